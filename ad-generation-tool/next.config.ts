@@ -29,6 +29,11 @@ const nextConfig: NextConfig = {
         source: '/api/:path*',
         destination: process.env.BACKEND_URL + '/:path*',
       },
+      // Generated audio URLs are backend-relative (/audio/<file>.wav), so serve them from the backend too
+      {
+        source: '/audio/:path*',
+        destination: process.env.BACKEND_URL + '/audio/:path*',
+      },
     ];
   },
 };
@@ -7,9 +7,9 @@ import ErrorMessage from '@/components/ErrorMessage';
 import LoadingSpinner from '@/components/LoadingSpinner';
 import ProgressSteps from '@/components/ProgressSteps';
 import BackButton from '@/components/BackButton';
-import { Script, RefineScriptResponse, GenerateAudioResponse, ValidationMetadata } from '@/types';
+import { Script, RefineScriptResponse, AudioJobStatus, ValidationMetadata } from '@/types';
 import api from '@/services/api';
-import { SCRIPT_STORAGE_KEY, SCRIPT_DATA_STORAGE_KEY, SCRIPT_VERSIONS_KEY, AUDIO_VERSIONS_KEY, VALIDATION_DATA_KEY, FORM_DATA_STORAGE_KEY, getItem, setItem, removeItem, safeJsonParse } from '@/services/storage';
+import { SCRIPT_STORAGE_KEY, SCRIPT_DATA_STORAGE_KEY, SCRIPT_VERSIONS_KEY, AUDIO_VERSIONS_KEY, VALIDATION_DATA_KEY, FORM_DATA_STORAGE_KEY, SCRIPT_ID_KEY, getItem, setItem, removeItem, safeJsonParse } from '@/services/storage';
 
 /**
  * Radio Ad Script Generation & Refinement Tool
@@ -152,6 +152,7 @@ const ValidationFeedback: React.FC<ValidationFeedbackProps> = ({ validation, sel
 const ResultsPage: React.FC = () => {
   const router = useRouter();
   const [script, setScript] = useState<Script[]>([]);
+  const [scriptId, setScriptId] = useState<string | null>(null);
   const [selectedLines, setSelectedLines] = useState<number[]>([]);
   const [improvementInstruction, setImprovementInstruction] = useState('');
   const [isRefining, setIsRefining] = useState(false);
@@ -254,6 +255,7 @@ const ResultsPage: React.FC = () => {
         }
         
         setScript(parsedScript);
+        setScriptId(await getItem(SCRIPT_ID_KEY));
         
         // Load script version history if available
         const savedVersions = await getItem(SCRIPT_VERSIONS_KEY);
@@ -382,6 +384,7 @@ const ResultsPage: React.FC = () => {
         // STEP 2: CALL API WITH VALIDATION SAFEGUARDS
         // The refineScriptWithValidation function includes both backend and frontend validation
         const result = await api.refineScriptWithValidation({
+          script_id: scriptId || undefined,
           selected_sentences: selectedLines,       // Only these sentences should be modified
           improvement_instruction: improvementInstruction,
           current_script: currentScript,
@@ -491,65 +494,51 @@ const ResultsPage: React.FC = () => {
     setAudioError(null);
     setGenerationProgress(0);
 
-    const progressInterval = setInterval(() => {
-      setGenerationProgress((prev) => Math.min(prev + 10, 90));
-    }, 1000);
-
     try {
-      const response = await axios.post<Object>('/api/generate_audio', {});
-      
-      let isProcessing = true;
-      
-      // Poll the status endpoint every 10 seconds
-      const pollInterval = setInterval(async () => {
-        try {
-          const statusResponse = await axios.get<GenerateAudioResponse>(`/api/audio_status`);
-          
-          // If we have a non-empty result, clear the interval and update the audio URL
-          if (statusResponse.data && Object.keys(statusResponse.data).length > 0 && statusResponse.data.audioUrl) {
-            clearInterval(pollInterval);
-            isProcessing = false;
-            setAudioUrl(statusResponse.data.audioUrl);
-            
-            // Save the audio version
-            saveAudioVersion(
-              statusResponse.data.audioUrl, 
-              `Generated with ${availableVoices.find(v => v.id === voiceId)?.name || 'Custom voice'}, speed: ${speed.toFixed(1)}, pitch: ${pitch.toFixed(1)}`
-            );
-            
-            setGenerationProgress(100);
+      const response = await axios.post<AudioJobStatus>('/api/audio_jobs', { script, script_id: scriptId });
+      const jobId = response.data.job_id;
+
+      // One held connection: the backend pushes progress after every synthesized line, then the result
+      const result = await new Promise<AudioJobStatus>((resolve, reject) => {
+        const events = new EventSource(`/api/audio_jobs/${jobId}/events`);
+        events.addEventListener('progress', (event) => {
+          const status: AudioJobStatus = JSON.parse((event as MessageEvent).data);
+          if (status.lines_total > 0) {
+            setGenerationProgress(Math.min(95, Math.round((status.lines_done / status.lines_total) * 100)));
           }
-        } catch (error) {
-          console.error('Error checking audio status:', error);
-          clearInterval(pollInterval);
-          isProcessing = false;
-          setAudioError('Failed to retrieve audio status. Please try again.');
-          setAudioRetryCount((prev) => prev + 1);
-        }
-      }, 10000); // Poll every 10 seconds
-      
-      // Clean up the interval if component unmounts
-      return () => {
-        if (isProcessing) {
-          clearInterval(pollInterval);
-        }
-      };
-      // setAudioUrl(response.data.audioUrl);
-      
-      // // Save the audio version
-      // saveAudioVersion(
-      //   response.data.audioUrl, 
-      //   `Generated with ${availableVoices.find(v => v.id === voiceId)?.name || 'Custom voice'}, speed: ${speed.toFixed(1)}, pitch: ${pitch.toFixed(1)}`
-      // );
-      
-      // setGenerationProgress(100);
+        });
+        events.addEventListener('complete', (event) => {
+          events.close();
+          resolve(JSON.parse((event as MessageEvent).data));
+        });
+        events.addEventListener('error', (event) => {
+          // Either an error event from the backend, or the connection dropping for good
+          const data = (event as MessageEvent).data;
+          if (data) {
+            events.close();
+            reject(new Error(JSON.parse(data).error || 'Audio generation failed'));
+          } else if (events.readyState === EventSource.CLOSED) {
+            reject(new Error('Lost connection to the audio job'));
+          }
+        });
+      });
+
+      if (result.audioUrl) {
+        setAudioUrl(result.audioUrl);
+
+        // Save the audio version
+        saveAudioVersion(
+          result.audioUrl, 
+          `Generated with ${availableVoices.find(v => v.id === voiceId)?.name || 'Custom voice'}, speed: ${speed.toFixed(1)}, pitch: ${pitch.toFixed(1)}`
+        );
+      }
+      setGenerationProgress(100);
     } catch (error) {
       console.error('Error generating audio:', error);
       setAudioError('Failed to generate audio. Please try again.');
       setAudioRetryCount((prev) => prev + 1);
     } finally {
       setIsGeneratingAudio(false);
-      clearInterval(progressInterval);
     }
   };
 
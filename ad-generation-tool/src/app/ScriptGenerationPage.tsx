@@ -9,7 +9,7 @@ import ProgressSteps from '@/components/ProgressSteps';
 import Tooltip from '@/components/Tooltip';
 import { Script } from '@/types';
 import api from '@/services/api';
-import { FORM_DATA_STORAGE_KEY, SCRIPT_STORAGE_KEY, SCRIPT_DATA_STORAGE_KEY, getItem, setItem, removeItem, safeJsonParse } from '@/services/storage';
+import { FORM_DATA_STORAGE_KEY, SCRIPT_STORAGE_KEY, SCRIPT_DATA_STORAGE_KEY, SCRIPT_ID_KEY, getItem, setItem, removeItem, safeJsonParse } from '@/services/storage';
 import isEqual from 'lodash/isEqual';
 
 const initialFormData = {
@@ -248,7 +248,7 @@ const ScriptGenerationPage: React.FC = () => {
       };
       console.log('[DEBUG-UI] Form data being sent:', formDataForDebug);
       
-      const script = await api.generateScript(formDataForDebug);
+      const { script, scriptId } = await api.generateScript(formDataForDebug);
       
       console.log('[DEBUG-UI] Script generation completed successfully');
       console.log('[DEBUG-UI] Script received:', script);
@@ -262,6 +262,12 @@ const ScriptGenerationPage: React.FC = () => {
           
           // Store the generated script
           await setItem(SCRIPT_STORAGE_KEY, scriptToStore);
+          // Refinements and audio for this script are sent with its id, so the backend can version it
+          if (scriptId) {
+            await setItem(SCRIPT_ID_KEY, scriptId);
+          } else {
+            await removeItem(SCRIPT_ID_KEY);
+          }
           console.log('[DEBUG-UI] Script saved to storage, navigating to results page');
           router.push('/results');
         } catch (storageError) {
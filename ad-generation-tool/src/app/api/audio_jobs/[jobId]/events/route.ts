@@ -0,0 +1,44 @@
+import { NextResponse } from 'next/server';
+import { forwardedClientHeaders } from '@/services/backendProxy';
+
+// The response is a live event stream; never cache or pre-render it
+export const dynamic = 'force-dynamic';
+
+export async function GET(req: Request, { params }: { params: Promise<{ jobId: string }> }) {
+  const { jobId } = await params;
+  try {
+    // Determine the backend URL based on environment
+    const isVercel = process.env.VERCEL === '1';
+    const backendUrl = isVercel 
+      ? (process.env.NEXT_PUBLIC_VERCEL_API_URL || 'http://172.206.3.68:8000')
+      : (process.env.BACKEND_URL || 'http://localhost:8001');
+    
+    // Pass Last-Event-ID through so a reconnecting EventSource resumes where it left off
+    const lastEventId = req.headers.get('last-event-id');
+    const response = await fetch(`${backendUrl}/audio_jobs/${encodeURIComponent(jobId)}/events`, {
+      headers: {
+        ...forwardedClientHeaders(req),
+        ...(lastEventId ? { 'Last-Event-ID': lastEventId } : {})
+      },
+      signal: req.signal,
+      cache: 'no-store'
+    });
+    
+    if (!response.ok || !response.body) {
+      return NextResponse.json({ error: `Backend API error: ${response.status}` }, { status: response.status });
+    }
+    
+    // Relay the backend's server-sent events as they arrive
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache, no-transform',
+        'Connection': 'keep-alive'
+      }
+    });
+    
+  } catch (error) {
+    console.error('Error streaming audio job events:', error);
+    return NextResponse.json({ error: 'Failed to stream audio job events' }, { status: 500 });
+  }
+}
@@ -0,0 +1,56 @@
+import { NextResponse } from 'next/server';
+import { forwardedClientHeaders, rateLimitedResponse } from '@/services/backendProxy';
+
+export async function POST(req: Request) {
+  try {
+    const body = await req.json();
+    const { script, script_id } = body;
+    
+    // Determine the backend URL based on environment
+    const isVercel = process.env.VERCEL === '1';
+    const backendUrl = isVercel 
+      ? (process.env.NEXT_PUBLIC_VERCEL_API_URL || 'http://172.206.3.68:8000')
+      : (process.env.BACKEND_URL || 'http://localhost:8001');
+    
+    console.log(`Starting audio job at ${backendUrl} (Vercel: ${isVercel})`);
+    
+    // Start the job; the backend answers at once with its id
+    const response = await fetch(`${backendUrl}/audio_jobs`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...forwardedClientHeaders(req)
+      },
+      body: JSON.stringify({ script, script_id })
+    });
+    
+    const limited = await rateLimitedResponse(response);
+    if (limited) {
+      return limited;
+    }
+    
+    if (!response.ok) {
+      let errorData;
+      try {
+        errorData = await response.json();
+      } catch (e) {
+        errorData = { detail: await response.text() };
+      }
+      throw new Error(`Backend API error: ${response.status} ${errorData.detail || response.statusText}`);
+    }
+    
+    const data = await response.json();
+    return NextResponse.json(data, { status: 202 });
+    
+  } catch (error) {
+    console.error('Error starting audio job:', error);
+    
+    let errorMessage = 'Failed to start audio generation';
+    
+    if (error instanceof Error) {
+      errorMessage = error.message;
+    }
+    
+    return NextResponse.json({ error: errorMessage }, { status: 500 });
+  }
+}
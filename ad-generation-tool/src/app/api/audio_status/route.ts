@@ -1,4 +1,5 @@
 import { NextResponse } from 'next/server';
+import { forwardedClientHeaders, rateLimitedResponse } from '@/services/backendProxy';
 
 export async function GET(req: Request) {
   try {
@@ -10,14 +11,22 @@ export async function GET(req: Request) {
     
     console.log(`Checking audio status at ${backendUrl} (Vercel: ${isVercel})`);
     
-    // Get the audio status from our FastAPI backend
-    const response = await fetch(`${backendUrl}/audio_status`, {
+    // Get the audio status from our FastAPI backend, for the stored script if the client names one
+    const scriptId = new URL(req.url).searchParams.get('script_id');
+    const query = scriptId ? `?script_id=${encodeURIComponent(scriptId)}` : '';
+    const response = await fetch(`${backendUrl}/audio_status${query}`, {
       method: 'GET',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...forwardedClientHeaders(req)
       }
     });
     
+    const limited = await rateLimitedResponse(response);
+    if (limited) {
+      return limited;
+    }
+    
     if (!response.ok) {
       let errorData;
       try {
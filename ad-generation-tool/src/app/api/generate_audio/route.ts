@@ -1,10 +1,11 @@
 import { NextResponse } from 'next/server';
+import { forwardedClientHeaders, rateLimitedResponse } from '@/services/backendProxy';
 import { Script } from '@/types';
 
 export async function POST(req: Request) {
   try {
     const body = await req.json();
-    const { speed, pitch, script, voiceId } = body;
+    const { speed, pitch, script, voiceId, script_id } = body;
     
     // Determine the backend URL based on environment
     const isVercel = process.env.VERCEL === '1';
@@ -18,16 +19,23 @@ export async function POST(req: Request) {
     const response = await fetch(`${backendUrl}/generate_audio`, {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...forwardedClientHeaders(req)
       },
       body: JSON.stringify({
         script,
         speed: speed || 1.0,
         pitch: pitch || 1.0,
-        voiceId
+        voiceId,
+        script_id
       })
     });
     
+    const limited = await rateLimitedResponse(response);
+    if (limited) {
+      return limited;
+    }
+    
     if (!response.ok) {
       let errorData;
       try {
@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { forwardedClientHeaders, rateLimitedResponse } from '@/services/backendProxy';
 
 export async function POST(request: NextRequest) {
   try {
@@ -23,6 +24,9 @@ export async function POST(request: NextRequest) {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          // Same budget as the abort below, so the backend stops working for us once we have given up
+          'X-Request-Timeout': '60',
+          ...forwardedClientHeaders(request),
         },
         body: JSON.stringify(body),
         signal: controller.signal
@@ -30,6 +34,11 @@ export async function POST(request: NextRequest) {
       
       clearTimeout(timeoutId);
       
+      const limited = await rateLimitedResponse(response);
+      if (limited) {
+        return limited;
+      }
+      
       if (!response.ok) {
         console.error('Backend returned error status:', response.status);
         let errorText = '';
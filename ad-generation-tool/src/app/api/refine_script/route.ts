@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { forwardedClientHeaders, rateLimitedResponse } from '@/services/backendProxy';
 
 export async function POST(request: NextRequest) {
   try {
@@ -49,6 +50,9 @@ export async function POST(request: NextRequest) {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          // Same budget as the abort below, so the backend stops working for us once we have given up
+          'X-Request-Timeout': '60',
+          ...forwardedClientHeaders(request),
         },
         body: JSON.stringify(body),
         signal: controller.signal
@@ -56,6 +60,11 @@ export async function POST(request: NextRequest) {
       
       clearTimeout(timeoutId);
       
+      const limited = await rateLimitedResponse(response);
+      if (limited) {
+        return limited;
+      }
+      
       if (!response.ok) {
         console.error('Backend returned error status:', response.status);
         let errorText = '';
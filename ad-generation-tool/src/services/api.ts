@@ -94,6 +94,7 @@ export interface GenerateScriptRequest {
 }
 
 export interface RefineScriptRequest {
+  script_id?: string;  // Stored script being refined: the refinement becomes its next version
   selected_sentences: number[];
   improvement_instruction: string;
   current_script: [string, string][];
@@ -102,6 +103,11 @@ export interface RefineScriptRequest {
   ad_length: number;
 }
 
+export interface GeneratedScript {
+  script: Script[];
+  scriptId: string | null;  // null if the backend could not store the script
+}
+
 export interface RefineScriptResult {
   script: Script[];
   validation?: ValidationMetadata;
@@ -124,7 +130,7 @@ const api = {
     }
   },
 
-  generateScript: async (data: Omit<GenerateScriptRequest, 'ad_length'> & { ad_length: string }): Promise<Script[]> => {
+  generateScript: async (data: Omit<GenerateScriptRequest, 'ad_length'> & { ad_length: string }): Promise<GeneratedScript> => {
     try {
       console.log('[DEBUG] generateScript called with data:', data);
       
@@ -177,7 +183,10 @@ const api = {
       }
       
       console.log('[DEBUG] Final processed script:', scripts);
-      return scripts;
+      return {
+        script: scripts,
+        scriptId: response.data.metadata?.script_version?.script_id ?? null
+      };
     } catch (error) {
       console.error('[DEBUG] Error in generateScript:', error);
       
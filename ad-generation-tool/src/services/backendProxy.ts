@@ -0,0 +1,34 @@
+import { NextResponse } from 'next/server';
+
+// Headers that let the backend rate limit the end client instead of this proxy. The client address
+// comes from the platform's edge (Vercel, or the reverse proxy in front of Next). The backend only
+// honours it from a trusted proxy, so outside loopback set BACKEND_PROXY_SECRET to its ADGEN_PROXY_SECRET.
+export function forwardedClientHeaders(req: Request): Record<string, string> {
+  const headers: Record<string, string> = {};
+  const clientIp = req.headers.get('x-real-ip') || req.headers.get('x-forwarded-for')?.split(',')[0].trim();
+  if (clientIp) {
+    headers['X-Real-IP'] = clientIp;
+  }
+  if (process.env.BACKEND_PROXY_SECRET) {
+    headers['X-Proxy-Secret'] = process.env.BACKEND_PROXY_SECRET;
+  }
+  return headers;
+}
+
+// A backend 429, passed through with its Retry-After so the client backs off instead of seeing a 500
+export async function rateLimitedResponse(response: Response): Promise<NextResponse | null> {
+  if (response.status !== 429) {
+    return null;
+  }
+  let errorData;
+  try {
+    errorData = await response.json();
+  } catch (e) {
+    errorData = { detail: 'Too many requests' };
+  }
+  const retryAfter = response.headers.get('Retry-After');
+  return NextResponse.json(errorData, {
+    status: 429,
+    headers: retryAfter ? { 'Retry-After': retryAfter } : {}
+  });
+}
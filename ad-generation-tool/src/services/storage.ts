@@ -7,6 +7,7 @@ export const SCRIPT_DATA_STORAGE_KEY = 'scriptData';
 export const SCRIPT_VERSIONS_KEY = 'scriptVersionHistory';
 export const AUDIO_VERSIONS_KEY = 'audioVersionHistory';
 export const VALIDATION_DATA_KEY = 'validationData';
+export const SCRIPT_ID_KEY = 'scriptId';
 
 // Helper to determine if we're running in a browser environment
 export const isBrowser = typeof window !== 'undefined';
@@ -3,9 +3,19 @@ export interface Script {
   artDirection: string;
 }
 
+// Where the backend stored a script; refinements and audio for it are sent with its script_id
+export interface ScriptVersionInfo {
+  script_id: string;
+  version: number;
+  content_hash: string;
+}
+
 export interface GenerateScriptResponse {
   success: boolean;
   script: Script[];
+  metadata?: {
+    script_version?: ScriptVersionInfo | null;
+  };
 }
 
 export interface ValidationMetadata {
@@ -33,6 +43,17 @@ export interface GenerateAudioResponse {
   audioUrl: string;
 }
 
+export interface AudioJobStatus {
+  job_id: string;
+  status: 'queued' | 'running' | 'succeeded' | 'failed' | 'cancelled';
+  version: number;
+  lines_done: number;
+  lines_total: number;
+  eta_seconds: number | null;
+  audioUrl: string | null;
+  error: string | null;
+}
+
 export interface ApiError {
   error: string;
 }
\ No newline at end of file
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Audio Pipeline Benchmark
+
+Measures end-to-end /generate_audio throughput and memory of the audio pipeline around
+the TTS model: per-line synthesis plumbing, post-processing, streaming wav writing and serving. The
+backend runs under uvicorn with the synthetic TTS backend (ADGEN_TTS_BACKEND=synthetic),
+so no model weights are needed and results only reflect the surrounding pipeline plus the
+configured synthetic per-character latency.
+
+Reports throughput, latency percentiles, the RSS of the server process, and the mean time
+per audio stage scraped from /metrics. With --quality preview, requests ask for drafts, each of
+which also queues its final render in the background (see ADGEN_SYNTHETIC_TTS_PREVIEW_COST).
+
+Usage (from the backend directory, Linux only because RSS is read from /proc):
+    python -m benchmarks.audio_pipeline_benchmark --requests 20 --concurrency 2 --lines 8
+    python -m benchmarks.audio_pipeline_benchmark --seconds-per-char 0.002 --sample-rate 24000 --json
+    python -m benchmarks.audio_pipeline_benchmark --seconds-per-char 0.005 --quality preview
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from benchmarks.load_test import BACKEND_DIR, RSSSampler, free_port, percentile
+
+STAGE_SUM_PATTERN = re.compile(r'adgen_stage_duration_seconds_(sum|count)\{pipeline="audio",stage="([^"]+)"\} (\S+)')
+
+
+def make_script(lines: int, words_per_line: int) -> list:
+    words = "fresh coffee every morning delivered to your door with a smile".split()
+    return [
+        {
+            "line": " ".join(words[(i + j) % len(words)] for j in range(words_per_line)) + ".",
+            "artDirection": f"A warm, friendly voice for line {i}, with minimal noise.",
+        }
+        for i in range(lines)
+    ]
+
+
+def start_backend(port: int, args, work_dir: str, log_path: Path) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "ADGEN_TTS_BACKEND": "synthetic",
+        "ADGEN_SYNTHETIC_TTS_SECONDS_PER_CHAR": str(args.seconds_per_char),
+        "ADGEN_SYNTHETIC_TTS_SAMPLE_RATE": str(args.sample_rate),
+        "ADGEN_AUDIO_RESULT_PATH": os.path.join(work_dir, "full_script_audio.wav"),
+        "ADGEN_LOG_MODE": os.environ.get("ADGEN_LOG_MODE", "production"),
+        "ADGEN_LOG_LEVEL": os.environ.get("ADGEN_LOG_LEVEL", "WARNING"),
+        # All benchmark traffic comes from one address; measure the pipeline, not the per-client limit
+        "ADGEN_RATE_LIMIT_PER_MINUTE": os.environ.get("ADGEN_RATE_LIMIT_PER_MINUTE", "0"),
+    }
+    log_file = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=str(BACKEND_DIR),
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited during startup, see {log_path}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/test_connection", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"Backend did not start within 60 seconds, see {log_path}")
+
+
+def scrape_audio_stages(base_url: str) -> dict:
+    sums, counts = {}, {}
+    for kind, stage_name, value in STAGE_SUM_PATTERN.findall(requests.get(f"{base_url}/metrics", timeout=10).text):
+        (sums if kind == "sum" else counts)[stage_name] = float(value)
+    return {
+        stage_name: {"count": int(counts[stage_name]), "mean_ms": round(1000 * sums[stage_name] / counts[stage_name], 3)}
+        for stage_name in sums
+        if counts.get(stage_name)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /generate_audio with the synthetic TTS backend")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--lines", type=int, default=8, help="Script lines per request")
+    parser.add_argument("--words-per-line", type=int, default=10)
+    parser.add_argument("--seconds-per-char", type=float, default=0.0, help="Synthetic per-character latency")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--quality", choices=["final", "preview"], default="final")
+    parser.add_argument("--fetch-audio", action="store_true", help="Also download the merged file after each request")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    script = make_script(args.lines, args.words_per_line)
+    with tempfile.TemporaryDirectory(prefix="adgen-audio-bench-") as work_dir:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        backend = start_backend(port, args, work_dir, BACKEND_DIR / "benchmarks" / "audio_benchmark_server.log")
+        sampler = RSSSampler(backend.pid)
+        sampler.start()
+
+        def send(_) -> dict:
+            started = time.perf_counter()
+            response = requests.post(f"{base_url}/generate_audio", json={"script": script, "quality": args.quality}, timeout=600)
+            if response.ok and args.fetch_audio:
+                requests.get(f"{base_url}{response.json()['audioUrl']}", timeout=60).raise_for_status()
+            return {"status": response.status_code, "latency": time.perf_counter() - started}
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(send, range(args.requests)))
+            elapsed = time.perf_counter() - started
+            stages = scrape_audio_stages(base_url)
+        finally:
+            sampler.stop()
+            backend.terminate()
+            backend.wait(timeout=30)
+
+    latencies = [r["latency"] for r in results if r["status"] == 200]
+    mib = 1024 * 1024
+    summary = {
+        "config": {key: value for key, value in vars(args).items() if key != "json"},
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 3),
+        "lines_per_second": round(len(latencies) * args.lines / elapsed, 2),
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "error_rate": round(1 - len(latencies) / len(results), 4),
+        "server_rss_mib": {
+            "peak": round(max(sampler.samples) / mib, 1) if sampler.samples else 0,
+            "mean": round(sum(sampler.samples) / len(sampler.samples) / mib, 1) if sampler.samples else 0,
+        },
+        "stages": stages,
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"Config: {json.dumps(summary['config'])}")
+    print(
+        f"{summary['throughput_rps']} req/s, {summary['lines_per_second']} lines/s, "
+        f"p50 {summary['p50_s']}s, p95 {summary['p95_s']}s, p99 {summary['p99_s']}s, errors {summary['error_rate']}"
+    )
+    print(f"Server RSS peak {summary['server_rss_mib']['peak']} MiB, mean {summary['server_rss_mib']['mean']} MiB")
+    for stage_name, stats in sorted(stages.items()):
+        print(f"  {stage_name:>16}: {stats['count']:>6} x {stats['mean_ms']:>10} ms")
+
+
+if __name__ == "__main__":
+    main()
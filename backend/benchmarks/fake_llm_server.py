@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+Fake OpenAI-compatible LLM server for offline benchmarks.
+
+Implements just enough of the OpenAI API (POST /v1/chat/completions, GET /v1/models) for the
+crews to run against it without network access or API quota. Responses follow the
+"Thought: ... Final Answer: ..." format the crew agents expect and contain a script as a
+list of tuples:
+
+- generation prompts get a canned script,
+- refinement prompts get the marked script echoed back, with the selected lines rewritten,
+- a configurable fraction of responses is malformed, to exercise the parsing fallbacks.
+
+Latency is a fixed base latency plus the completion length at a configurable token rate,
+so runs are reproducible for a given --seed.
+
+Usage (from the backend directory):
+    python -m benchmarks.fake_llm_server --port 8900 --latency 0.5 --tokens-per-second 80
+Then point the crews at it with OPENAI_API_BASE=http://127.0.0.1:8900/v1 and any OPENAI_API_KEY.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+
+CANNED_SCRIPT = [
+    ("Mornings are HARD... but they don't have to be.", "Warm, empathetic voice, slight sigh at the start."),
+    ("Meet Sunrise Roast, coffee roasted FRESH every single day.", "Upbeat and confident, emphasize FRESH."),
+    ("Fair trade beans, delivered to your door before you wake up.", "Friendly and reassuring, steady pace."),
+    ("One sip... and you're ready for anything.", "Slow down on the pause, then energetic."),
+    ("Sunrise Roast. Wake up to something better.", "Bright, memorable tagline delivery."),
+]
+
+MALFORMED_OUTPUTS = [
+    # Prose instead of a list of tuples
+    "Here is your refined script. The first line is great and the second line is even better.",
+    # Truncated list
+    '[("Mornings are HARD... but", "Warm voice"), ("Meet Sunrise',
+    # Wrong shape: single strings instead of tuples
+    '["Mornings are HARD.", "Meet Sunrise Roast."]',
+]
+
+# Marked lines as they appear in the interpolated refinement prompt, in either prompt mode
+MARKED_LINE_PATTERN = re.compile(
+    r"\[\[(SELECTED FOR MODIFICATION|PRESERVE|EDIT|KEEP):?\s*(\d+)\]\]\s?(.*?)(?:\s?\[\[END (?:SELECTED|PRESERVE)\]\])?['\"],\s*['\"](.*?)['\"]\]"
+)
+
+
+class FakeLLMConfig:
+    def __init__(self, latency: float = 0.5, tokens_per_second: float = 80.0, malformed_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests_served = 0
+
+
+def _strip_marker(text: str) -> str:
+    return re.sub(r"\[\[(?:SELECTED FOR MODIFICATION|PRESERVE|EDIT|KEEP):?\s*\d+\]\]\s?|\s?\[\[END (?:SELECTED|PRESERVE)\]\]", "", text)
+
+
+def build_script_answer(prompt: str) -> List[Tuple[str, str]]:
+    """Echo a refinement prompt's marked script with the selected lines rewritten, or return the canned script."""
+    marked_lines = MARKED_LINE_PATTERN.findall(prompt)
+    if not marked_lines:
+        return CANNED_SCRIPT
+    script = {}
+    for marker, index, line, art_direction in marked_lines:
+        index = int(index)
+        if index in script:
+            continue
+        line, art_direction = _strip_marker(line), _strip_marker(art_direction)
+        if marker in ("SELECTED FOR MODIFICATION", "EDIT"):
+            line = f"{line.rstrip('.!')}... NOW even better!"
+            art_direction = f"{art_direction} More energy."
+        script[index] = (line, art_direction)
+    return [script[index] for index in sorted(script)]
+
+
+def build_completion_text(prompt: str, config: FakeLLMConfig) -> str:
+    with config.lock:
+        malformed = config.random.random() < config.malformed_rate
+        malformed_output = config.random.choice(MALFORMED_OUTPUTS)
+    answer = malformed_output if malformed else repr(build_script_answer(prompt))
+    return f"Thought: I now can give a great answer\nFinal Answer: {answer}"
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    config: FakeLLMConfig = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "benchmark"}]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        completion = build_completion_text(prompt, self.config)
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(completion)
+        with self.config.lock:
+            self.config.requests_served += 1
+
+        time.sleep(self.config.latency)
+        if request.get("stream"):
+            self._stream_completion(request, completion, prompt_tokens, completion_tokens)
+            return
+        time.sleep(completion_tokens / self.config.tokens_per_second)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake-model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": completion}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def _stream_completion(self, request: dict, completion: str, prompt_tokens: int, completion_tokens: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        delay = CHARS_PER_TOKEN / self.config.tokens_per_second
+        for start in range(0, len(completion), CHARS_PER_TOKEN):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake-model"),
+                "choices": [{"index": 0, "delta": {"content": completion[start:start + CHARS_PER_TOKEN]}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(delay)
+        final_chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "fake-model"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+        self.wfile.write(f"data: {json.dumps(final_chunk)}\n\ndata: [DONE]\n\n".encode())
+        self.close_connection = True
+
+
+def start_fake_llm_server(port: int = 0, config: Optional[FakeLLMConfig] = None) -> ThreadingHTTPServer:
+    """Start the fake server on a background thread and return it; server.server_address has the bound port."""
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {"config": config or FakeLLMConfig()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible LLM server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5, help="Base latency per request in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Completion token rate")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of malformed responses (0-1)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(args.latency, args.tokens_per_second, args.malformed_rate, args.seed)
+    server = start_fake_llm_server(args.port, config)
+    print(f"Fake LLM server listening on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""
+Load Test for the Script Endpoints
+
+Starts the fake OpenAI-compatible LLM server (benchmarks/fake_llm_server.py) and the backend
+under uvicorn, then drives /generate_script and/or /regenerate_script at a fixed concurrency.
+Nothing leaves the machine: the crews talk to the local stub through OPENAI_API_BASE.
+
+Before the load, one /generate_script request must succeed end to end, and a run in which every
+request fails is reported as a failure rather than as a result.
+
+Reports throughput, p50/p95/p99 latency, error rate by status code and the resident memory
+of the server process tree (the API process plus its crew subprocesses), sampled while the
+test runs. Runs are reproducible for a given --seed.
+
+Usage (from the backend directory, Linux only because RSS is read from /proc):
+    python -m benchmarks.load_test --endpoint mixed --requests 40 --concurrency 4
+    python -m benchmarks.load_test --llm-latency 2 --malformed-rate 0.1 --json
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import requests
+
+from benchmarks.fake_llm_server import FakeLLMConfig, start_fake_llm_server
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+PRODUCTS = [
+    ("Sunrise Roast", "Busy professionals", "freshly roasted, fair trade, delivered daily"),
+    ("GreenGlow Cleaner", "Environmentally conscious families", "non-toxic, plant based, refillable"),
+    ("PeakFit Tracker", "Amateur runners", "week-long battery, GPS, heart rate zones"),
+    ("CloudDesk", "Small business owners", "simple invoicing, bank sync, mobile app"),
+]
+
+BASE_SCRIPT = [
+    ["Mornings are HARD... but they don't have to be.", "Warm, empathetic voice."],
+    ["Meet Sunrise Roast, coffee roasted FRESH every day.", "Upbeat and confident."],
+    ["Fair trade beans, delivered before you wake up.", "Friendly, steady pace."],
+    ["Sunrise Roast. Wake up to something better.", "Bright tagline delivery."],
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss_bytes(root_pid: int) -> int:
+    """Sum the resident set size of a process and all of its descendants, read from /proc."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                # The command name may contain spaces, so split after its closing parenthesis
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError):
+            continue
+
+    total, pending = 0, [root_pid]
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as statm_file:
+                total += int(statm_file.read().split()[1]) * page_size
+        except OSError:
+            continue
+        pending.extend(children.get(pid, []))
+    return total
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(process_tree_rss_bytes(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def make_payload(endpoint: str, rng: random.Random) -> dict:
+    product_name, audience, selling_points = rng.choice(PRODUCTS)
+    if endpoint == "/generate_script":
+        return {
+            "product_name": product_name,
+            "target_audience": audience,
+            "key_selling_points": selling_points,
+            "tone": rng.choice(["Fun", "Professional", "Urgent"]),
+            "ad_length": rng.choice([15, 30, 60]),
+            "speaker_voice": rng.choice(["Male", "Female", "Either"]),
+        }
+    return {
+        "selected_sentences": sorted(rng.sample(range(len(BASE_SCRIPT)), rng.randint(1, 2))),
+        "improvement_instruction": rng.choice(["Make it punchier", "Add a pun about mornings", "Sound more urgent"]),
+        "current_script": BASE_SCRIPT,
+        "key_selling_points": selling_points,
+        "tone": "Fun",
+        "ad_length": 30,
+    }
+
+
+def start_backend(port: int, llm_base_url: str, log_path: Path) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OPENAI_API_BASE": llm_base_url,
+        "OPENAI_BASE_URL": llm_base_url,
+        "OPENAI_API_KEY": "sk-fake-benchmark-key",
+        "OPENAI_MODEL_NAME": os.environ.get("OPENAI_MODEL_NAME", "gpt-4o-mini"),
+        "CREWAI_DISABLE_TELEMETRY": "true",
+        "OTEL_SDK_DISABLED": "true",
+        "ADGEN_LOG_MODE": os.environ.get("ADGEN_LOG_MODE", "production"),
+        "ADGEN_LOG_LEVEL": os.environ.get("ADGEN_LOG_LEVEL", "WARNING"),
+        # All benchmark traffic comes from one address; measure the pipeline, not the per-client limit
+        "ADGEN_RATE_LIMIT_PER_MINUTE": os.environ.get("ADGEN_RATE_LIMIT_PER_MINUTE", "0"),
+    }
+    log_file = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=str(BACKEND_DIR),
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited during startup, see {log_path}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/test_connection", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.25)
+    else:
+        process.terminate()
+        raise RuntimeError(f"Backend did not start within 60 seconds, see {log_path}")
+    try:
+        preflight(f"http://127.0.0.1:{port}", timeout=120)
+    except RuntimeError as e:
+        process.terminate()
+        raise RuntimeError(f"{e}, see {log_path}")
+    return process
+
+
+def preflight(base_url: str, timeout: float):
+    """
+    Run one script generation end to end before the load starts. The backend answers /test_connection
+    even when the crews cannot run (e.g. a dependency missing from their environment), and a run in
+    which every request fails is not a measurement.
+    """
+    payload = {
+        "product_name": "Preflight Check",
+        "target_audience": "Benchmark operators",
+        "key_selling_points": "verifies the crews run before the load starts",
+        "tone": "Professional",
+        "ad_length": 15,
+        "speaker_voice": "Either",
+    }
+    try:
+        response = requests.post(f"{base_url}/generate_script", json=payload, timeout=timeout)
+    except requests.RequestException as e:
+        raise RuntimeError(f"Preflight /generate_script failed: {e}")
+    if response.status_code != 200:
+        raise RuntimeError(f"Preflight /generate_script returned {response.status_code}: {response.text[:500]}")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def run_load(base_url: str, endpoints: List[str], total_requests: int, concurrency: int, timeout: float, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    # Build the whole request plan up front so it does not depend on thread scheduling
+    plan = [(endpoints[i % len(endpoints)], make_payload(endpoints[i % len(endpoints)], rng)) for i in range(total_requests)]
+    local = threading.local()
+
+    def send(item) -> dict:
+        endpoint, payload = item
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = local.session.post(f"{base_url}{endpoint}", json=payload, timeout=timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return {"endpoint": endpoint, "status": status, "latency": time.perf_counter() - started}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(send, plan))
+
+
+def summarize(results: List[dict], elapsed: float, rss_samples: List[int]) -> dict:
+    summary = {"elapsed_s": round(elapsed, 2), "endpoints": {}}
+    for endpoint in sorted({r["endpoint"] for r in results}) + ["all"]:
+        selected = [r for r in results if endpoint == "all" or r["endpoint"] == endpoint]
+        latencies = [r["latency"] for r in selected if r["status"] == 200]
+        errors = [r for r in selected if r["status"] != 200]
+        status_counts: Dict[str, int] = {}
+        for r in selected:
+            status_counts[str(r["status"])] = status_counts.get(str(r["status"]), 0) + 1
+        summary["endpoints"][endpoint] = {
+            "requests": len(selected),
+            "throughput_rps": round(len(selected) / elapsed, 3) if elapsed else 0,
+            "p50_s": round(percentile(latencies, 50), 3),
+            "p95_s": round(percentile(latencies, 95), 3),
+            "p99_s": round(percentile(latencies, 99), 3),
+            "mean_s": round(statistics.mean(latencies), 3) if latencies else 0,
+            "error_rate": round(len(errors) / len(selected), 4) if selected else 0,
+            "status_counts": status_counts,
+        }
+    mib = 1024 * 1024
+    summary["server_rss_mib"] = {
+        "peak": round(max(rss_samples) / mib, 1) if rss_samples else 0,
+        "mean": round(statistics.mean(rss_samples) / mib, 1) if rss_samples else 0,
+    }
+    return summary
+
+
+def print_summary(summary: dict, config: dict):
+    print(f"Config: {json.dumps(config)}")
+    print(f"Elapsed: {summary['elapsed_s']}s, server RSS peak {summary['server_rss_mib']['peak']} MiB, mean {summary['server_rss_mib']['mean']} MiB")
+    header = f"{'endpoint':>20} | {'reqs':>5} | {'rps':>7} | {'p50':>7} | {'p95':>7} | {'p99':>7} | {'errors':>7} | statuses"
+    print(header)
+    print("-" * len(header))
+    for endpoint, stats in summary["endpoints"].items():
+        print(
+            f"{endpoint:>20} | {stats['requests']:>5} | {stats['throughput_rps']:>7} | {stats['p50_s']:>7} | "
+            f"{stats['p95_s']:>7} | {stats['p99_s']:>7} | {stats['error_rate']:>7} | {stats['status_counts']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /generate_script and /regenerate_script against a fake LLM")
+    parser.add_argument("--endpoint", choices=["generate", "regenerate", "mixed"], default="mixed")
+    parser.add_argument("--requests", type=int, default=20, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake LLM base latency in seconds")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of malformed LLM outputs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend-url", help="Use an already running backend instead of starting one (RSS is then not sampled)")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    endpoints = {
+        "generate": ["/generate_script"],
+        "regenerate": ["/regenerate_script"],
+        "mixed": ["/generate_script", "/regenerate_script"],
+    }[args.endpoint]
+
+    llm_server = start_fake_llm_server(0, FakeLLMConfig(args.llm_latency, args.llm_tokens_per_second, args.malformed_rate, args.seed))
+    llm_base_url = f"http://127.0.0.1:{llm_server.server_address[1]}/v1"
+
+    backend = None
+    sampler = None
+    log_path = BACKEND_DIR / "benchmarks" / "load_test_server.log"
+    try:
+        if args.backend_url:
+            base_url = args.backend_url.rstrip("/")
+            preflight(base_url, args.timeout)
+        else:
+            port = free_port()
+            backend = start_backend(port, llm_base_url, log_path)
+            base_url = f"http://127.0.0.1:{port}"
+    except RuntimeError as e:
+        llm_server.shutdown()
+        sys.exit(str(e))
+    if backend:
+        sampler = RSSSampler(backend.pid)
+        sampler.start()
+
+    try:
+        started = time.perf_counter()
+        results = run_load(base_url, endpoints, args.requests, args.concurrency, args.timeout, args.seed)
+        elapsed = time.perf_counter() - started
+    finally:
+        if sampler:
+            sampler.stop()
+        if backend:
+            backend.terminate()
+            backend.wait(timeout=30)
+        llm_server.shutdown()
+
+    if not any(r["status"] == 200 for r in results):
+        statuses = sorted({str(r["status"]) for r in results})
+        sys.exit(f"Every request failed (statuses {', '.join(statuses)}); not reporting a result" + ("" if args.backend_url else f", see {log_path}"))
+
+    summary = summarize(results, elapsed, sampler.samples if sampler else [])
+    config = {key: value for key, value in vars(args).items() if key != "json"}
+    if args.json:
+        print(json.dumps({"config": config, **summary}, indent=2))
+    else:
+        print_summary(summary, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Parsing and Validation Regression Benchmark
+
+Times the hot paths that run on every crew response in the API process:
+
+- parse_script_output for each output format it accepts: JSON, Python literal, the regex
+  fallback and malformed output (which walks every fallback before raising),
+- process_marked_output for refinement responses where a given share of the non-selected
+  lines was changed by the model and has to be reverted.
+
+Each case runs at several script sizes. Results can be saved as a baseline and later runs
+compared against it; --check exits non-zero when a case got slower than the baseline by
+more than --threshold, or when time grows faster than --max-exponent with script size
+(e.g. 2.0 for quadratic), which catches accidental O(n^2) loops even without a baseline.
+
+Timings are normalized by a fixed pure-Python calibration workload, so baselines stay
+comparable across machines of different speed.
+
+Usage (from the backend directory):
+    python -m benchmarks.parsing_benchmark
+    python -m benchmarks.parsing_benchmark --save-baseline
+    python -m benchmarks.parsing_benchmark --check --threshold 1.5
+"""
+
+import argparse
+import gc
+import json
+import logging
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from utils.job_handlers.job_handlers import parse_script_output, process_marked_output
+
+DEFAULT_BASELINE_PATH = Path(__file__).parent / "baselines" / "parsing_benchmark.json"
+FORMATS = ["json", "literal", "regex", "malformed"]
+REVERT_RATIOS = [0.0, 0.5, 1.0]
+
+
+def make_script(size: int) -> List[Tuple[str, str]]:
+    return [
+        (
+            f"Line {i}: mornings are HARD... but Sunrise Roast makes them easy, fresh every day!",
+            f"Warm, upbeat voice for line {i}; slight pause after the ellipsis, emphasize HARD.",
+        )
+        for i in range(size)
+    ]
+
+
+def render_output(script: List[Tuple[str, str]], output_format: str) -> str:
+    """Render a script the way a crew might return it, so that parse_script_output takes the given path."""
+    if output_format == "json":
+        return json.dumps([list(pair) for pair in script])
+    if output_format == "literal":
+        # Single-quoted strings are not JSON, so this goes through ast.literal_eval
+        return repr(script)
+    if output_format == "regex":
+        # Valid tuples but a truncated list, so only the regex fallback can recover the lines
+        return "[" + ", ".join(f'("{line}", "{art}")' for line, art in script)
+    if output_format == "malformed":
+        return " ".join(f"{line} {art}" for line, art in script)
+    raise ValueError(f"Unknown output format '{output_format}'")
+
+
+def make_refine_case(size: int, revert_ratio: float) -> Tuple[str, List[Tuple[str, str]], List[int]]:
+    """Every other line is selected; revert_ratio of the remaining lines come back changed."""
+    original = make_script(size)
+    selected = list(range(0, size, 2))
+    unselected = [i for i in range(size) if i % 2]
+    changed = set(unselected[:round(len(unselected) * revert_ratio)])
+    output = []
+    for i, (line, art) in enumerate(original):
+        if i % 2 == 0:
+            output.append((f"[[SELECTED FOR MODIFICATION: {i}]] {line} NOW even better! [[END SELECTED]]", art))
+        elif i in changed:
+            output.append((f"[[PRESERVE: {i}]] {line} (rewritten anyway) [[END PRESERVE]]", art))
+        else:
+            output.append((f"[[PRESERVE: {i}]] {line} [[END PRESERVE]]", art))
+    return json.dumps([list(pair) for pair in output]), original, selected
+
+
+def time_call(func: Callable[[], object], min_seconds: float) -> float:
+    """
+    Fastest seconds per call over repeated rounds of at least min_seconds / 5 each; as with timeit,
+    the minimum is the least noisy estimate since interference only ever adds time. Like timeit, the garbage collector is paused so collections triggered by earlier cases do not skew later ones.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        return _time_rounds(func, min_seconds)
+    finally:
+        gc.enable()
+
+
+def _time_rounds(func: Callable[[], object], min_seconds: float) -> float:
+    func()
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds / 5:
+            break
+        calls *= 2
+    rounds = [elapsed / calls]
+    for _ in range(4):
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        rounds.append((time.perf_counter() - started) / calls)
+    return min(rounds)
+
+
+def calibrate() -> float:
+    """Seconds for a fixed mix of string, dict and list work, used to normalize timings across machines."""
+
+    def workload():
+        items = []
+        for i in range(2000):
+            text = f"line {i} with some text"
+            items.append({"line": text.upper(), "artDirection": text.replace("text", "art")})
+        return [item["line"] for item in items if item["artDirection"] != ""]
+
+    return time_call(workload, 0.2)
+
+
+def expect_failure(func: Callable[[], object]) -> Callable[[], None]:
+    def call():
+        try:
+            func()
+        except ValueError:
+            return
+        raise AssertionError("Malformed output was parsed")
+
+    return call
+
+
+def build_cases(sizes: List[int]) -> Dict[str, Dict[int, Callable[[], object]]]:
+    cases: Dict[str, Dict[int, Callable[[], object]]] = {}
+    for output_format in FORMATS:
+        name = f"parse_script_output[{output_format}]"
+        cases[name] = {}
+        for size in sizes:
+            output = render_output(make_script(size), output_format)
+            if output_format == "malformed":
+                cases[name][size] = expect_failure(lambda output=output: parse_script_output(output))
+            else:
+                cases[name][size] = lambda output=output: parse_script_output(output)
+    for revert_ratio in REVERT_RATIOS:
+        name = f"process_marked_output[revert={revert_ratio}]"
+        cases[name] = {}
+        for size in sizes:
+            output, original, selected = make_refine_case(size, revert_ratio)
+            cases[name][size] = lambda args=(output, original, selected): process_marked_output(*args)
+    return cases
+
+
+def growth_exponent(results: Dict[str, float], sizes: List[int]) -> float:
+    """Slope of log(time) over log(size) between the two largest sizes: ~1 for linear, ~2 for quadratic."""
+    small, large = sizes[-2], sizes[-1]
+    return math.log(results[str(large)] / results[str(small)]) / math.log(large / small)
+
+
+def run(sizes: List[int], min_seconds: float) -> dict:
+    cases = build_cases(sizes)
+    # Calibrate on both sides of the run so a burst of load at the start does not skew every ratio
+    calibration_before = calibrate()
+    seconds = {name: {str(size): time_call(func, min_seconds) for size, func in by_size.items()} for name, by_size in cases.items()}
+    calibration = min(calibration_before, calibrate())
+    results = {name: {size: value / calibration for size, value in by_size.items()} for name, by_size in seconds.items()}
+    return {"calibration_s": calibration, "sizes": sizes, "results": results}
+
+
+def check(current: dict, baseline: dict, threshold: float, max_exponent: float) -> List[str]:
+    failures = []
+    sizes = current["sizes"]
+    for name, by_size in current["results"].items():
+        if len(sizes) >= 2:
+            exponent = growth_exponent(by_size, sizes)
+            if exponent > max_exponent:
+                failures.append(f"{name}: time grows as size^{exponent:.2f} between {sizes[-2]} and {sizes[-1]} lines (limit {max_exponent})")
+        for size, normalized in by_size.items():
+            baseline_value = baseline.get("results", {}).get(name, {}).get(size)
+            if baseline_value and normalized / baseline_value > threshold:
+                failures.append(f"{name} at {size} lines: {normalized / baseline_value:.2f}x the baseline (limit {threshold}x)")
+    return failures
+
+
+def print_results(current: dict, baseline: dict):
+    sizes = current["sizes"]
+    calibration = current["calibration_s"]
+    print(f"Calibration: {calibration * 1000:.3f} ms (times below in ms on this machine, ratio vs baseline in brackets)")
+    header = f"{'case':>38} | " + " | ".join(f"{size:>16}" for size in sizes) + " | exponent"
+    print(header)
+    print("-" * len(header))
+    for name, by_size in current["results"].items():
+        cells = []
+        for size in sizes:
+            normalized = by_size[str(size)]
+            baseline_value = baseline.get("results", {}).get(name, {}).get(str(size))
+            ratio = f"[{normalized / baseline_value:.2f}x]" if baseline_value else ""
+            cells.append(f"{normalized * calibration * 1000:>9.3f} {ratio:>6}")
+        exponent = f"{growth_exponent(by_size, sizes):.2f}" if len(sizes) >= 2 else "-"
+        print(f"{name:>38} | " + " | ".join(cells) + f" | {exponent:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regression benchmark for parse_script_output and process_marked_output")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 4000], help="Script lengths in lines")
+    parser.add_argument("--min-seconds", type=float, default=0.25, help="Minimum measuring time per case and size")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run's results to --baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=2.0, help="Allowed slowdown vs the baseline, as a ratio (loose by default; shared CI machines are noisy)")
+    parser.add_argument("--max-exponent", type=float, default=1.5, help="Allowed growth exponent between the two largest sizes")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    # The validation path logs a warning per reverted line; keep the output readable and time the code, not the handlers
+    logging.disable(logging.CRITICAL)
+    sizes = sorted(args.sizes)
+    current = run(sizes, args.min_seconds)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() and not args.save_baseline else {}
+
+    if args.json:
+        print(json.dumps(current, indent=2))
+    else:
+        print_results(current, baseline)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(current, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+
+    if args.check:
+        failures = check(current, baseline, args.threshold, args.max_exponent)
+        for failure in failures:
+            print(f"REGRESSION: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Prompt Compaction Benchmark
+
+Compares the prompts the regenerate_script crew receives in "full" and "compact" mode
+across script lengths. For each size it reports the estimated prompt tokens and the time
+spent rendering the prompt in the API process.
+
+With --live the benchmark also runs the real refinement crew once per mode and size and
+reports end-to-end latency and the token usage returned by the crew. This needs a working
+crew environment (OPENAI_API_KEY or an OpenAI-compatible endpoint).
+
+Usage (from the backend directory):
+    python -m benchmarks.prompt_compaction_benchmark
+    python -m benchmarks.prompt_compaction_benchmark --sizes 4 8 16 --live
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from utils.token_accounting.token_accounting import estimate_tokens
+from utils.token_accounting.prompt_compaction import (
+    PROMPT_MODES,
+    build_marked_script,
+    build_explicit_instruction,
+    render_refine_prompt,
+)
+
+
+def make_refine_inputs(size: int) -> dict:
+    """Build a refine request for a synthetic script with `size` lines and every third line selected."""
+    current_script = [
+        (
+            f"Line {i} of the ad... with a FRESH twist, natural pauses, and a clear call to action.",
+            f"Warm, upbeat voice for line {i}. Slight pause after the ellipsis, emphasize FRESH."
+        )
+        for i in range(size)
+    ]
+    return {
+        "selected_sentences": list(range(0, size, 3)),
+        "improvement_instruction": "Make it more energetic and add a light pun about mornings.",
+        "current_script": current_script,
+        "key_selling_points": "freshly roasted, fair trade, delivered daily",
+        "tone": "Fun",
+        "ad_length": 30,
+    }
+
+
+def render_prompt(inputs: dict, mode: str) -> str:
+    enhanced_inputs = inputs.copy()
+    enhanced_inputs["current_script"] = build_marked_script(inputs["current_script"], inputs["selected_sentences"], mode)
+    enhanced_inputs["explicit_instruction"] = build_explicit_instruction(inputs["selected_sentences"], mode)
+    return render_refine_prompt(enhanced_inputs, mode)
+
+
+def benchmark_rendering(size: int, mode: str, repeats: int) -> dict:
+    inputs = make_refine_inputs(size)
+    prompt = render_prompt(inputs, mode)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        render_prompt(inputs, mode)
+    render_ms = (time.perf_counter() - started) * 1000 / repeats
+    return {
+        "size": size,
+        "mode": mode,
+        "prompt_chars": len(prompt),
+        "prompt_tokens": estimate_tokens(prompt),
+        "render_ms": round(render_ms, 3),
+    }
+
+
+async def benchmark_live(size: int, mode: str) -> dict:
+    # Imported lazily so the offline benchmark does not need the API dependencies
+    from utils.job_handlers.job_handlers import run_regenerate_script_crew
+
+    inputs = {**make_refine_inputs(size), "prompt_mode": mode}
+    started = time.perf_counter()
+    _, validation_meta, token_usage = await run_regenerate_script_crew(inputs)
+    return {
+        "size": size,
+        "mode": mode,
+        "latency_s": round(time.perf_counter() - started, 2),
+        "prompt_tokens": token_usage["prompt_tokens"],
+        "completion_tokens": token_usage["completion_tokens"],
+        "reverted": len(validation_meta.get("reverted_changes", [])),
+    }
+
+
+def print_table(rows: list, columns: list):
+    print(" | ".join(f"{column:>17}" for column in columns))
+    print("-" * (20 * len(columns)))
+    for row in rows:
+        print(" | ".join(f"{str(row[column]):>17}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full and compact refinement prompts")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--repeats", type=int, default=200, help="Render repetitions per measurement")
+    parser.add_argument("--live", action="store_true", help="Also run the real crew for each mode and size")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rows = [benchmark_rendering(size, mode, args.repeats) for size in args.sizes for mode in PROMPT_MODES]
+    for row in rows:
+        if row["mode"] == "compact":
+            full = next(r for r in rows if r["size"] == row["size"] and r["mode"] == "full")
+            row["token_saving"] = f"{100 * (1 - row['prompt_tokens'] / full['prompt_tokens']):.1f}%"
+        else:
+            row["token_saving"] = "-"
+
+    live_rows = []
+    if args.live:
+        for size in args.sizes:
+            for mode in PROMPT_MODES:
+                live_rows.append(asyncio.run(benchmark_live(size, mode)))
+
+    if args.json:
+        print(json.dumps({"render": rows, "live": live_rows}, indent=2))
+        return
+
+    print_table(rows, ["size", "mode", "prompt_chars", "prompt_tokens", "render_ms", "token_saving"])
+    if live_rows:
+        print()
+        print_table(live_rows, ["size", "mode", "latency_s", "prompt_tokens", "completion_tokens", "reverted"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Scheduler Benchmark
+
+Simulates the crew gate under a bulk backlog to show what the priority lanes buy: a steady stream of
+interactive edits arrives while bulk jobs keep every slot busy. The same workload runs twice, once with
+every job in a single lane (first come, first served, as before the lanes existed) and once with the
+real lanes, and the benchmark reports how long each class waited for a slot and how long the whole
+workload took. Jobs are asyncio sleeps, so no crew or LLM is involved.
+
+Usage (from the backend directory):
+    python -m benchmarks.scheduler_benchmark
+    python -m benchmarks.scheduler_benchmark --slots 4 --bulk-jobs 60 --bulk-seconds 1.0 --interactive-every 0.25 --json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+from benchmarks.load_test import percentile
+from utils.admission.admission import JobGate
+
+
+async def run_job(gate: JobGate, kind: str, lane: str, seconds: float, waits: Dict[str, List[float]]):
+    enqueued = time.perf_counter()
+    async with gate.slot("scheduler_benchmark", lane=lane):
+        waits[kind].append(time.perf_counter() - enqueued)
+        await asyncio.sleep(seconds)
+
+
+async def simulate(args, use_lanes: bool) -> dict:
+    gate = JobGate(f"benchmark_{'lanes' if use_lanes else 'fifo'}", args.slots, max_queue=10 ** 6, default_job_seconds=args.bulk_seconds)
+    gate.scheduler.max_wait_seconds = args.max_wait
+    bulk_lane = "bulk" if use_lanes else "standard"
+    interactive_lane = "interactive" if use_lanes else "standard"
+    waits = {"bulk": [], "interactive": []}
+
+    started = time.perf_counter()
+    # The bulk backlog is queued up front, like a batch submission
+    jobs = [asyncio.create_task(run_job(gate, "bulk", bulk_lane, args.bulk_seconds, waits)) for _ in range(args.bulk_jobs)]
+    for _ in range(args.interactive_jobs):
+        await asyncio.sleep(args.interactive_every)
+        jobs.append(asyncio.create_task(run_job(gate, "interactive", interactive_lane, args.interactive_seconds, waits)))
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - started
+
+    interactive, bulk = waits["interactive"], waits["bulk"]
+    return {
+        "mode": "lanes" if use_lanes else "fifo",
+        "elapsed_s": round(elapsed, 2),
+        "interactive_wait_p50_s": round(percentile(interactive, 50), 3),
+        "interactive_wait_p95_s": round(percentile(interactive, 95), 3),
+        "interactive_wait_max_s": round(max(interactive), 3) if interactive else 0,
+        "bulk_wait_p95_s": round(percentile(bulk, 95), 3),
+        "bulk_wait_max_s": round(max(bulk), 3) if bulk else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare interactive wait times with and without priority lanes")
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--bulk-jobs", type=int, default=40)
+    parser.add_argument("--bulk-seconds", type=float, default=0.5)
+    parser.add_argument("--interactive-jobs", type=int, default=20)
+    parser.add_argument("--interactive-every", type=float, default=0.2, help="Seconds between interactive arrivals")
+    parser.add_argument("--interactive-seconds", type=float, default=0.2)
+    parser.add_argument("--max-wait", type=float, default=120.0, help="Starvation protection threshold in seconds")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = [asyncio.run(simulate(args, use_lanes=False)), asyncio.run(simulate(args, use_lanes=True))]
+    if args.json:
+        print(json.dumps({"config": {key: value for key, value in vars(args).items() if key != "json"}, "results": results}, indent=2))
+        return
+    header = f"{'mode':>6} | {'elapsed':>8} | {'int p50':>8} | {'int p95':>8} | {'int max':>8} | {'bulk p95':>8} | {'bulk max':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['mode']:>6} | {r['elapsed_s']:>8} | {r['interactive_wait_p50_s']:>8} | {r['interactive_wait_p95_s']:>8} | "
+            f"{r['interactive_wait_max_s']:>8} | {r['bulk_wait_p95_s']:>8} | {r['bulk_wait_max_s']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
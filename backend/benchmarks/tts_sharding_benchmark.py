@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+TTS Sharding Benchmark
+
+Compares synthesis throughput of one process generating batches of lines with all the cores'
+threads (the single-process baseline) against the same lines sharded over pools of TTS worker
+processes (ADGEN_TTS_WORKERS), with the cores partitioned between the workers. Each pool keeps
+one line per worker in flight, as /generate_audio does.
+
+Reports lines and seconds of audio synthesized per wall-clock second after warm-up, the speedup
+over the baseline, the time to start each configuration, and memory: the mean unique memory per
+worker, and the total proportional set size (PSS) of the pool, which with shared weights (the
+default) counts the weights once across the workers and their fork server.
+
+Run it with the real model on the box sizes to compare (8, 16, 32 cores). The synthetic backend
+only sleeps, so with it the numbers show the cost of the process plumbing rather than of decoding;
+--synthetic-weights-mb gives it weights to share.
+
+Usage (from the backend directory):
+    python -m benchmarks.tts_sharding_benchmark --backend parler --workers 1 2 4 8 --lines 16
+    python -m benchmarks.tts_sharding_benchmark --backend synthetic --seconds-per-char 0.01 --json
+    python -m benchmarks.tts_sharding_benchmark --synthetic-weights-mb 500 --no-share-weights
+"""
+
+import argparse
+import json
+import multiprocessing.forkserver
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from benchmarks.audio_pipeline_benchmark import make_script
+from utils.tts_integration.backends import BACKENDS, TTSBackend
+from utils.tts_integration.tts_pool import PooledTTSBackend, process_memory
+
+
+def measure(backend: TTSBackend, items: List[Tuple[str, str]], batch_size: int, rounds: int) -> dict:
+    # One warm-up round: first calls pay for lazy initialization in the model
+    backend.synthesize_batch(items[:backend.concurrency])
+    started = time.perf_counter()
+    audio_seconds = 0.0
+    for _ in range(rounds):
+        if backend.concurrency == 1:
+            outputs = [samples for start in range(0, len(items), batch_size) for samples in backend.synthesize_batch(items[start:start + batch_size])]
+        else:
+            with ThreadPoolExecutor(backend.concurrency) as pool:
+                outputs = list(pool.map(lambda item: backend.synthesize(*item), items))
+        audio_seconds += sum(len(samples) for samples in outputs) / backend.sampling_rate
+    elapsed = time.perf_counter() - started
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "lines_per_s": round(len(items) * rounds / elapsed, 3),
+        "audio_s_per_s": round(audio_seconds / elapsed, 3),
+    }
+
+
+def pool_memory(pooled: PooledTTSBackend) -> dict:
+    workers = pooled.worker_memory()
+    # The fork server holds the one shared copy of the weights; its share of them belongs to the pool
+    forkserver_pid = getattr(multiprocessing.forkserver._forkserver, "_forkserver_pid", None) if pooled.share_weights else None
+    forkserver = process_memory(forkserver_pid) if forkserver_pid else None
+    return {
+        "unique_mb_per_worker": round(sum(usage["unique"] for usage in workers.values()) / max(1, len(workers)) / 2 ** 20, 1),
+        "pool_pss_mb": round((sum(usage["pss"] for usage in workers.values()) + (forkserver["pss"] if forkserver else 0)) / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-process batched TTS with TTS sharded over worker processes")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="synthetic")
+    parser.add_argument("--cores", type=int, default=os.cpu_count() or 1, help="Cores to partition between the workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--lines", type=int, default=16)
+    parser.add_argument("--words-per-line", type=int, default=12)
+    parser.add_argument("--batch-size", type=int, default=4, help="Lines per generate call of the single-process baseline")
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--seconds-per-char", type=float, default=0.005, help="Synthetic backend latency")
+    parser.add_argument("--synthetic-weights-mb", type=float, default=0.0, help="Stand-in weights the synthetic backend loads")
+    parser.add_argument("--no-share-weights", action="store_true", help="Have every worker load its own copy of the weights")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["ADGEN_SYNTHETIC_TTS_SECONDS_PER_CHAR"] = str(args.seconds_per_char)
+    os.environ["ADGEN_SYNTHETIC_TTS_WEIGHTS_MB"] = str(args.synthetic_weights_mb)
+    items = [(line["line"], line["artDirection"]) for line in make_script(args.lines, args.words_per_line)]
+    results = []
+
+    started = time.perf_counter()
+    baseline = BACKENDS[args.backend]()
+    baseline.set_threads(args.cores)
+    baseline.load()
+    start_s = round(time.perf_counter() - started, 2)
+    own = process_memory(os.getpid())
+    results.append({"mode": "batched", "workers": 1, "threads_per_worker": args.cores, "start_s": start_s,
+                    **measure(baseline, items, args.batch_size, args.rounds),
+                    "unique_mb_per_worker": round(own["unique"] / 2 ** 20, 1) if own else None, "pool_pss_mb": round(own["pss"] / 2 ** 20, 1) if own else None})
+    del baseline
+
+    for workers in args.workers:
+        started = time.perf_counter()
+        pooled = PooledTTSBackend(args.backend, workers, max(1, args.cores // workers), share_weights=not args.no_share_weights)
+        pooled.load()
+        start_s = round(time.perf_counter() - started, 2)
+        try:
+            results.append({"mode": "sharded", "workers": workers, "threads_per_worker": pooled.threads_per_worker, "start_s": start_s,
+                            **measure(pooled, items, args.batch_size, args.rounds), **pool_memory(pooled)})
+        finally:
+            pooled.close()
+
+    for result in results:
+        result["speedup"] = round(result["lines_per_s"] / results[0]["lines_per_s"], 2)
+    if args.json:
+        print(json.dumps({"config": {key: value for key, value in vars(args).items() if key != "json"}, "results": results}, indent=2))
+        return
+    header = (f"{'mode':>8} | {'workers':>7} | {'threads':>7} | {'start s':>7} | {'lines/s':>8} | {'audio s/s':>9} | {'speedup':>7} | "
+              f"{'unique MB/worker':>16} | {'PSS MB':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['mode']:>8} | {r['workers']:>7} | {r['threads_per_worker']:>7} | {r['start_s']:>7} | "
+            f"{r['lines_per_s']:>8} | {r['audio_s_per_s']:>9} | {r['speedup']:>7} | {str(r['unique_mb_per_worker']):>16} | {str(r['pool_pss_mb']):>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,38 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Depends, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import Response, FileResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 import os
-import subprocess
 import json
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Tuple, Literal, Dict, Any, Optional
+from typing import Awaitable, List, Tuple, Literal, Dict, Any, Optional
 import requests
+import asyncio
 import logging
+import time
+from utils.admission.admission import CREW_GATE, TTS_GATE, JobGate, check_admission, client_id_for, lane_for
+from utils.job_registry.dispatch import RegistryGate, execution_mode, get_artifact_store, submit_and_wait
+from utils.script_store.version_store import ScriptNotFound, get_script_store
+from utils.duration.duration_estimator import get_duration_estimator, lines_to_trim, tts_backend_name
+from utils.semantic_cache.brief_cache import get_semantic_cache, semantic_cache_enabled
+from utils.script_store.sessions import SessionConflict, SessionNotFound, get_session_store
+from utils.tts_integration.backends import loaded_tts_backends
+from utils.tts_integration.speculative import get_speculative_synthesizer, speculative_tts_enabled
+from utils.audio_jobs.audio_jobs import get_audio_jobs
+from utils.job_handlers.job_handlers import JOB_HANDLERS, audio_job, process_marked_output
+from utils.campaigns.campaigns import CampaignNotFound, RowRejected, get_campaign_runner, parse_campaign_rows
+from utils.cancellation.cancellation import DISCONNECTED_SCOPE_KEY, DisconnectWatcher, RequestCancelled, request_timeout, run_cancellable
+from utils.observability.metrics import (
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    HTTP_REQUEST_DURATION,
+    AUDIO_JOB_WATCHERS,
+)
+from utils.observability.tracing import current_trace_id, start_span
+from utils.observability.profiling import admin_token, get_profile_store, is_admin, profile_request, profiling_requested
+from utils.observability.logging_config import configure_logging
 
 app = FastAPI()
 
@@ -26,8 +51,97 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "Retry-After", "X-Profile"],
 )
 
+if admin_token():
+    # Only installed with an admin token configured: unprofiled requests otherwise pay nothing for it.
+    # Innermost, so the request's trace id is set and the profile covers the handler alone.
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        """Profile requests sent with X-Profile and the admin token; the report is stored under the trace id."""
+        if not profiling_requested(request.headers):
+            return await call_next(request)
+        return await profile_request(current_trace_id(), request.method, request.url.path, lambda: call_next(request))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record end-to-end latency for every request, labelled by route template rather than raw path."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST_DURATION.labels(method=request.method, path=path, status=status).observe(time.perf_counter() - started)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Open a root span for every request, continuing the caller's trace if a traceparent header is sent.
+    The trace id is returned in the X-Trace-Id header so clients can correlate responses with traces.
+    """
+    with start_span(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path}
+    ) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            span.name = f"{request.method} {route.path}"
+        span.set_attribute("http.status_code", response.status_code)
+        response.headers["X-Trace-Id"] = span.trace_id
+        response.headers["traceparent"] = span.traceparent
+        return response
+
+# Outermost, so that it sees client disconnects the middlewares above never pass on
+app.add_middleware(DisconnectWatcher)
+
+async def cancellable(http_request: Request, pipeline: str, work: Awaitable):
+    """Run an endpoint's work under the request's deadline, and cancel it if the client disconnects first."""
+    try:
+        return await run_cancellable(work, pipeline, request_timeout(http_request.headers), http_request.scope.get(DISCONNECTED_SCOPE_KEY))
+    except RequestCancelled as e:
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail=f"{pipeline} did not finish within the request deadline")
+        # Nobody reads this response; the status shows up in logs and request metrics
+        raise HTTPException(status_code=499, detail="Client closed request")
+
+# In distributed mode the queue that matters is the shared registry's, not this process's
+if execution_mode() == "distributed":
+    CREW_ADMISSION_GATE = RegistryGate("crew", ["generate_script", "regenerate_script"], CREW_GATE.max_queue, CREW_GATE.default_job_seconds)
+    TTS_ADMISSION_GATE = RegistryGate("tts", ["audio"], TTS_GATE.max_queue, TTS_GATE.default_job_seconds)
+else:
+    CREW_ADMISSION_GATE, TTS_ADMISSION_GATE = CREW_GATE, TTS_GATE
+
+def admission(gate: JobGate, default_lane: str):
+    """
+    Route dependency that admits a request for a crew or TTS job, or rejects it straight away with
+    429 and Retry-After when the client is over its rate limit or the gate's queue is full.
+    Resolves to the priority lane the job is scheduled in.
+    """
+    async def admit(request: Request) -> str:
+        return admit_client(request.headers, request.client.host if request.client else None, request.url.path, gate, default_lane)
+    return admit
+
+def admit_client(headers, peer_host: Optional[str], path: str, gate: JobGate, default_lane: str) -> str:
+    """Admit one job for a client, returning its lane, or raise HTTPException(429) with Retry-After."""
+    lane = lane_for(headers, default_lane)
+    client_id = client_id_for(headers, peer_host)
+    rejection = check_admission(client_id, gate, lane)
+    if rejection is not None:
+        logging.warning(f"Rejected {path} ({lane}) from {client_id}: {rejection.reason}, retry after {rejection.retry_after_header}s")
+        raise HTTPException(
+            status_code=429,
+            detail=rejection.detail,
+            headers={"Retry-After": rejection.retry_after_header},
+        )
+    return lane
+
 class ScriptRequest(BaseModel):
     product_name: str
     target_audience: str
@@ -35,6 +149,8 @@ class ScriptRequest(BaseModel):
     tone: str
     ad_length: int = Field(..., ge=15, le=60)  # Validate length between 15 and 60 seconds
     speaker_voice: Literal["Male", "Female", "Either"]
+    allow_cached: bool = True  # False always generates a new script, even with ADGEN_SEMANTIC_CACHE on
+    auto_trim: bool = False  # Ask the refinement crew to shorten a script estimated to run over ad_length
 
 class RefineRequest(BaseModel):
     selected_sentences: List[int]
@@ -43,14 +159,106 @@ class RefineRequest(BaseModel):
     key_selling_points: str
     tone: str
     ad_length: int = Field(..., ge=15, le=60)  # Validate length between 15 and 60 seconds
+    prompt_mode: Optional[Literal["full", "compact"]] = None  # Defaults to ADGEN_PROMPT_MODE
+    script_id: Optional[str] = None  # Record the refinement as a new version of this stored script
+    base_version: Optional[int] = None  # Version current_script corresponds to; defaults to the latest
 
 class Script(BaseModel):
     line: str
     artDirection: str
 
+class ScriptChange(BaseModel):
+    index: int = Field(..., ge=0)
+    line: str
+    artDirection: str
+
+class ScriptVersionInfo(BaseModel):
+    script_id: str
+    version: int
+    parent_version: Optional[int] = None
+    length: int
+    content_hash: str
+    created_at: float
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+class ScriptVersionEntry(ScriptVersionInfo):
+    changes: List[ScriptChange]  # Changes against parent_version (the full script for version 1)
+
+class ScriptVersionResponse(ScriptVersionInfo):
+    script: List[Script]
+
+class ScriptHistoryResponse(BaseModel):
+    script_id: str
+    head_version: int
+    versions: List[ScriptVersionEntry]
+
+class ScriptDiffResponse(BaseModel):
+    from_version: int
+    to_version: int
+    length: int
+    changes: List[ScriptChange]
+
+class CreateScriptRequest(BaseModel):
+    script: List[Script]
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+class CommitScriptVersionRequest(BaseModel):
+    parent_version: int
+    script: Optional[List[Script]] = None  # Either the full new script...
+    changes: Optional[List[ScriptChange]] = None  # ...or the changes against parent_version
+    length: Optional[int] = Field(None, ge=0)  # New length when committing changes; defaults to the parent's
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+class TaskTokenUsage(BaseModel):
+    task: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    successful_requests: int = 0
+
+class TokenUsage(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    successful_requests: int = 0
+    tasks: List[TaskTokenUsage] = Field(default_factory=list)
+    estimated_prompt_tokens: Optional[int] = None  # Local estimate of the rendered prompt size
+    prompt_mode: str = "full"
+    reported: bool = False  # False if the crew did not write a usage report
+
+class CacheMetadata(BaseModel):
+    hit: bool
+    score: Optional[float] = None  # Cosine similarity to the closest cached brief, on a hit
+    cached_at: Optional[float] = None  # When the served response was generated
+
+class DurationEstimate(BaseModel):
+    estimated_seconds: float
+    line_seconds: List[float]  # Estimated seconds of each script line, in script order
+    target_seconds: Optional[float] = None
+    over_length: bool = False  # Estimated to run over target_seconds by more than ADGEN_DURATION_TOLERANCE
+    overrun_seconds: float = 0.0
+    backend: str  # TTS backend whose calibration was used
+    calibration_samples: int = 0  # Synthesized lines the calibration has seen
+    trimmed: bool = False  # The script was shortened by an automatic trim pass
+
+class RoutingDecision(BaseModel):
+    task: str
+    size: str  # full (generation), small or large (refinement)
+    model: Optional[str] = None  # None: the crew's default model
+    tier: Literal["strong", "fast"]
+    reason: str
+
+class ResponseMetadata(BaseModel):
+    token_usage: Optional[TokenUsage] = None
+    routing: Optional[RoutingDecision] = None  # The model the crew ran with, and why
+    script_version: Optional[ScriptVersionInfo] = None  # Where the script was stored in the version store
+    cache: Optional[CacheMetadata] = None  # Set when the near-duplicate cache was consulted
+    duration: Optional[DurationEstimate] = None  # Estimated spoken length of the returned script
+
 class GenerateScriptResponse(BaseModel):
     success: bool
     script: List[Script]
+    metadata: Optional[ResponseMetadata] = None
 
 class ValidationMetadata(BaseModel):
     had_unauthorized_changes: bool = False
@@ -62,387 +270,291 @@ class ValidationMetadata(BaseModel):
 
 class AudioRequest(BaseModel):
     script: List[Script]
+    ad_length: Optional[int] = Field(None, ge=15, le=60)  # Reject scripts estimated to run over this, before synthesis
+    allow_over_length: bool = False
+    script_id: Optional[str] = None  # Stored script the audio is for; with speculative TTS, a miss supersedes its background synthesis
+    quality: Literal["final", "preview"] = "final"  # preview: a fast draft, with the final render queued in the background
+
+class DurationRequest(BaseModel):
+    script: List[Script]
+    ad_length: Optional[int] = Field(None, ge=15, le=60)
 
 class GenerateAudioResponse(BaseModel):
     audioUrl: str
+    quality: Literal["final", "preview"] = "final"
+    finalJobId: Optional[str] = None  # For previews: the audio job rendering the final quality
+
+class AudioJobStatus(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "succeeded", "failed", "cancelled"]
+    version: int  # Grows with every change; pass it back as `after` (or Last-Event-ID) to wait for the next one
+    lines_done: int
+    lines_total: int
+    eta_seconds: Optional[float] = None
+    audioUrl: Optional[str] = None
+    error: Optional[str] = None
 
 class RefineScriptResponse(BaseModel):
     status: str
     data: List[Script]  # Now will only contain modified sentences
     modified_indices: List[int]  # Indices of the sentences that were modified
     validation: Optional[ValidationMetadata] = None
+    metadata: Optional[ResponseMetadata] = None
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+class OpenSessionRequest(BaseModel):
+    script: Optional[List[Script]] = None  # Either a script to start from...
+    script_id: Optional[str] = None  # ...or a stored script
+    version: Optional[int] = None  # Version of script_id to start from; defaults to the latest
+    key_selling_points: str
+    tone: str
+    ad_length: int = Field(..., ge=15, le=60)
+    prompt_mode: Optional[Literal["full", "compact"]] = None
 
-def parse_script_output(output: str) -> List[Dict[str, str]]:
-    """Parse the script output from the crew into a list of script objects."""
-    try:
-        # Clean up the output string to handle common formatting issues
-        output = output.strip()
-        # Remove trailing period before closing bracket if present
-        if output.endswith(').'):
-            output = output[:-1] + ')'
-        if output.endswith(').  ]'):
-            output = output[:-5] + ')]'
-            
-        # First try to parse as JSON
-        try:
-            data = json.loads(output)
-            if isinstance(data, list):
-                # Each item should be a tuple/list of two strings
-                scripts = []
-                for item in data:
-                    if isinstance(item, (list, tuple)) and len(item) == 2:
-                        script_line = item[0]
-                        art_direction = item[1]
-                        # Remove any extra quotes if present
-                        if isinstance(script_line, str) and isinstance(art_direction, str):
-                            scripts.append({
-                                "line": script_line,
-                                "artDirection": art_direction
-                            })
-                return scripts
-        except json.JSONDecodeError:
-            # If not JSON, try to parse as Python literal
-            import ast
-            try:
-                # Safely evaluate the string as a Python literal
-                data = ast.literal_eval(output)
-                if isinstance(data, list):
-                    return [
-                        {
-                            "line": item[0],
-                            "artDirection": item[1]
-                        }
-                        for item in data
-                        if isinstance(item, (list, tuple)) and len(item) == 2
-                    ]
-            except (SyntaxError, ValueError):
-                # Last resort: try to fix common formatting issues with regex
-                import re
-                # Find all pairs of quoted strings
-                pattern = r'\("([^"]+)",\s*"([^"]+)"\)'
-                matches = re.findall(pattern, output)
-                if matches:
-                    return [
-                        {
-                            "line": line,
-                            "artDirection": art
-                        }
-                        for line, art in matches
-                    ]
-
-        # If all parsing attempts fail, log the raw output and raise an error
-        logging.error(f"Could not parse output format. Raw output: {output}")
-        raise ValueError("Output format not recognized")
+class SessionResponse(BaseModel):
+    session_id: str
+    script_id: str
+    version: int
+    content_hash: str
+    script: List[Script]
 
-    except Exception as e:
-        logging.error(f"Error parsing script output: {str(e)}")
-        logging.error(f"Raw output: {output}")
-        raise ValueError(f"Failed to parse script output: {str(e)}")
+class SessionRefineRequest(BaseModel):
+    selected_sentences: List[int]
+    improvement_instruction: str
+    base_hash: Optional[str] = None  # Hash of the client's copy; a stale copy gets 409 instead of a delta
 
-async def run_crewai_script(inputs: dict) -> List[Dict[str, str]]:
-    try:
-        # Log the inputs for debugging
-        logging.debug(f"Inputs to script generation: {json.dumps(inputs, indent=2)}")
-        
-        # Get absolute paths
-        backend_dir = Path(__file__).parent.absolute()
-        script_gen_dir = backend_dir / "script_generation"
-        script_src_dir = script_gen_dir / "src"
-        
-        # Define possible output paths
-        expected_output_path = script_gen_dir / "radio_script.md"
-        possible_output_paths = [
-            expected_output_path,
-            Path("/home/azureuser/marketing-app-ad-gen/backend/script_generation/radio_script.md"),
-            Path(script_src_dir) / "home" / "azureuser" / "marketing-app-ad-gen" / "backend" / "script_generation" / "radio_script.md",
-            backend_dir / "script_generation" / "radio_script.md"
-        ]
-        
-        # Clean up any existing files at these paths
-        for output_path in possible_output_paths:
-            if output_path.exists():
-                try:
-                    output_path.unlink()
-                    logging.info(f"Deleted existing file: {output_path}")
-                except Exception as e:
-                    logging.warning(f"Failed to delete {output_path}: {str(e)}")
-                    
-        # Create directories if they don't exist
-        expected_output_path.parent.mkdir(parents=True, exist_ok=True)
+class SessionChangesRequest(BaseModel):
+    changes: List[ScriptChange]
+    length: Optional[int] = Field(None, ge=0)
+    base_hash: Optional[str] = None
+
+class SessionDeltaResponse(BaseModel):
+    session_id: str
+    script_id: str
+    version: int
+    parent_version: int
+    base_hash: str  # The changes apply to the script with this hash...
+    content_hash: str  # ...and produce the script with this one
+    length: int
+    changes: List[ScriptChange]
+    modified_indices: List[int] = Field(default_factory=list)
+    validation: Optional[ValidationMetadata] = None
+    metadata: Optional[ResponseMetadata] = None
+
+# Configure logging (ADGEN_LOG_MODE=production for structured, queued JSON logs)
+configure_logging()
+
+async def execute_job(kind: str, payload: dict, lane: str) -> Dict[str, Any]:
+    """Run a job in this process, or hand it to the workers through the job registry in distributed mode."""
+    if execution_mode() == "distributed":
+        return await submit_and_wait(kind, payload, lane)
+    return await JOB_HANDLERS[kind](payload, lane)
+
+async def refine_selected(request: RefineRequest, lane: str) -> Tuple[List[int], List[Dict[str, str]], Dict[str, Any], Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Run the refinement crew and return the selected sentences it actually modified, with validation, token usage and model routing."""
+    original_script = request.current_script
+    result = await execute_job("regenerate_script", request.dict(), lane)
+    full_script_output, validation_meta, token_usage = result["script"], result["validation"], result["token_usage"]
+    
+    # Identify which selected sentences were actually modified
+    modified_indices = []
+    modified_sentences = []
+    
+    for i in request.selected_sentences:
+        if i < len(full_script_output) and i < len(original_script):
+            orig_line = original_script[i][0]
+            orig_art = original_script[i][1]
             
-        # Print debug information
-        logging.info(f"Current working directory before running script: {os.getcwd()}")
-        logging.info(f"Expected script generation output path: {expected_output_path}")
-        logging.info(f"All possible output paths: {possible_output_paths}")
-        
-        # Set environment variables for the subprocess, including the explicit output path
-        env_vars = {
-            **os.environ,
-            "PYTHONPATH": str(script_src_dir),
-            "CREW_INPUTS": json.dumps(inputs),
-            "SCRIPT_OUTPUT_PATH": str(expected_output_path)
-        }
-        
-        # Run the script generation process
-        result = subprocess.run(
-            ["python", "-m", "script_generation.main"],
-            env=env_vars,
-            cwd=str(script_src_dir),  # Set working directory explicitly
-            capture_output=True,
-            text=True
-        )
-        
-        # Log the output for debugging
-        logging.info(f"Script generation output: {result.stdout}")
-        
-        if result.stderr:
-            logging.warning(f"Script generation errors: {result.stderr}")
-        
-        if result.returncode != 0:
-            logging.error(f"CrewAI Error: {result.stderr}")
-            raise RuntimeError(f"CrewAI Error: {result.stderr}")
-        
-        # Check all possible output paths
-        for output_path in possible_output_paths:
-            if output_path.exists():
-                logging.info(f"Found output file at {output_path}")
-                try:
-                    output_text = output_path.read_text()
-                    return parse_script_output(output_text)
-                except Exception as e:
-                    logging.error(f"Error reading {output_path}: {str(e)}")
-        
-        # Try to parse the output directly from stdout if no file is found
-        if "Final Answer:" in result.stdout:
-            logging.info("Trying to parse script from stdout")
-            answer_text = result.stdout.split("Final Answer:")[1].strip()
-            return parse_script_output(answer_text)
+            new_line = full_script_output[i].get("line", "")
+            new_art = full_script_output[i].get("artDirection", "")
             
-        # Additional debug information if file not found
-        logging.error(f"Output file not found at any of the expected paths")
-        all_md_files = list(Path(script_gen_dir).glob('**/*.md'))
-        logging.error(f"All markdown files in script_gen_dir: {all_md_files}")
-        logging.error(f"Directory contents: {list(Path(__file__).parent.glob('**/*.md'))}")
-        raise FileNotFoundError("Script output file not generated")
-    except Exception as e:
-        logging.error(f"Script generation failed: {str(e)}")
-        raise RuntimeError(f"Script generation failed: {str(e)}")
-    finally:
-        os.chdir(Path(__file__).parent)
+            # Check if the sentence was actually modified
+            if new_line != orig_line or new_art != orig_art:
+                modified_indices.append(i)
+                modified_sentences.append(full_script_output[i])
+    
+    logging.info(f"Script regeneration complete. {len(modified_indices)} out of {len(request.selected_sentences)} selected sentences were modified.")
+    return modified_indices, modified_sentences, validation_meta, token_usage, result.get("routing")
 
-async def run_regenerate_script_crew(inputs: dict) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
-    try:
-        # Create enhanced input structure with explicit marking of selected sentences
-        enhanced_inputs = inputs.copy()
-        
-        # Extract the current script and selected sentences
-        current_script = enhanced_inputs.get("current_script", [])
-        selected_sentences = enhanced_inputs.get("selected_sentences", [])
-        
-        # Create a marked script that clearly highlights which sentences should be modified
-        marked_script = []
-        for idx, (line, art_direction) in enumerate(current_script):
-            if idx in selected_sentences:
-                # Mark selected sentences with special prefix/suffix
-                marked_script.append([
-                    f"[[SELECTED FOR MODIFICATION: {idx}]] {line} [[END SELECTED]]",
-                    f"[[SELECTED FOR MODIFICATION: {idx}]] {art_direction} [[END SELECTED]]"
-                ])
-            else:
-                # Mark non-selected sentences as should be preserved
-                marked_script.append([
-                    f"[[PRESERVE: {idx}]] {line} [[END PRESERVE]]",
-                    f"[[PRESERVE: {idx}]] {art_direction} [[END PRESERVE]]"
-                ])
-        
-        # Replace the original script with the marked version
-        enhanced_inputs["current_script"] = marked_script
-        
-        # Add explicit instruction about only modifying selected sentences
-        enhanced_inputs["explicit_instruction"] = f"""
-IMPORTANT: You MUST ONLY modify sentences marked with [[SELECTED FOR MODIFICATION]].
-DO NOT change ANY part of sentences marked with [[PRESERVE]].
-Your task is to apply the improvement instruction ONLY to the selected sentences.
-For any sentence not selected (marked with PRESERVE), return it EXACTLY as provided.
-The indices that should be modified are: {selected_sentences}
-"""
-        
-        logging.debug(f"Enhanced inputs to regenerate_script crew: {json.dumps(enhanced_inputs, indent=2)}")
-        
-        script_gen_dir = Path(__file__).parent / "regenerate_script" / "src"
-        os.chdir(script_gen_dir)
-        
-        # Define possible output paths
-        possible_output_paths = [
-            Path("/home/azureuser/marketing-app-ad-gen/backend/regenerate_script/refined_script.md"),
-            Path(script_gen_dir) / "home" / "azureuser" / "marketing-app-ad-gen" / "backend" / "regenerate_script" / "refined_script.md",
-            Path(__file__).parent / "regenerate_script" / "refined_script.md"
-        ]
-        
-        # Clean up any existing files at these paths
-        for output_path in possible_output_paths:
-            if output_path.exists():
-                output_path.unlink()
-            
-        # Print debug information
-        logging.info(f"Possible script regeneration output paths: {possible_output_paths}")
-        logging.info(f"Current working directory: {os.getcwd()}")
-        
-        result = subprocess.run(
-            ["python", "-m", "regenerate_script.main"],
-            env={
-                **os.environ,
-                "PYTHONPATH": str(script_gen_dir),
-                "CREW_INPUTS": json.dumps(enhanced_inputs)
-            },
-            capture_output=True,
-            text=True
-        )
-        
-        # Log the output for debugging
-        logging.info(f"Script regeneration output: {result.stdout}")
-        logging.info(f"Script regeneration errors: {result.stderr}")
-        
-        logging.debug(f"RegenerateScript result: {result.stdout}")
-        if result.returncode != 0:
-            logging.error(f"RegenerateScript Error: {result.stderr}")
-            raise RuntimeError(f"RegenerateScript Error: {result.stderr}")
-        
-        # Check all possible output paths
-        for output_path in possible_output_paths:
-            if output_path.exists():
-                logging.info(f"Found output file at {output_path}")
-                output_text = output_path.read_text()
-                # Process the output to remove the markers and enforce constraints
-                processed_output, validation_meta = process_marked_output(output_text, current_script, selected_sentences)
-                return processed_output, validation_meta
-        
-        # Try to parse the output directly from stdout if no file is found
-        if "Final Answer:" in result.stdout:
-            logging.info("Trying to parse script from stdout")
-            answer_text = result.stdout.split("Final Answer:")[1].strip()
-            processed_output, validation_meta = process_marked_output(answer_text, current_script, selected_sentences)
-            return processed_output, validation_meta
-                
-        # Additional debug information if file not found
-        logging.error(f"Output file not found at any of the expected paths")
-        all_md_files = list(Path(script_gen_dir).glob('**/*.md'))
-        logging.error(f"All markdown files in script_gen_dir: {all_md_files}")
-        logging.error(f"Directory contents: {list(Path(__file__).parent.glob('**/*.md'))}")
-        
-        # If no output file was created, try to parse from stdout
-        parsed_output, validation_meta = process_marked_output(result.stdout, current_script, selected_sentences)
-        return parsed_output, validation_meta
-    except Exception as e:
-        logging.error(f"Failed to run regenerate_script crew: {str(e)}")
-        raise RuntimeError(f"Failed to run regenerate_script crew: {str(e)}")
-    finally:
-        os.chdir(Path(__file__).parent)
+def estimate_duration(script: List[Dict[str, str]], ad_length: Optional[int]) -> Dict[str, Any]:
+    """Estimated spoken length of a script with the calibration of the configured TTS backend."""
+    return get_duration_estimator().estimate_script([item.get("line", "") for item in script], tts_backend_name(), ad_length)
 
-def process_marked_output(output_text: str, original_script: List[Tuple[str, str]], selected_sentences: List[int]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+async def trim_to_length(script: List[Dict[str, str]], request: ScriptRequest, duration: Dict[str, Any], lane: str) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
     """
-    Process the output from the crew to:
-    1. Remove markers from the output
-    2. Verify that only selected sentences have been modified
-    3. Revert any unauthorized changes to non-selected sentences
-    
-    This creates a safety mechanism regardless of what the crew returns.
-    
-    Returns:
-        A tuple containing:
-        - The verified script with only authorized changes
-        - Metadata about the validation process (reverted changes, etc.)
+    One refinement pass over the longest lines of an over-length script, asking the crew to cut the
+    estimated overrun. Returns the trimmed script and its new estimate, or the original on failure.
     """
-    meta = {
-        "reverted_changes": [],
-        "had_unauthorized_changes": False,
-        "had_length_mismatch": False,
-        "original_length": len(original_script),
-        "received_length": 0
-    }
-    
+    selected = lines_to_trim(duration["line_seconds"], duration["overrun_seconds"])
+    trim_request = RefineRequest(
+        selected_sentences=selected,
+        improvement_instruction=(
+            f"Shorten these lines so the whole ad reads in {request.ad_length} seconds. It currently runs about "
+            f"{duration['estimated_seconds']:.0f} seconds, so cut about {duration['overrun_seconds']:.0f} seconds of speech "
+            f"across these lines. Keep the key selling points and the call to action."
+        ),
+        current_script=[(item.get("line", ""), item.get("artDirection", "")) for item in script],
+        key_selling_points=request.key_selling_points,
+        tone=request.tone,
+        ad_length=request.ad_length,
+    )
     try:
-        # First, try to parse the output normally
-        parsed_script = parse_script_output(output_text)
-        meta["received_length"] = len(parsed_script)
-        
-        # Validate script length
-        if len(parsed_script) != len(original_script):
-            meta["had_length_mismatch"] = True
-            logging.warning(f"Script length mismatch: original={len(original_script)}, received={len(parsed_script)}. Adjusting to match original length.")
-            # If the lengths don't match, we'll keep the original script length
-            # Truncate if too long, or extend with original sentences if too short
-            if len(parsed_script) > len(original_script):
-                parsed_script = parsed_script[:len(original_script)]
-            else:
-                for i in range(len(parsed_script), len(original_script)):
-                    parsed_script.append({
-                        "line": original_script[i][0],
-                        "artDirection": original_script[i][1]
-                    })
-        
-        # Remove markers from the generated script
-        for item in parsed_script:
-            for marker in ["[[SELECTED FOR MODIFICATION: ", "[[PRESERVE: ", "]] ", " [[END SELECTED]]", " [[END PRESERVE]]"]:
-                if "line" in item and isinstance(item["line"], str):
-                    item["line"] = item["line"].replace(marker, "")
-                if "artDirection" in item and isinstance(item["artDirection"], str):
-                    item["artDirection"] = item["artDirection"].replace(marker, "")
-        
-        # Step 2: Verify and enforce that only selected sentences were modified
-        verified_script = []
-        
-        for i, (orig_line, orig_art) in enumerate(original_script):
-            # Get the corresponding generated item
-            gen_item = parsed_script[i] if i < len(parsed_script) else {"line": "", "artDirection": ""}
-            
-            # If this is not a selected sentence, ensure it remains unchanged
-            if i not in selected_sentences:
-                # Check if the line or art direction was modified
-                if gen_item.get("line", "") != orig_line or gen_item.get("artDirection", "") != orig_art:
-                    meta["had_unauthorized_changes"] = True
-                    meta["reverted_changes"].append({
-                        "index": i,
-                        "original": {"line": orig_line, "artDirection": orig_art},
-                        "attempted": {"line": gen_item.get("line", ""), "artDirection": gen_item.get("artDirection", "")}
-                    })
-                    logging.warning(f"Unauthorized change detected for sentence {i}. Reverting to original.")
-                    verified_script.append({
-                        "line": orig_line,
-                        "artDirection": orig_art
-                    })
-                else:
-                    # No changes detected, keep as is
-                    verified_script.append(gen_item)
-            else:
-                # This is a selected sentence, accept the changes
-                verified_script.append(gen_item)
-        
-        if meta["had_unauthorized_changes"]:
-            logging.info(f"Some unauthorized changes were reverted in the generated script: {len(meta['reverted_changes'])} sentences affected.")
-        
-        return verified_script, meta
-        
+        modified_indices, modified_sentences, _, _, _ = await refine_selected(trim_request, lane)
     except Exception as e:
-        logging.error(f"Error processing marked output: {str(e)}")
-        # Fall back to returning the original script if there's a critical error
-        meta["error"] = str(e)
-        return [{"line": line, "artDirection": art} for line, art in original_script], meta
+        logging.warning(f"Automatic trim failed, returning the over-length script: {str(e)}")
+        return script, duration
+    trimmed = list(script)
+    for index, sentence in zip(modified_indices, modified_sentences):
+        trimmed[index] = sentence
+    trimmed_duration = estimate_duration(trimmed, request.ad_length)
+    trimmed_duration["trimmed"] = bool(modified_indices)
+    logging.info(f"Automatic trim: {duration['estimated_seconds']}s -> {trimmed_duration['estimated_seconds']}s")
+    return trimmed, trimmed_duration
+
+def speculation_owner(script_id: Optional[str], http_request: Request) -> str:
+    """Whose speculative synthesis a script replaces: the stored script's, or the client's for unstored scripts."""
+    if script_id:
+        return f"script:{script_id}"
+    return client_id_for(http_request.headers, http_request.client.host if http_request.client else None)
+
+def speculate_audio(owner: str, script: List[Dict[str, str]], duration: Dict[str, Any]):
+    """Start synthesizing a script in the background if speculative TTS is on. Over-length scripts are likely to be trimmed first."""
+    if speculative_tts_enabled() and not duration["over_length"]:
+        get_speculative_synthesizer().schedule(owner, [(item.get("line", ""), item.get("artDirection", "")) for item in script])
+
+def script_changes(changes: List[Tuple[int, str, str]]) -> List[Dict[str, Any]]:
+    return [{"index": index, "line": line, "artDirection": art} for index, line, art in changes]
+
+def record_refinement(script_id: str, base_version: Optional[int], original_script: List[Tuple[str, str]],
+                      modified_indices: List[int], modified_sentences: List[Dict[str, str]], instruction: str) -> Dict[str, Any]:
+    """Store a refinement as a new version of a stored script. Only the modified sentences are written."""
+    store = get_script_store()
+    parent_version = base_version if base_version is not None else store.head(script_id)
+    new_script = [tuple(pair) for pair in original_script]
+    for index, sentence in zip(modified_indices, modified_sentences):
+        new_script[index] = (sentence.get("line", ""), sentence.get("artDirection", ""))
+    return store.commit(script_id, parent_version, lines=new_script, metadata={"source": "regenerate_script", "instruction": instruction})
 
 @app.post("/generate_script", response_model=GenerateScriptResponse)
-async def generate_script(request: ScriptRequest):
+async def generate_script(request: ScriptRequest, http_request: Request, lane: str = Depends(admission(CREW_ADMISSION_GATE, "standard"))):
+    return await cancellable(http_request, "generate_script", generate_script_response(request, lane))
+
+async def generate_script_response(request: ScriptRequest, lane: str, interactive: bool = True) -> GenerateScriptResponse:
     try:
-        script_output = await run_crewai_script(request.dict())
-        return GenerateScriptResponse(success=True, script=script_output)
+        brief = request.dict(exclude={"allow_cached", "auto_trim"})
+        cache = get_semantic_cache() if semantic_cache_enabled() and request.allow_cached else None
+        match = cache.lookup(brief) if cache is not None else None
+        if match is not None:
+            # Served from a near-identical brief: no crew run, so no token usage
+            result, score, cached_at = match
+            logging.info(f"Serving generate_script from the near-duplicate cache (similarity {score:.3f})")
+            cache_meta = CacheMetadata(hit=True, score=round(score, 4), cached_at=cached_at)
+            token_usage = routing = None
+        else:
+            result = await execute_job("generate_script", brief, lane)
+            cache_meta = CacheMetadata(hit=False) if cache is not None else None
+            token_usage = result["token_usage"]
+            routing = result.get("routing")
+        script = result["script"]
+        duration = estimate_duration(script, request.ad_length)
+        if duration["over_length"]:
+            logging.warning(f"Generated script is estimated at {duration['estimated_seconds']}s for a {request.ad_length}s ad")
+            if request.auto_trim:
+                script, duration = await trim_to_length(script, request, duration, lane)
+        if cache is not None and match is None:
+            cache.store(brief, {**result, "script": script})
+        version = None
+        if interactive:
+            lines = [(item.get("line", ""), item.get("artDirection", "")) for item in script]
+            try:
+                version = await asyncio.to_thread(get_script_store().create, lines, {"source": "generate_script"})
+            except Exception as e:
+                # The script itself was generated; return it even if it could not be stored
+                logging.warning(f"Could not store generated script: {str(e)}")
+            if version is not None:
+                speculate_audio(f"script:{version['script_id']}", script, duration)
+        return GenerateScriptResponse(
+            success=True,
+            script=script,
+            metadata=ResponseMetadata(token_usage=token_usage, routing=routing, script_version=version, cache=cache_meta, duration=duration)
+        )
     except Exception as e:
         logging.error(f"Error in generate_script endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+CAMPAIGN_MAX_ROWS = int(os.environ.get("ADGEN_CAMPAIGN_MAX_ROWS", "1000"))
+
+async def campaign_row(row: Dict[str, Any], lane: str) -> Dict[str, Any]:
+    """One campaign row: a /generate_script request, run in the campaign's lane. Bulk scripts are neither stored as versions nor synthesized speculatively."""
+    try:
+        request = ScriptRequest(**row)
+    except ValidationError as e:
+        raise RowRejected("; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()))
+    try:
+        response = await generate_script_response(request, lane, interactive=False)
+    except HTTPException as e:
+        # Retried by the campaign runner
+        raise RuntimeError(e.detail)
+    return jsonable_encoder(response)
+
+def campaign_stream(campaign: Dict[str, Any], after: int) -> StreamingResponse:
+    """
+    NDJSON: a `campaign` line with the campaign's id and counts, a `row` line per finished row in
+    completion order (its `seq`, then `result` or `error`), and a `summary` line once all rows are done.
+    """
+    runner = get_campaign_runner(campaign_row)
+    campaign_id = campaign["campaign_id"]
+
+    async def stream():
+        yield json.dumps({"type": "campaign", **campaign}) + "\n"
+        async for result in runner.follow(campaign_id, after):
+            yield json.dumps({"type": "row", **result}) + "\n"
+        summary = await asyncio.to_thread(runner.store.get, campaign_id)
+        yield json.dumps({"type": "summary", **summary}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={"X-Campaign-Id": campaign_id, "X-Accel-Buffering": "no"})
+
+@app.post("/campaigns")
+async def create_campaign(http_request: Request, lane: str = Depends(admission(CREW_ADMISSION_GATE, "bulk"))):
+    """
+    Generate scripts for every row of a CSV or JSONL body of /generate_script requests, and stream the
+    results as NDJSON. The campaign keeps running if the client goes away; resume the stream with
+    GET /campaigns/{campaign_id}/results?after=<last seq seen>.
+    """
+    try:
+        rows = parse_campaign_rows(await http_request.body(), http_request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rows:
+        raise HTTPException(status_code=400, detail="The campaign has no rows")
+    if len(rows) > CAMPAIGN_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"A campaign takes at most {CAMPAIGN_MAX_ROWS} rows, got {len(rows)}")
+    runner = get_campaign_runner(campaign_row)
+    campaign_id = await asyncio.to_thread(runner.store.create, rows, lane)
+    await runner.ensure_running(campaign_id)
+    logging.info(f"Started campaign {campaign_id} with {len(rows)} rows ({lane})")
+    return campaign_stream(await asyncio.to_thread(runner.store.get, campaign_id), 0)
+
+@app.get("/campaigns/{campaign_id}")
+async def get_campaign(campaign_id: str):
+    try:
+        return await asyncio.to_thread(get_campaign_runner(campaign_row).store.get, campaign_id)
+    except CampaignNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.get("/campaigns/{campaign_id}/results")
+async def campaign_results(campaign_id: str, after: int = 0):
+    """Stream the campaign's results after sequence number `after`, resuming the campaign if it was interrupted."""
+    try:
+        campaign = await asyncio.to_thread(get_campaign_runner(campaign_row).store.get, campaign_id)
+    except CampaignNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return campaign_stream(campaign, after)
+
 @app.post("/regenerate_script", response_model=RefineScriptResponse)
-async def regenerate_script(request: RefineRequest):
+async def regenerate_script(request: RefineRequest, http_request: Request, lane: str = Depends(admission(CREW_ADMISSION_GATE, "interactive"))):
+    return await cancellable(http_request, "regenerate_script", regenerate_script_response(request, http_request, lane))
+
+async def regenerate_script_response(request: RefineRequest, http_request: Request, lane: str) -> RefineScriptResponse:
     try:
         logging.info(f"Regenerate script request received for {len(request.selected_sentences)} selected sentences")
         
@@ -465,32 +577,30 @@ async def regenerate_script(request: RefineRequest):
         original_script = request.current_script
         
         try:
-            full_script_output, validation_meta = await run_regenerate_script_crew(request.dict())
-            
-            # Identify which selected sentences were actually modified
-            modified_indices = []
-            modified_sentences = []
+            modified_indices, modified_sentences, validation_meta, token_usage, routing = await refine_selected(request, lane)
             
-            for i in request.selected_sentences:
-                if i < len(full_script_output) and i < len(original_script):
-                    orig_line = original_script[i][0]
-                    orig_art = original_script[i][1]
-                    
-                    new_line = full_script_output[i].get("line", "")
-                    new_art = full_script_output[i].get("artDirection", "")
-                    
-                    # Check if the sentence was actually modified
-                    if new_line != orig_line or new_art != orig_art:
-                        modified_indices.append(i)
-                        modified_sentences.append(full_script_output[i])
+            version = None
+            if request.script_id:
+                try:
+                    version = await asyncio.to_thread(
+                        record_refinement, request.script_id, request.base_version, original_script, modified_indices, modified_sentences, request.improvement_instruction
+                    )
+                except (ScriptNotFound, ValueError) as e:
+                    # The refinement itself succeeded; return it even if it could not be recorded
+                    logging.warning(f"Could not record refinement of script {request.script_id}: {str(e)}")
             
-            logging.info(f"Script regeneration complete. {len(modified_indices)} out of {len(request.selected_sentences)} selected sentences were modified.")
+            refined_script = [{"line": line, "artDirection": art} for line, art in original_script]
+            for index, sentence in zip(modified_indices, modified_sentences):
+                refined_script[index] = sentence
+            duration = estimate_duration(refined_script, request.ad_length)
+            speculate_audio(speculation_owner(request.script_id, http_request), refined_script, duration)
             
             return RefineScriptResponse(
                 status="success",
                 data=modified_sentences,
                 modified_indices=modified_indices,
-                validation=validation_meta
+                validation=validation_meta,
+                metadata=ResponseMetadata(token_usage=token_usage, routing=routing, script_version=version, duration=duration)
             )
         except Exception as e:
             logging.error(f"Error in regenerate_script_crew: {str(e)}")
@@ -503,37 +613,386 @@ async def regenerate_script(request: RefineRequest):
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 @app.post("/generate_audio", response_model=GenerateAudioResponse)
-async def generate_audio(request: AudioRequest):
+async def generate_audio(request: AudioRequest, http_request: Request, lane: str = Depends(admission(TTS_ADMISSION_GATE, "standard"))):
     """
-    Generate audio from a script using the Parler TTS model.
+    Generate audio from a script using the configured TTS backend (Parler TTS by default).
     """
+    return await cancellable(http_request, "audio", generate_audio_response(request, http_request, lane))
+
+async def generate_audio_response(request: AudioRequest, http_request: Request, lane: str) -> GenerateAudioResponse:
     try:
-        # Import here to avoid circular imports
-        from utils.tts_integration.tts_integration import call_parler_tts_api
-        
         # Convert our AudioRequest to a format expected by the TTS integration
         script = [(script.line, script.artDirection) for script in request.script]
+        check_audio_length(request)
 
-        # Generate audio from the script
-        call_parler_tts_api(script)
-        
-        # Return the audio URL
-        return {}
+        # Generate audio from the script and return its URL
+        owner = speculation_owner(request.script_id, http_request)
+        result = await execute_job("audio", {"script": script, "owner": owner, "quality": request.quality}, lane)
+        await get_audio_jobs(audio_job).record(owner, result["audioUrl"])
+        if request.quality == "preview":
+            final_job_id = await render_final(owner, script)
+            return GenerateAudioResponse(audioUrl=result["audioUrl"], quality="preview", finalJobId=final_job_id)
+        return GenerateAudioResponse(audioUrl=result["audioUrl"])
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Audio generation failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate audio: {str(e)}")
 
+async def render_final(owner: str, script: List[Tuple[str, str]]) -> str:
+    """
+    Queue the full-quality render of a previewed script as an audio job in the bulk lane and return its id.
+    A preview of another script supersedes the owner's pending render; the same script reuses it.
+    The audio jobs store keeps track of the pending render, so this holds across API processes too.
+    """
+    return await get_audio_jobs(audio_job).submit_superseding(f"final:{owner}", {"script": script, "owner": owner, "quality": "final"}, "bulk")
+
+def check_audio_length(request: AudioRequest):
+    """Synthesis takes far longer than estimating, so reject over-length scripts before any TTS runs."""
+    if request.ad_length is not None and not request.allow_over_length:
+        duration = estimate_duration([{"line": item.line} for item in request.script], request.ad_length)
+        if duration["over_length"]:
+            raise HTTPException(status_code=422, detail={
+                "message": f"Script is estimated to run {duration['estimated_seconds']}s, over the {request.ad_length}s ad length",
+                "duration": duration,
+            })
+
+# Longest a long poll or a silent event stream is held before answering / sending a keep-alive
+AUDIO_JOB_MAX_WAIT_SECONDS = 60.0
+AUDIO_JOB_KEEPALIVE_SECONDS = 15.0
+
+@app.post("/audio_jobs", response_model=AudioJobStatus, status_code=202)
+async def start_audio_job(request: AudioRequest, http_request: Request, lane: str = Depends(admission(TTS_ADMISSION_GATE, "standard"))):
+    """
+    Start generating audio and return at once. Follow the job with GET /audio_jobs/{job_id}/events
+    (server-sent events) or GET /audio_jobs/{job_id}?after=<version>&wait=<seconds> (long poll).
+    """
+    check_audio_length(request)
+    script = [(item.line, item.artDirection) for item in request.script]
+    jobs = get_audio_jobs(audio_job)
+    job_id = await jobs.submit({"script": script, "owner": speculation_owner(request.script_id, http_request), "quality": request.quality}, lane)
+    return await jobs.get(job_id)
+
+@app.get("/audio_jobs/{job_id}", response_model=AudioJobStatus)
+async def get_audio_job(job_id: str, after: int = -1, wait: float = 0.0):
+    """The job's status, once its version is past `after` or after `wait` seconds (at most 60), whichever is first."""
+    AUDIO_JOB_WATCHERS.labels(transport="long_poll").inc()
+    try:
+        snapshot = await get_audio_jobs(audio_job).wait(job_id, after, min(max(wait, 0.0), AUDIO_JOB_MAX_WAIT_SECONDS))
+    finally:
+        AUDIO_JOB_WATCHERS.labels(transport="long_poll").dec()
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"Unknown audio job {job_id}")
+    return snapshot
+
+@app.get("/audio_jobs/{job_id}/events")
+async def audio_job_events(job_id: str, http_request: Request):
+    """
+    Server-sent events for one job: `progress` on every change, then `complete` (with audioUrl) or `error`.
+    Event ids are the job's versions, so a reconnecting EventSource resumes with Last-Event-ID.
+    """
+    jobs = get_audio_jobs(audio_job)
+    if await jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown audio job {job_id}")
+    try:
+        after = int(http_request.headers.get("last-event-id", "-1"))
+    except ValueError:
+        after = -1
+
+    async def stream():
+        nonlocal after
+        AUDIO_JOB_WATCHERS.labels(transport="sse").inc()
+        try:
+            while True:
+                snapshot = await jobs.wait(job_id, after, AUDIO_JOB_KEEPALIVE_SECONDS)
+                if snapshot is None:
+                    return
+                finished = snapshot["status"] in ("succeeded", "failed", "cancelled")
+                if snapshot["version"] > after:
+                    event = {"succeeded": "complete", "failed": "error", "cancelled": "error"}.get(snapshot["status"], "progress")
+                    yield f"event: {event}\nid: {snapshot['version']}\ndata: {json.dumps(snapshot)}\n\n"
+                    after = snapshot["version"]
+                elif not finished:
+                    yield ": keep-alive\n\n"
+                if finished:
+                    return
+        finally:
+            AUDIO_JOB_WATCHERS.labels(transport="sse").dec()
+
+    # X-Accel-Buffering: nginx would otherwise hold events back until its buffer fills
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/estimate_duration", response_model=DurationEstimate)
+async def estimate_script_duration(request: DurationRequest):
+    """Estimated spoken length of each line and of the whole script, without synthesizing anything."""
+    return estimate_duration([{"line": item.line} for item in request.script], request.ad_length)
+
 @app.get("/audio_status")
-async def audio_status():
+async def audio_status(http_request: Request, script_id: Optional[str] = None):
+    """The caller's latest generated audio: that of the stored script `script_id`, or of the client for unstored scripts."""
     try:
-        if os.exist("/home/azureuser/marketing-app-ad-gen/full_script_audio.wav"):
-            from tts_integration import result_path
-            return GenerateAudioResponse(audioUrl=result_path)
-        else:
-            return {}
+        audio_url = await get_audio_jobs(audio_job).latest(speculation_owner(script_id, http_request))
+        return GenerateAudioResponse(audioUrl=audio_url) if audio_url else {}
     except Exception as e:
-        logging.error(f"Audio generation failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to generate audio: {str(e)}")
+        logging.error(f"Audio status check failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to check audio status: {str(e)}")
+
+@app.get("/audio/{file_name}")
+async def get_audio_file(file_name: str):
+    """Serve a generated audio file from the audio result directory, or from the artifact store in distributed mode."""
+    if Path(file_name).name != file_name or Path(file_name).suffix != ".wav":
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    if execution_mode() == "distributed":
+        audio_path = get_artifact_store().path_for(f"audio/{file_name}")
+    else:
+        from utils.tts_integration.tts_integration import result_path
+        audio_path = Path(result_path).parent / file_name
+    if not audio_path.is_file():
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    return FileResponse(audio_path, media_type="audio/wav")
+
+@app.post("/scripts", response_model=ScriptVersionInfo)
+async def create_script(request: CreateScriptRequest):
+    """Store a script as version 1 of a new script history."""
+    lines = [(item.line, item.artDirection) for item in request.script]
+    return await asyncio.to_thread(get_script_store().create, lines, request.metadata)
+
+@app.post("/scripts/{script_id}/versions", response_model=ScriptVersionEntry)
+async def commit_script_version(script_id: str, request: CommitScriptVersionRequest):
+    """Store a new version from either the full script or the changes against its parent. Only the delta is kept."""
+    if (request.script is None) == (request.changes is None):
+        raise HTTPException(status_code=400, detail="Provide either script or changes")
+    lines = [(item.line, item.artDirection) for item in request.script] if request.script is not None else None
+    changes = [(item.index, item.line, item.artDirection) for item in request.changes] if request.changes is not None else None
+    try:
+        info = await asyncio.to_thread(
+            get_script_store().commit, script_id, request.parent_version, lines, changes, request.length, request.metadata
+        )
+    except ScriptNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**info, "changes": script_changes(info["changes"])}
+
+@app.get("/scripts/{script_id}/versions/{version}", response_model=ScriptVersionResponse)
+async def get_script_version(script_id: str, version: int):
+    """Return a version of a stored script in full, rebuilt from its deltas."""
+    store = get_script_store()
+    try:
+        info = await asyncio.to_thread(store.info, script_id, version)
+        lines = await asyncio.to_thread(store.get, script_id, version)
+    except ScriptNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return {**info, "script": [{"line": line, "artDirection": art} for line, art in lines]}
+
+@app.get("/scripts/{script_id}", response_model=ScriptVersionResponse)
+async def get_script(script_id: str):
+    """Return the latest version of a stored script in full."""
+    try:
+        head = await asyncio.to_thread(get_script_store().head, script_id)
+    except ScriptNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return await get_script_version(script_id, head)
+
+@app.get("/scripts/{script_id}/history", response_model=ScriptHistoryResponse)
+async def get_script_history(script_id: str, since: int = 0, limit: int = 100):
+    """Versions after `since`, each as changes against its parent, so clients can fetch history incrementally."""
+    store = get_script_store()
+    try:
+        head = await asyncio.to_thread(store.head, script_id)
+        versions = await asyncio.to_thread(store.history, script_id, since, min(max(limit, 1), 1000))
+    except ScriptNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return ScriptHistoryResponse(
+        script_id=script_id,
+        head_version=head,
+        versions=[{**entry, "changes": script_changes(entry["changes"])} for entry in versions],
+    )
+
+@app.get("/scripts/{script_id}/diff", response_model=ScriptDiffResponse)
+async def get_script_diff(script_id: str, from_version: int, to_version: int):
+    """Changes that turn one version of a stored script into another."""
+    try:
+        diff = await asyncio.to_thread(get_script_store().diff, script_id, from_version, to_version)
+    except ScriptNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return {**diff, "changes": script_changes(diff["changes"])}
+
+@contextmanager
+def session_errors():
+    """Map session and version store errors to HTTP errors."""
+    try:
+        yield
+    except (SessionNotFound, ScriptNotFound) as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except SessionConflict as e:
+        raise HTTPException(status_code=409, detail={
+            "message": "The script changed since base_hash; fetch the session to resync",
+            "version": e.session["version"],
+            "content_hash": e.session["content_hash"],
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def session_response(session: Dict[str, Any], lines: List[Tuple[str, str]]) -> SessionResponse:
+    return SessionResponse(
+        session_id=session["session_id"],
+        script_id=session["script_id"],
+        version=session["version"],
+        content_hash=session["content_hash"],
+        script=[Script(line=line, artDirection=art) for line, art in lines],
+    )
+
+async def get_session_state(session_id: str) -> SessionResponse:
+    store = get_session_store()
+    with session_errors():
+        session = await asyncio.to_thread(store.get, session_id)
+        lines = await asyncio.to_thread(store.script, session)
+    return session_response(session, lines)
+
+async def refine_session(session_id: str, request: SessionRefineRequest, lane: str) -> SessionDeltaResponse:
+    """Refine the selected sentences of a session's script and move the session to the result."""
+    store = get_session_store()
+    with session_errors():
+        session = await asyncio.to_thread(store.check, session_id, request.base_hash)
+        lines = await asyncio.to_thread(store.script, session)
+    if not request.selected_sentences:
+        raise HTTPException(status_code=400, detail="At least one sentence must be selected for refinement")
+    if not request.improvement_instruction:
+        raise HTTPException(status_code=400, detail="An improvement instruction must be provided")
+    if any(index < 0 or index >= len(lines) for index in request.selected_sentences):
+        raise HTTPException(status_code=400, detail=f"Selected sentences must be between 0 and {len(lines) - 1}")
+
+    refine_request = RefineRequest(
+        selected_sentences=request.selected_sentences,
+        improvement_instruction=request.improvement_instruction,
+        current_script=lines,
+        **session["context"],
+    )
+    try:
+        modified_indices, modified_sentences, validation_meta, token_usage, routing = await refine_selected(refine_request, lane)
+    except Exception as e:
+        logging.error(f"Error refining session {session_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to regenerate script: {str(e)}")
+
+    changes = [(index, sentence.get("line", ""), sentence.get("artDirection", "")) for index, sentence in zip(modified_indices, modified_sentences)]
+    with session_errors():
+        # Compare-and-set against the version the crew refined, not the client's hash
+        result = await asyncio.to_thread(
+            store.advance, session_id, session["content_hash"], None, changes, None,
+            {"source": "session_refine", "instruction": request.improvement_instruction},
+        )
+    return SessionDeltaResponse(
+        **{**result, "changes": script_changes(result["changes"])},
+        modified_indices=modified_indices,
+        validation=validation_meta,
+        metadata=ResponseMetadata(token_usage=token_usage, routing=routing),
+    )
+
+async def apply_session_changes(session_id: str, request: SessionChangesRequest) -> SessionDeltaResponse:
+    """Record edits made on the client (such as manual rewording) so the session stays in sync."""
+    changes = [(item.index, item.line, item.artDirection) for item in request.changes]
+    with session_errors():
+        result = await asyncio.to_thread(
+            get_session_store().advance, session_id, request.base_hash, None, changes, request.length, {"source": "session_edit"}
+        )
+    return SessionDeltaResponse(**{**result, "changes": script_changes(result["changes"])})
+
+@app.post("/sessions", response_model=SessionResponse)
+async def open_session(request: OpenSessionRequest):
+    """
+    Start an editing session on a script. The server keeps the script and its refinement context, so
+    refine calls only send the selected sentences and the instruction.
+    """
+    if (request.script is None) == (request.script_id is None):
+        raise HTTPException(status_code=400, detail="Provide either script or script_id")
+    context = {
+        "key_selling_points": request.key_selling_points,
+        "tone": request.tone,
+        "ad_length": request.ad_length,
+        "prompt_mode": request.prompt_mode,
+    }
+    lines = [(item.line, item.artDirection) for item in request.script] if request.script is not None else None
+    store = get_session_store()
+    with session_errors():
+        session = await asyncio.to_thread(store.open, context, lines, request.script_id, request.version)
+        lines = await asyncio.to_thread(store.script, session)
+    return session_response(session, lines)
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    """Current script of a session in full, for clients whose copy no longer matches the hash."""
+    return await get_session_state(session_id)
+
+@app.post("/sessions/{session_id}/refine", response_model=SessionDeltaResponse)
+async def refine_session_endpoint(session_id: str, request: SessionRefineRequest, http_request: Request, lane: str = Depends(admission(CREW_ADMISSION_GATE, "interactive"))):
+    """Refine selected sentences; the response carries only the changes and the hashes before and after."""
+    return await cancellable(http_request, "regenerate_script", refine_session(session_id, request, lane))
+
+@app.post("/sessions/{session_id}/changes", response_model=SessionDeltaResponse)
+async def session_changes(session_id: str, request: SessionChangesRequest):
+    return await apply_session_changes(session_id, request)
+
+@app.delete("/sessions/{session_id}")
+async def close_session(session_id: str):
+    await asyncio.to_thread(get_session_store().close, session_id)
+    return {"status": "closed"}
+
+@app.websocket("/sessions/{session_id}/ws")
+async def session_socket(websocket: WebSocket, session_id: str):
+    """
+    The session API over one connection, for rapid edit loops. Each JSON message has a "type" ("get",
+    "refine" or "changes"), the fields of the matching HTTP request and an optional "id" echoed in the
+    reply. Replies are {"type": "result", "id", "data"} or {"type": "error", "id", "status", "detail"}.
+    """
+    await websocket.accept()
+    peer_host = websocket.client.host if websocket.client else None
+    try:
+        while True:
+            message = await websocket.receive_json()
+            message_type, message_id = message.get("type"), message.get("id")
+            try:
+                with start_span("session.ws_message", session_id=session_id, type=str(message_type)):
+                    if message_type == "get":
+                        result = await get_session_state(session_id)
+                    elif message_type == "refine":
+                        # Every refine is admitted like an HTTP request, so one socket cannot bypass the limits
+                        lane = admit_client(websocket.headers, peer_host, websocket.url.path, CREW_ADMISSION_GATE, "interactive")
+                        result = await refine_session(session_id, SessionRefineRequest(**message), lane)
+                    elif message_type == "changes":
+                        result = await apply_session_changes(session_id, SessionChangesRequest(**message))
+                    else:
+                        raise HTTPException(status_code=400, detail=f"Unknown message type '{message_type}'")
+                await websocket.send_json({"type": "result", "id": message_id, "data": jsonable_encoder(result)})
+            except HTTPException as e:
+                await websocket.send_json({
+                    "type": "error",
+                    "id": message_id,
+                    "status": e.status_code,
+                    "detail": e.detail,
+                    "retry_after": (e.headers or {}).get("Retry-After"),
+                })
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "id": message_id, "status": 422, "detail": jsonable_encoder(e.errors())})
+    except WebSocketDisconnect:
+        logging.debug("Session socket for %s closed", session_id)
+
+@app.get("/metrics")
+async def metrics():
+    """Expose stage latencies, queue depth, in-flight jobs, cache and validation counters for Prometheus."""
+    for backend in loaded_tts_backends():
+        backend.report_memory()
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/profiles/{trace_id}")
+async def get_profile(trace_id: str, http_request: Request):
+    """The profile report of a request sent with X-Profile. Admin only."""
+    if not is_admin(http_request.headers):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    report = await asyncio.to_thread(get_profile_store().get, trace_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
 
 @app.get("/test_connection")
 async def test_connection():
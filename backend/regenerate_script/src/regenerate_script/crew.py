@@ -2,6 +2,12 @@
 from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 from pathlib import Path
+import os
+
+# Verbose crew output is useful in development; the API sets CREW_VERBOSE=false in production
+CREW_VERBOSE = os.environ.get("CREW_VERBOSE", "true").lower() != "false"
+# Model picked for this run by the API's model router; unset keeps the agents' default LLM
+CREW_LLM_MODEL = os.environ.get("CREW_LLM_MODEL")
 
 @CrewBase
 class ScriptRefinement():
@@ -57,8 +63,13 @@ class ScriptRefinement():
     """
 
     # Load the YAML configuration files for agents and tasks.
-    agents_config = 'config/agents.yaml'
-    tasks_config = 'config/tasks.yaml'
+    # CREW_PROMPT_MODE=compact selects the leaner prompt variants with short markers.
+    if os.environ.get("CREW_PROMPT_MODE") == "compact":
+        agents_config = 'config/agents_compact.yaml'
+        tasks_config = 'config/tasks_compact.yaml'
+    else:
+        agents_config = 'config/agents.yaml'
+        tasks_config = 'config/tasks.yaml'
 
     @agent
     def refine_script_generator(self) -> Agent:
@@ -78,7 +89,8 @@ class ScriptRefinement():
         """
         return Agent(
             config=self.agents_config['refine_script_generator'],
-            verbose=True
+            verbose=CREW_VERBOSE,
+            **({"llm": CREW_LLM_MODEL} if CREW_LLM_MODEL else {})
         )
 
     @task
@@ -98,9 +110,14 @@ class ScriptRefinement():
         # Create a task for the script refinement
         print("Creating script refinement task...")
         
-        # Use an absolute path that will work on the server
-        output_path = Path("/home/azureuser/marketing-app-ad-gen/backend/regenerate_script/refined_script.md")
+        # Get output path from environment variable or use an absolute path that will work on the server
+        env_output_path = os.environ.get("REFINED_SCRIPT_OUTPUT_PATH")
+        if env_output_path:
+            output_path = Path(env_output_path)
+        else:
+            output_path = Path("/home/azureuser/marketing-app-ad-gen/backend/regenerate_script/refined_script.md")
         print(f"Expected output path: {output_path}")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
         
         task = Task(
             config=self.tasks_config['refine_script_task'],
@@ -127,5 +144,5 @@ class ScriptRefinement():
             agents=self.agents,  # Automatically created by the @agent decorator.
             tasks=self.tasks,    # Automatically created by the @task decorator.
             process=Process.sequential,
-            verbose=True,
+            verbose=CREW_VERBOSE,
         )
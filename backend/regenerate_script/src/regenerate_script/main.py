@@ -3,6 +3,11 @@ import sys
 import warnings
 import os
 import json
+import time
+
+# Recorded before the crew imports so the worker startup span covers them
+process_started_at = time.time()
+
 from regenerate_script.crew import ScriptRefinement
 import dotenv 
 
@@ -57,7 +62,18 @@ def run(inputs: dict):
     - The system will verify compliance with modification constraints
     """
     try:
-        ScriptRefinement().crew().kickoff(inputs=inputs)
+        crew = ScriptRefinement().crew()
+        reporting = bool(os.environ.get("CREW_REPORT_PATH"))
+        if reporting:
+            # Only the API process asks for a report, and it puts the backend on PYTHONPATH; `crewai run` does neither
+            from utils.crew_runner.crew_report import TaskUsageRecorder, write_run_report
+            task_usage = TaskUsageRecorder(crew)
+        kickoff_started_at = time.time()
+        started = time.perf_counter()
+        result = crew.kickoff(inputs=inputs)
+        if reporting:
+            write_run_report(result, process_started_at, kickoff_started_at, time.perf_counter() - started, task_usage.tasks,
+                             prompt_mode=os.environ.get("CREW_PROMPT_MODE", "full"))
     except Exception as e:
         raise Exception(f"An error occurred while running the refinement crew: {e}")
 
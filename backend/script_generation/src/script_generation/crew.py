@@ -4,6 +4,11 @@ from crewai.project import CrewBase, agent, crew, task
 from pathlib import Path
 import os
 
+# Verbose crew output is useful in development; the API sets CREW_VERBOSE=false in production
+CREW_VERBOSE = os.environ.get("CREW_VERBOSE", "true").lower() != "false"
+# Model picked for this run by the API's model router; unset keeps the agents' default LLM
+CREW_LLM_MODEL = os.environ.get("CREW_LLM_MODEL")
+
 @CrewBase
 class ScriptGeneration():
     """
@@ -33,7 +38,8 @@ class ScriptGeneration():
     def ad_script_generator(self) -> Agent:
         return Agent(
             config=self.agents_config['ad_script_generator'],
-            verbose=True
+            verbose=CREW_VERBOSE,
+            **({"llm": CREW_LLM_MODEL} if CREW_LLM_MODEL else {})
         )
 
 
@@ -75,6 +81,6 @@ class ScriptGeneration():
             agents=self.agents,  # Automatically created by the @agent decorator.
             tasks=self.tasks,    # Automatically created by the @task decorator.
             process=Process.sequential,
-            verbose=True,
+            verbose=CREW_VERBOSE,
 			# process=Process.hierarchical, # In case you wanna use that instead https://docs.crewai.com/how-to/Hierarchical/
         )
@@ -4,6 +4,10 @@ import warnings
 import os
 import dotenv
 import json
+import time
+
+# Recorded before the crew imports so the worker startup span covers them
+process_started_at = time.time()
 
 from script_generation.crew import ScriptGeneration
 
@@ -22,7 +26,17 @@ def run(inputs: dict):
     Run the ScriptGeneration crew with inputs for generating an ad script and art direction.
     """
     try:
-        ScriptGeneration().crew().kickoff(inputs=inputs)
+        crew = ScriptGeneration().crew()
+        reporting = bool(os.environ.get("CREW_REPORT_PATH"))
+        if reporting:
+            # Only the API process asks for a report, and it puts the backend on PYTHONPATH; `crewai run` does neither
+            from utils.crew_runner.crew_report import TaskUsageRecorder, write_run_report
+            task_usage = TaskUsageRecorder(crew)
+        kickoff_started_at = time.time()
+        started = time.perf_counter()
+        result = crew.kickoff(inputs=inputs)
+        if reporting:
+            write_run_report(result, process_started_at, kickoff_started_at, time.perf_counter() - started, task_usage.tasks)
     except Exception as e:
         raise Exception(f"An error occurred while running the crew: {e}")
 
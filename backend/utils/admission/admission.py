@@ -0,0 +1,276 @@
+"""
+Admission control for the expensive endpoints.
+
+Two checks run before a crew or TTS job is accepted:
+
+- a token bucket per client (API key, or IP address) limits how fast one client can submit jobs,
+- a JobGate per job kind caps how many jobs run at once and how many may wait for a slot.
+
+Rejected requests get a 429 with a Retry-After header straight away, so a burst is turned away
+in microseconds instead of piling up subprocesses and model runs until the box runs out of memory.
+The Retry-After of a full queue is estimated from the durations of recently completed jobs.
+"""
+
+import hashlib
+import hmac
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from utils.observability.metrics import ADMISSION_REJECTIONS, JOBS_IN_FLIGHT, QUEUE_DEPTH
+from utils.observability.stages import stage
+from utils.scheduling.scheduler import LANES, PriorityScheduler, lane_rank
+
+# Peers whose X-Real-IP / X-Forwarded-For are trusted: the local nginx by default, plus e.g. the
+# frontend's proxy routes. Proxies without a fixed address (serverless) send ADGEN_PROXY_SECRET instead.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.environ.get("ADGEN_TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+    if network.strip()
+]
+PROXY_SECRET = os.environ.get("ADGEN_PROXY_SECRET", "")
+
+
+class Rejection:
+    """Why a request was turned away and when the client should retry."""
+
+    def __init__(self, kind: str, reason: str, retry_after: float, detail: str):
+        self.kind = kind
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = detail
+
+    @property
+    def retry_after_header(self) -> str:
+        # Retry-After takes whole seconds; rounding down would invite a retry that is rejected again
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def take(self, now: float, cost: float = 1.0) -> float:
+        """Take `cost` tokens if available. Returns 0 on success, otherwise the seconds until enough tokens accrue."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by client id.
+    Only the most recently seen max_clients buckets are kept; an evicted client simply starts again with a full bucket.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int, max_clients: int = 10000):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, client_id: str, cost: float = 1.0) -> float:
+        """Returns 0 if the client may proceed, otherwise the seconds to wait before retrying."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client_id)
+            if bucket is None:
+                bucket = self._buckets[client_id] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client_id)
+            return bucket.take(now, cost)
+
+
+def estimate_retry_after(ahead: int, running: int, max_queue: int, capacity: int, mean_job_seconds: float) -> Optional[float]:
+    """
+    None if a new job would be admitted behind `ahead` waiting jobs, otherwise the estimated seconds until it would be.
+    The queue drains at `capacity` jobs per mean job duration; the estimate is the time until it is one below max_queue.
+    """
+    if ahead < max_queue or running + ahead < capacity:
+        return None
+    return (ahead - max_queue + 1) * mean_job_seconds / capacity
+
+
+class JobGate:
+    """
+    Caps the number of jobs of one kind that run at once and bounds the queue in front of them.
+
+    Jobs wait for a slot in `slot()`, where a PriorityScheduler decides which lane goes next.
+    A new request is only admitted while fewer than max_queue jobs of its lane or higher lanes are
+    waiting, so a backlog of bulk work never turns interactive requests away. Past that,
+    `retry_after()` estimates how long until the queue has room, from the mean duration of the last
+    completed jobs.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, default_job_seconds: float, window: int = 50):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.default_job_seconds = default_job_seconds
+        self.scheduler = PriorityScheduler(
+            name,
+            self.max_in_flight,
+            weights=parse_lane_weights(os.environ.get("ADGEN_SCHEDULER_WEIGHTS", "")),
+            max_wait_seconds=float(os.environ.get("ADGEN_SCHEDULER_MAX_WAIT_SECONDS", "120")),
+        )
+        self._recent_durations = deque(maxlen=window)
+
+    @property
+    def waiting(self) -> int:
+        return self.scheduler.waiting()
+
+    @property
+    def running(self) -> int:
+        return self.scheduler.running
+
+    def mean_job_seconds(self) -> float:
+        if not self._recent_durations:
+            return self.default_job_seconds
+        return sum(self._recent_durations) / len(self._recent_durations)
+
+    def retry_after(self, lane: str = "standard") -> Optional[float]:
+        """None while a new job in `lane` would be queued, otherwise the estimated seconds until one would be."""
+        return estimate_retry_after(self.scheduler.waiting(lane), self.running, self.max_queue, self.max_in_flight, self.mean_job_seconds())
+
+    @asynccontextmanager
+    async def slot(self, label: Optional[str] = None, pipeline: Optional[str] = None, lane: str = "standard"):
+        """
+        Wait for an execution slot in the given priority lane. `label` is the kind reported in the queue
+        depth and in-flight gauges; with a `pipeline`, the wait is recorded as that pipeline's queue_wait stage.
+        """
+        label = label or self.name
+        queue_depth = QUEUE_DEPTH.labels(kind=label)
+        in_flight = JOBS_IN_FLIGHT.labels(kind=label)
+
+        queue_depth.inc()
+        try:
+            if pipeline:
+                with stage(pipeline, "queue_wait", lane=lane):
+                    await self.scheduler.acquire(lane)
+            else:
+                await self.scheduler.acquire(lane)
+        finally:
+            queue_depth.dec()
+
+        in_flight.inc()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._recent_durations.append(time.monotonic() - started)
+            in_flight.dec()
+            self.scheduler.release(lane)
+
+
+def parse_lane_weights(spec: str) -> Dict[str, float]:
+    """Parse "interactive=6,standard=3,bulk=1"; lanes left out keep their default weight."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        lane, _, weight = item.partition("=")
+        if lane.strip() not in LANES:
+            raise ValueError(f"Unknown scheduler lane '{lane.strip()}', expected one of {LANES}")
+        weights[lane.strip()] = float(weight)
+    return weights
+
+
+def lane_for(headers, default_lane: str) -> str:
+    """
+    Lane for a request: the endpoint's default, or a lower priority lane requested with X-Priority.
+    Clients can move their own batch work out of the way but cannot jump ahead of interactive edits.
+    """
+    requested = headers.get("x-priority", "").strip().lower()
+    if requested in LANES and lane_rank(requested) > lane_rank(default_lane):
+        return requested
+    return default_lane
+
+
+def is_trusted_proxy(headers, peer_host: Optional[str]) -> bool:
+    """Whether the peer is a proxy allowed to name the client: by address, or by the shared X-Proxy-Secret."""
+    secret = headers.get("x-proxy-secret")
+    if PROXY_SECRET and secret and hmac.compare_digest(secret.encode(), PROXY_SECRET.encode()):
+        return True
+    if peer_host == "localhost":
+        return True
+    try:
+        address = ipaddress.ip_address(peer_host or "")
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_id_for(headers, peer_host: Optional[str]) -> str:
+    """
+    Identify the client for rate limiting: its API key if one is sent, otherwise its IP address.
+    X-Real-IP / X-Forwarded-For are only trusted from a trusted proxy.
+    """
+    api_key = headers.get("x-api-key")
+    if not api_key and headers.get("authorization", "").lower().startswith("bearer "):
+        api_key = headers["authorization"][len("bearer "):]
+    if api_key:
+        # Keep hashes rather than raw keys in memory
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    if is_trusted_proxy(headers, peer_host):
+        forwarded = headers.get("x-real-ip") or headers.get("x-forwarded-for", "").split(",")[0].strip()
+        if forwarded:
+            return "ip:" + forwarded
+    return "ip:" + (peer_host or "unknown")
+
+
+RATE_LIMITER = RateLimiter(
+    requests_per_minute=float(os.environ.get("ADGEN_RATE_LIMIT_PER_MINUTE", "30")),
+    burst=int(os.environ.get("ADGEN_RATE_LIMIT_BURST", "10")),
+)
+
+# Every crew job is a Python subprocess of a few hundred MB, so the cap bounds memory as much as CPU
+CREW_GATE = JobGate(
+    "crew",
+    max_in_flight=int(os.environ.get("ADGEN_MAX_CREW_JOBS", "4")),
+    max_queue=int(os.environ.get("ADGEN_MAX_CREW_QUEUE", "16")),
+    default_job_seconds=30.0,
+)
+# One TTS model is loaded per process; concurrent jobs mostly compete for the same cores. With the
+# default single slot the bulk lane limit cannot keep a slot free, so bulk TTS work must take the slot
+# one line at a time (generate_audio_from_script does so for the bulk lane) and other lanes wait for at
+# most one line.
+TTS_GATE = JobGate(
+    "tts",
+    max_in_flight=int(os.environ.get("ADGEN_MAX_TTS_JOBS", "1")),
+    max_queue=int(os.environ.get("ADGEN_MAX_TTS_QUEUE", "4")),
+    default_job_seconds=60.0,
+)
+
+
+def check_admission(client_id: str, gate: JobGate, lane: str = "standard") -> Optional[Rejection]:
+    """Decide whether to accept a new job for `gate` in `lane` from `client_id`. Returns None if admitted."""
+    retry_after = gate.retry_after(lane)
+    if retry_after is not None:
+        ADMISSION_REJECTIONS.labels(kind=gate.name, reason="queue_full").inc()
+        return Rejection(gate.name, "queue_full", retry_after, f"Server busy: {gate.waiting} {gate.name} jobs are queued")
+    # Checked second so that requests turned away for a full queue do not use up the client's budget
+    retry_after = RATE_LIMITER.check(client_id)
+    if retry_after:
+        ADMISSION_REJECTIONS.labels(kind=gate.name, reason="rate_limited").inc()
+        return Rejection(gate.name, "rate_limited", retry_after, "Rate limit exceeded")
+    return None
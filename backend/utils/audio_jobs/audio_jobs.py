@@ -0,0 +1,260 @@
+"""
+Audio jobs with progress, for pushing completion to clients instead of having them poll.
+
+POST /audio_jobs starts a job and returns its id; clients then hold one connection per job, either a
+server-sent event stream or a long poll, and get a new snapshot whenever the job moves: queued,
+running with each synthesized line (lines done, estimated seconds remaining), and finally succeeded
+with the audio URL or failed with the error.
+
+Snapshots carry a version that grows with every change (0 queued, 1 + lines done while running,
+lines + 2 once finished), so a client can resume from the last version it saw.
+
+In local execution mode jobs run in this process and waiters are woken on every change. In
+distributed mode the workers write progress to the job registry and waiters poll their row, so any
+API process can serve any job's events.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from utils.duration.duration_estimator import get_duration_estimator, tts_backend_name
+from utils.job_registry.dispatch import execution_mode, get_registry
+from utils.job_registry.registry import TERMINAL_STATUSES, JobRegistry
+from utils.observability.tracing import current_traceparent
+
+AUDIO_JOB_RETENTION_SECONDS = float(os.environ.get("ADGEN_AUDIO_JOB_RETENTION_SECONDS", "3600"))
+# Owners whose latest audio is remembered in local mode, least recently finished dropped first
+MAX_LATEST_AUDIO_OWNERS = 1024
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class AudioProgress:
+    """
+    Called with the number of lines done (0 once the job holds its TTS slot). Reports lines done and
+    the estimated seconds remaining: the time taken so far, scaled by the estimated spoken length of
+    the remaining lines over that of the lines done.
+    """
+
+    def __init__(self, script_lines: Sequence[Tuple[str, str]], report: ProgressCallback):
+        estimator = get_duration_estimator()
+        backend = tts_backend_name()
+        # Floor each line so that even an empty line takes some time
+        self.line_weights = [max(0.1, estimator.estimate_line(line, backend)) for line, _ in script_lines]
+        self.report = report
+        self.started_at: Optional[float] = None
+
+    async def __call__(self, lines_done: int):
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        done = sum(self.line_weights[:lines_done])
+        eta_seconds = None
+        if done > 0:
+            eta_seconds = round((time.monotonic() - self.started_at) * sum(self.line_weights[lines_done:]) / done, 1)
+        await self.report({"lines_done": lines_done, "lines_total": len(self.line_weights), "eta_seconds": eta_seconds})
+
+
+def audio_job_snapshot(job_id: str, status: str, lines_total: int, progress: Optional[Dict[str, Any]] = None,
+                       audio_url: Optional[str] = None, error: Optional[str] = None) -> Dict[str, Any]:
+    progress = progress or {}
+    lines_done = progress.get("lines_done", 0)
+    eta_seconds = progress.get("eta_seconds")
+    if status in TERMINAL_STATUSES:
+        version = lines_total + 2
+        if status == "succeeded":
+            lines_done, eta_seconds = lines_total, 0.0
+    elif status == "running":
+        version = 1 + lines_done
+    else:
+        version = 0
+    return {
+        "job_id": job_id,
+        "status": status,
+        "version": version,
+        "lines_done": lines_done,
+        "lines_total": lines_total,
+        "eta_seconds": eta_seconds,
+        "audioUrl": audio_url,
+        "error": error,
+    }
+
+
+class LocalAudioJobs:
+    """Audio jobs run by this process. `handler(payload, lane, job_id=..., on_progress=...)` returns {"audioUrl": ...}."""
+
+    def __init__(self, handler: Callable[..., Awaitable[Dict[str, Any]]], retention_seconds: float = AUDIO_JOB_RETENTION_SECONDS):
+        self.handler = handler
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # Set and replaced on every change of the job
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Latest job and its payload per supersede key, while the job is kept
+        self._latest: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._latest_audio: "OrderedDict[str, str]" = OrderedDict()
+
+    async def submit(self, payload: Dict[str, Any], lane: str) -> str:
+        self._prune()
+        return self._start(payload, lane)
+
+    async def submit_superseding(self, key: str, payload: Dict[str, Any], lane: str) -> str:
+        """
+        Submit a job as the latest for `key`, cancelling the key's previous job if it is still queued or running.
+        If that job has the same payload and has not failed or been cancelled, it is kept and its id returned instead.
+        """
+        self._prune()
+        # No awaits from here on, so concurrent submissions for one key cannot interleave
+        previous = self._latest.get(key)
+        if previous is not None:
+            previous_id, previous_payload = previous
+            if previous_payload == payload and self._jobs[previous_id]["status"] not in ("failed", "cancelled"):
+                return previous_id
+            self._cancel(previous_id)
+        job_id = self._start(payload, lane)
+        self._latest[key] = (job_id, payload)
+        return job_id
+
+    def _start(self, payload: Dict[str, Any], lane: str) -> str:
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {"status": "queued", "lines_total": len(payload["script"]), "progress": {}, "audio_url": None, "error": None, "finished_at": None}
+        self._changed[job_id] = asyncio.Event()
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id, payload, lane))
+        return job_id
+
+    async def _run(self, job_id: str, payload: Dict[str, Any], lane: str):
+        async def on_progress(progress: Dict[str, Any]):
+            self._update(job_id, status="running", progress=progress)
+
+        try:
+            result = await self.handler(payload, lane, job_id=job_id, on_progress=on_progress)
+            self._update(job_id, status="succeeded", audio_url=result["audioUrl"], finished_at=time.time())
+            await self.record(payload.get("owner"), result["audioUrl"])
+        except asyncio.CancelledError:
+            self._update(job_id, status="cancelled", error="Cancelled", finished_at=time.time())
+        except Exception as e:
+            logging.error(f"Audio job {job_id} failed: {str(e)}")
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            self._tasks.pop(job_id, None)
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. False if it had already finished."""
+        return self._cancel(job_id)
+
+    def _cancel(self, job_id: str) -> bool:
+        task = self._tasks.pop(job_id, None)
+        if task is None:
+            return False
+        # Marked here too: a task cancelled before it first runs never reaches its handler
+        task.cancel()
+        self._update(job_id, status="cancelled", error="Cancelled", finished_at=time.time())
+        return True
+
+    async def record(self, owner: Optional[str], audio_url: str):
+        """Remember the owner's latest audio, including audio rendered outside a job (synchronous /generate_audio)."""
+        if owner is None:
+            return
+        self._latest_audio[owner] = audio_url
+        self._latest_audio.move_to_end(owner)
+        while len(self._latest_audio) > MAX_LATEST_AUDIO_OWNERS:
+            self._latest_audio.popitem(last=False)
+
+    async def latest(self, owner: str) -> Optional[str]:
+        """URL of the owner's most recently finished audio, if any."""
+        return self._latest_audio.get(owner)
+
+    def _update(self, job_id: str, **changes):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.update(changes)
+        self._changed.pop(job_id).set()
+        self._changed[job_id] = asyncio.Event()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+            self._changed.pop(job_id).set()
+        for key in [key for key, (job_id, _) in self._latest.items() if job_id not in self._jobs]:
+            del self._latest[key]
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return audio_job_snapshot(job_id, job["status"], job["lines_total"], job["progress"], job["audio_url"], job["error"])
+
+    async def wait(self, job_id: str, after: int, timeout: float) -> Optional[Dict[str, Any]]:
+        """The job's snapshot once its version is past `after`, or after `timeout` seconds. None for an unknown job."""
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self._changed.get(job_id)
+            snapshot = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if snapshot is None or snapshot["version"] > after or snapshot["status"] in TERMINAL_STATUSES or remaining <= 0:
+                return snapshot
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+class RegistryAudioJobs:
+    """Audio jobs in the shared job registry (distributed mode), run and reported on by the workers."""
+
+    def __init__(self, registry: JobRegistry, poll_interval: float = 0.5):
+        self.registry = registry
+        self.poll_interval = poll_interval
+
+    async def submit(self, payload: Dict[str, Any], lane: str) -> str:
+        return await asyncio.to_thread(self.registry.submit, "audio", payload, lane, current_traceparent())
+
+    async def submit_superseding(self, key: str, payload: Dict[str, Any], lane: str) -> str:
+        return await asyncio.to_thread(self.registry.submit_superseding, "audio", key, payload, lane, current_traceparent())
+
+    async def cancel(self, job_id: str) -> bool:
+        # The worker running it notices at its next lease renewal
+        return await asyncio.to_thread(self.registry.cancel, job_id)
+
+    async def record(self, owner: Optional[str], audio_url: str):
+        # Every audio render in this mode is a registry job, which records its owner and result itself
+        pass
+
+    async def latest(self, owner: str) -> Optional[str]:
+        job = await asyncio.to_thread(self.registry.latest, "audio", "succeeded", owner)
+        return job["result"]["audioUrl"] if job else None
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await asyncio.to_thread(self.registry.get, job_id)
+        if job is None or job["kind"] != "audio":
+            return None
+        return audio_job_snapshot(
+            job_id, job["status"], len(job["payload"]["script"]), job["progress"],
+            (job["result"] or {}).get("audioUrl"), job["error"],
+        )
+
+    async def wait(self, job_id: str, after: int, timeout: float) -> Optional[Dict[str, Any]]:
+        # One registry read per poll interval per waiter, instead of one client round trip per poll
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = await self.get(job_id)
+            if snapshot is None or snapshot["version"] > after or snapshot["status"] in TERMINAL_STATUSES or time.monotonic() >= deadline:
+                return snapshot
+            await asyncio.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+
+_audio_jobs = None
+
+
+def get_audio_jobs(handler: Callable[..., Awaitable[Dict[str, Any]]]):
+    """The audio jobs of this execution mode; `handler` runs local jobs."""
+    global _audio_jobs
+    if _audio_jobs is None:
+        _audio_jobs = RegistryAudioJobs(get_registry()) if execution_mode() == "distributed" else LocalAudioJobs(handler)
+    return _audio_jobs
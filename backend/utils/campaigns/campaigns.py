@@ -0,0 +1,356 @@
+"""
+Bulk campaigns: scripts for a whole sheet of products in one request.
+
+A campaign is a CSV or JSONL upload whose rows are /generate_script requests. Rows run in the bulk
+lane, at most `concurrency` at a time per campaign, so a 200-row sheet keeps the crew slots busy
+without crowding out interactive work. A row that fails is retried with exponential backoff, up to
+max_attempts. A row that can never succeed, such as one that fails validation, fails straight away.
+
+Rows and their results are stored in SQLite (ADGEN_CAMPAIGN_STORE_PATH), and each finished row gets
+a sequence number in completion order. Clients stream results as NDJSON and resume after any
+interruption by asking for the campaign's results after the last sequence number they saw:
+
+- a dropped connection does not stop the campaign, which keeps running in the background,
+- if the API process running it goes away, its lease runs out and the next request for the
+  campaign's results resumes the rows that had not finished.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from utils.observability.metrics import CAMPAIGN_ROWS
+
+DEFAULT_STORE_PATH = Path(__file__).parent.parent.parent / "var" / "campaigns.sqlite3"
+CAMPAIGN_RETENTION_SECONDS = float(os.environ.get("ADGEN_CAMPAIGN_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    lane TEXT NOT NULL,
+    rows_total INTEGER NOT NULL,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    runner_id TEXT,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS campaign_rows (
+    campaign_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (campaign_id, row)
+);
+CREATE INDEX IF NOT EXISTS campaign_rows_seq ON campaign_rows (campaign_id, seq);
+"""
+
+
+class CampaignNotFound(KeyError):
+    pass
+
+
+class RowRejected(Exception):
+    """A row that would fail on every attempt, so it is not retried."""
+
+
+def parse_campaign_rows(body: bytes, content_type: str = "") -> List[Dict[str, Any]]:
+    """
+    Rows of a CSV (header row naming the fields) or JSONL upload, told apart by the content type, or by
+    whether the body starts with `{`. Empty CSV cells are left out, so the field's default applies.
+    Raises ValueError for a body that is neither.
+    """
+    text = body.decode("utf-8-sig")
+    if "csv" in content_type or ("json" not in content_type and not text.lstrip().startswith("{")):
+        try:
+            return [{key.strip(): value for key, value in row.items() if key and value not in (None, "")}
+                    for row in csv.DictReader(io.StringIO(text))]
+        except csv.Error as e:
+            raise ValueError(f"Invalid CSV: {e}")
+    rows = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {number} is not valid JSON: {e}")
+        if not isinstance(row, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        rows.append(row)
+    return rows
+
+
+class CampaignStore:
+    def __init__(self, path: Optional[str] = None, retention_seconds: float = CAMPAIGN_RETENTION_SECONDS):
+        self.path = Path(path or os.environ.get("ADGEN_CAMPAIGN_STORE_PATH", str(DEFAULT_STORE_PATH)))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.retention_seconds = retention_seconds
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_result(row: sqlite3.Row) -> Dict[str, Any]:
+        result = {"seq": row["seq"], "row": row["row"], "status": row["status"], "attempts": row["attempts"]}
+        if row["status"] == "succeeded":
+            result["result"] = json.loads(row["result"])
+        else:
+            result["error"] = row["error"]
+        return result
+
+    def create(self, rows: List[Dict[str, Any]], lane: str = "bulk") -> str:
+        self.prune()
+        campaign_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT INTO campaigns (id, lane, rows_total, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (campaign_id, lane, len(rows), now, now),
+            )
+            conn.executemany(
+                "INSERT INTO campaign_rows (campaign_id, row, request, status) VALUES (?, ?, ?, 'pending')",
+                [(campaign_id, index, json.dumps(row)) for index, row in enumerate(rows)],
+            )
+            conn.execute("COMMIT")
+        return campaign_id
+
+    def get(self, campaign_id: str) -> Dict[str, Any]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+            if row is None:
+                raise CampaignNotFound(f"Unknown campaign {campaign_id}")
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM campaign_rows WHERE campaign_id = ? GROUP BY status", (campaign_id,)
+            ).fetchall())
+        return {
+            "campaign_id": campaign_id,
+            "lane": row["lane"],
+            "rows_total": row["rows_total"],
+            "rows_done": row["rows_done"],
+            "succeeded": counts.get("succeeded", 0),
+            "failed": counts.get("failed", 0),
+            "done": row["rows_done"] >= row["rows_total"],
+        }
+
+    def claim(self, campaign_id: str, runner_id: str, lease_seconds: float) -> bool:
+        """Take over running the campaign, unless it is finished or another runner's lease is still valid."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE campaigns SET runner_id = ?, lease_expires_at = ? WHERE id = ? AND rows_done < rows_total "
+                "AND (runner_id IS NULL OR runner_id = ? OR lease_expires_at < ?)",
+                (runner_id, now + lease_seconds, campaign_id, runner_id, now),
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, campaign_id: str, runner_id: str, lease_seconds: float) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE campaigns SET lease_expires_at = ? WHERE id = ? AND runner_id = ?",
+                (time.time() + lease_seconds, campaign_id, runner_id),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, campaign_id: str, runner_id: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE campaigns SET runner_id = NULL, lease_expires_at = NULL WHERE id = ? AND runner_id = ?", (campaign_id, runner_id))
+
+    def pending(self, campaign_id: str) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT row, request, attempts FROM campaign_rows WHERE campaign_id = ? AND status = 'pending' ORDER BY row",
+                (campaign_id,),
+            ).fetchall()
+        return [{"row": row["row"], "request": json.loads(row["request"]), "attempts": row["attempts"]} for row in rows]
+
+    def record_attempt(self, campaign_id: str, row: int, attempts: int):
+        with self._connect() as conn:
+            conn.execute("UPDATE campaign_rows SET attempts = ? WHERE campaign_id = ? AND row = ?", (attempts, campaign_id, row))
+
+    def finish_row(self, campaign_id: str, row: int, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> Optional[int]:
+        """Store a row's outcome under the campaign's next sequence number. None if the row had already finished."""
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE, so that two rows finishing together cannot take the same sequence number
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = conn.execute("SELECT rows_done + 1 FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()[0]
+                cursor = conn.execute(
+                    "UPDATE campaign_rows SET status = ?, seq = ?, result = ?, error = ? WHERE campaign_id = ? AND row = ? AND status = 'pending'",
+                    ("failed" if error is not None else "succeeded", seq, json.dumps(result) if result is not None else None, error, campaign_id, row),
+                )
+                if cursor.rowcount != 1:
+                    conn.execute("ROLLBACK")
+                    return None
+                conn.execute("UPDATE campaigns SET rows_done = ?, updated_at = ? WHERE id = ?", (seq, time.time(), campaign_id))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return seq
+
+    def results(self, campaign_id: str, after: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Finished rows in completion order, from sequence number after + 1."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM campaign_rows WHERE campaign_id = ? AND seq > ? ORDER BY seq LIMIT ?", (campaign_id, after, limit)
+            ).fetchall()
+        return [self._row_to_result(row) for row in rows]
+
+    def prune(self) -> int:
+        """Delete campaigns untouched for longer than the retention period."""
+        cutoff = time.time() - self.retention_seconds
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM campaign_rows WHERE campaign_id IN (SELECT id FROM campaigns WHERE updated_at < ?)", (cutoff,))
+            cursor = conn.execute("DELETE FROM campaigns WHERE updated_at < ?", (cutoff,))
+            conn.execute("COMMIT")
+        return cursor.rowcount
+
+
+class CampaignRunner:
+    """
+    Runs campaigns in this process. `run_row(request, lane)` produces a row's result, and raises
+    RowRejected for rows not worth retrying.
+    """
+
+    def __init__(self, store: CampaignStore, run_row: Callable[[Dict[str, Any], str], Awaitable[Dict[str, Any]]],
+                 concurrency: int = 4, max_attempts: int = 3, retry_backoff_seconds: float = 2.0,
+                 lease_seconds: float = 30.0, poll_interval: float = 1.0):
+        self.store = store
+        self.run_row = run_row
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.runner_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Set and replaced whenever a row of the campaign finishes in this process
+        self._changed: Dict[str, asyncio.Event] = {}
+
+    async def ensure_running(self, campaign_id: str) -> bool:
+        """Start running the campaign here unless it is finished or running elsewhere. Returns whether it runs here."""
+        if campaign_id in self._tasks:
+            return True
+        if not await asyncio.to_thread(self.store.claim, campaign_id, self.runner_id, self.lease_seconds):
+            return False
+        self._tasks[campaign_id] = asyncio.create_task(self._run(campaign_id))
+        return True
+
+    async def _run(self, campaign_id: str):
+        campaign = await asyncio.to_thread(self.store.get, campaign_id)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_guarded(pending: Dict[str, Any]):
+            async with semaphore:
+                await self._run_row(campaign_id, campaign["lane"], pending)
+
+        rows = [asyncio.create_task(run_guarded(pending)) for pending in await asyncio.to_thread(self.store.pending, campaign_id)]
+        logging.info(f"Running campaign {campaign_id}: {len(rows)} of {campaign['rows_total']} rows to go")
+        try:
+            while rows:
+                done, _ = await asyncio.wait(rows, timeout=self.lease_seconds / 3)
+                rows = [task for task in rows if task not in done]
+                if rows and not await asyncio.to_thread(self.store.renew, campaign_id, self.runner_id, self.lease_seconds):
+                    # Taken over after our lease lapsed; the new runner redoes the rows still pending
+                    logging.warning(f"Lost the lease on campaign {campaign_id}")
+                    break
+        finally:
+            for task in rows:
+                task.cancel()
+            await asyncio.gather(*rows, return_exceptions=True)
+            await asyncio.to_thread(self.store.release, campaign_id, self.runner_id)
+            self._tasks.pop(campaign_id, None)
+            self._notify(campaign_id)
+
+    async def _run_row(self, campaign_id: str, lane: str, pending: Dict[str, Any]):
+        attempts = pending["attempts"]
+        while True:
+            attempts += 1
+            await asyncio.to_thread(self.store.record_attempt, campaign_id, pending["row"], attempts)
+            try:
+                result, error = await self.run_row(pending["request"], lane), None
+            except asyncio.CancelledError:
+                raise
+            except RowRejected as e:
+                result, error = None, str(e)
+            except Exception as e:
+                if attempts < self.max_attempts:
+                    CAMPAIGN_ROWS.labels(outcome="retried").inc()
+                    logging.warning(f"Campaign {campaign_id} row {pending['row']} failed (attempt {attempts}), retrying: {str(e)}")
+                    await asyncio.sleep(self.retry_backoff_seconds * 2 ** (attempts - 1))
+                    continue
+                result, error = None, str(e)
+            break
+        await asyncio.to_thread(self.store.finish_row, campaign_id, pending["row"], result, error)
+        CAMPAIGN_ROWS.labels(outcome="failed" if error is not None else "succeeded").inc()
+        self._notify(campaign_id)
+
+    def _notify(self, campaign_id: str):
+        changed = self._changed.pop(campaign_id, None)
+        if changed is not None:
+            changed.set()
+
+    async def follow(self, campaign_id: str, after: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Results after sequence number `after` as they finish, until the campaign is done. Resumes the
+        campaign here if nobody is running it.
+        """
+        while True:
+            changed = self._changed.setdefault(campaign_id, asyncio.Event())
+            results = await asyncio.to_thread(self.store.results, campaign_id, after)
+            for result in results:
+                yield result
+                after = result["seq"]
+            if results:
+                continue
+            campaign = await asyncio.to_thread(self.store.get, campaign_id)
+            if campaign["done"]:
+                return
+            running_here = await self.ensure_running(campaign_id)
+            try:
+                # Rows finishing in another process are only seen by polling
+                await asyncio.wait_for(changed.wait(), timeout=None if running_here else self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+_runner: Optional[CampaignRunner] = None
+
+
+def get_campaign_runner(run_row: Callable[[Dict[str, Any], str], Awaitable[Dict[str, Any]]]) -> CampaignRunner:
+    global _runner
+    if _runner is None:
+        _runner = CampaignRunner(
+            CampaignStore(),
+            run_row,
+            concurrency=int(os.environ.get("ADGEN_CAMPAIGN_CONCURRENCY", "4")),
+            max_attempts=int(os.environ.get("ADGEN_CAMPAIGN_MAX_ATTEMPTS", "3")),
+            retry_backoff_seconds=float(os.environ.get("ADGEN_CAMPAIGN_RETRY_BACKOFF_SECONDS", "2")),
+        )
+    return _runner
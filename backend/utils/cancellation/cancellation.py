@@ -0,0 +1,112 @@
+"""
+Cancellation of work nobody is waiting for any more.
+
+Every request runs under a deadline: X-Request-Timeout (seconds, as sent by the frontend proxy,
+which gives up after 60) or ADGEN_REQUEST_TIMEOUT_SECONDS, whichever is shorter. The request is also
+watched for a client disconnect. When either happens first, the task doing the work is cancelled:
+crew subprocesses are killed (see run_crew_process), TTS jobs stop after the line being synthesized,
+and distributed jobs are cancelled in the registry. The client gets 504 for a deadline (a gone client
+gets nothing), and adgen_cancellations_total counts both.
+
+Disconnects have to be caught below the @app.middleware("http") layers, which never pass
+http.disconnect on to the endpoint; DisconnectWatcher is added as the outermost middleware for that.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Optional, TypeVar
+
+from utils.observability.metrics import CANCELLATIONS
+
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("ADGEN_REQUEST_TIMEOUT_SECONDS", "600"))
+DISCONNECTED_SCOPE_KEY = "adgen.disconnected"
+
+T = TypeVar("T")
+
+
+class RequestCancelled(Exception):
+    def __init__(self, pipeline: str, reason: str):
+        super().__init__(f"{pipeline} cancelled: {reason}")
+        self.pipeline = pipeline
+        self.reason = reason
+
+
+class DisconnectWatcher:
+    """
+    ASGI middleware that sets scope["adgen.disconnected"] (an asyncio.Event) when the client goes away.
+    Once the request body has been read, it keeps a receive() pending to see the disconnect, and hands
+    the same message to the app if the app asks for one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        disconnected = asyncio.Event()
+        scope[DISCONNECTED_SCOPE_KEY] = disconnected
+        watcher: Optional[asyncio.Task] = None
+
+        async def watch():
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            return message
+
+        async def watched_receive():
+            nonlocal watcher
+            if watcher is not None:
+                return await asyncio.shield(watcher)
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                watcher = asyncio.create_task(watch())
+            return message
+
+        try:
+            await self.app(scope, watched_receive, send)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
+def request_timeout(headers) -> float:
+    """Seconds the request may run: X-Request-Timeout if sent and shorter than the server's limit."""
+    try:
+        requested = float(headers.get("x-request-timeout", ""))
+    except ValueError:
+        return REQUEST_TIMEOUT_SECONDS
+    return min(requested, REQUEST_TIMEOUT_SECONDS) if requested > 0 else REQUEST_TIMEOUT_SECONDS
+
+
+async def run_cancellable(work: Awaitable[T], pipeline: str, timeout: float, disconnected: Optional[asyncio.Event] = None) -> T:
+    """
+    Run `work` until it finishes, `timeout` seconds pass or `disconnected` is set. In the latter two
+    cases the work is cancelled, its cleanup awaited, and RequestCancelled raised.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(disconnected.wait()) if disconnected is not None else None
+    try:
+        done, _ = await asyncio.wait([task] + ([watcher] if watcher else []), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+    if task in done:
+        return task.result()
+
+    reason = "client_disconnect" if watcher in done else "deadline"
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        # The work's own outcome is moot: nobody is waiting for it
+        pass
+    CANCELLATIONS.labels(pipeline=pipeline, reason=reason).inc()
+    logging.warning(f"Cancelled {pipeline} ({reason})")
+    raise RequestCancelled(pipeline, reason)
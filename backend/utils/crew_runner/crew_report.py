@@ -0,0 +1,93 @@
+"""
+Run reports written by the crew subprocesses (script_generation, regenerate_script).
+
+When the API process sets CREW_REPORT_PATH, the crew's main.py imports this module and calls
+write_run_report after kickoff, and the API process reads the report back with
+token_accounting.read_crew_report. The crew subprocesses' PYTHONPATH adds the backend directory to
+their own src, so this module uses the standard library only. Crews started with `crewai run` have
+neither, and skip the report.
+"""
+
+import json
+import os
+import secrets
+from typing import Any, Dict, List, Optional
+
+
+def build_trace_spans(process_started_at: float, kickoff_started_at: float, kickoff_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Build trace spans for this worker as children of the span in the TRACEPARENT environment
+    variable, so the API process can export them as part of the request trace.
+    """
+    parts = os.environ.get("TRACEPARENT", "").split("-")
+    if len(parts) != 4:
+        return []
+    trace_id, parent_span_id = parts[1], parts[2]
+
+    def span(name: str, started_at: float, ended_at: float) -> dict:
+        return {
+            "name": name,
+            "trace_id": trace_id,
+            "span_id": secrets.token_hex(8),
+            "parent_span_id": parent_span_id,
+            "start_time_ns": int(started_at * 1e9),
+            "end_time_ns": int(ended_at * 1e9),
+            "attributes": {"pid": os.getpid()},
+        }
+
+    return [
+        span("crew_worker.startup", process_started_at, kickoff_started_at),
+        span("crew_worker.kickoff", kickoff_started_at, kickoff_started_at + kickoff_seconds),
+    ]
+
+
+def _usage(value) -> Optional[Dict[str, Any]]:
+    if value is None:
+        return None
+    return value.model_dump() if hasattr(value, "model_dump") else dict(value)
+
+
+class TaskUsageRecorder:
+    """
+    Crew task_callback that records the token usage of each task. CrewAI reports usage for the crew
+    as a whole only, so a task's usage is how much the crew total grew while it ran. The crews run
+    their tasks sequentially, so the per-task figures add up to the crew total.
+    """
+
+    def __init__(self, crew):
+        self.crew = crew
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self._previous: Dict[str, Any] = {}
+        if hasattr(crew, "calculate_usage_metrics"):
+            crew.task_callback = self
+
+    def __call__(self, task_output):
+        usage = _usage(self.crew.calculate_usage_metrics()) or {}
+        name = getattr(task_output, "name", None) or f"task_{len(self.tasks)}"
+        self.tasks[name] = {
+            key: value - self._previous.get(key, 0) for key, value in usage.items() if isinstance(value, (int, float))
+        }
+        self._previous = usage
+
+
+def write_run_report(result, process_started_at: float, kickoff_started_at: float, kickoff_seconds: float,
+                     tasks: Optional[Dict[str, Dict[str, Any]]] = None, **extra):
+    """
+    Write token usage and timings for this run to the path in CREW_REPORT_PATH so the API process
+    can return them in the response metadata. `tasks` is the per-task usage from a TaskUsageRecorder,
+    reported only if it covers every task. `extra` adds crew-specific fields.
+    """
+    report_path = os.environ.get("CREW_REPORT_PATH")
+    if not report_path:
+        return
+    report = {
+        "token_usage": _usage(result.token_usage) or {},
+        "kickoff_started_at": kickoff_started_at,
+        "kickoff_seconds": kickoff_seconds,
+        "spans": build_trace_spans(process_started_at, kickoff_started_at, kickoff_seconds),
+        **extra,
+    }
+    if tasks and len(tasks) == len(result.tasks_output):
+        report["tasks"] = tasks
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file)
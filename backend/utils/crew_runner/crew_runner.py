@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from utils.admission.admission import CREW_GATE
+from utils.observability.metrics import TOKENS
+from utils.observability.stages import stage, observe_stage
+from utils.observability.tracing import record_remote_spans
+from utils.observability.logging_config import RingBuffer, crew_verbose
+
+# Only the tail of the crew output is kept; the final answer is printed last
+CREW_OUTPUT_MAX_BYTES = int(os.environ.get("ADGEN_CREW_OUTPUT_MAX_BYTES", str(256 * 1024)))
+# Time a cancelled crew gets to exit on SIGTERM before it is killed
+CREW_KILL_GRACE_SECONDS = float(os.environ.get("ADGEN_CREW_KILL_GRACE_SECONDS", "5"))
+
+
+class CrewProcessResult(subprocess.CompletedProcess):
+    """Completed crew subprocess, plus the wall-clock time it was spawned at."""
+
+    def __init__(self, args, returncode, stdout, stderr, spawned_at: float):
+        super().__init__(args, returncode, stdout, stderr)
+        self.spawned_at = spawned_at
+
+
+async def _drain_stream(stream: asyncio.StreamReader, buffer: RingBuffer):
+    while True:
+        chunk = await stream.read(64 * 1024)
+        if not chunk:
+            return
+        buffer.append(chunk)
+
+
+async def _terminate(process: asyncio.subprocess.Process):
+    """SIGTERM the crew's process group (the crew and anything it started), then SIGKILL after the grace period."""
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), timeout=CREW_KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+    except ProcessLookupError:
+        pass
+
+
+async def run_crew_process(pipeline: str, module: str, cwd: Path, env: Dict[str, str], lane: str = "standard") -> CrewProcessResult:
+    """
+    Run a crew module in a subprocess without blocking the event loop.
+    The run waits for a slot on the shared crew gate, which caps concurrent crew subprocesses
+    and schedules waiting runs by priority lane.
+    Records queue wait, subprocess spawn and total process time as pipeline stages.
+    If the run is cancelled (deadline, client gone), the subprocess is terminated before the slot is released.
+    """
+    async with CREW_GATE.slot(pipeline, pipeline=pipeline, lane=lane):
+        with stage(pipeline, "crew_process", module=module) as process_span:
+            # The worker reports its own spans as children of this one
+            env = {**env, "TRACEPARENT": process_span.traceparent, "CREW_VERBOSE": crew_verbose()}
+            spawned_at = time.time()
+            with stage(pipeline, "subprocess_spawn"):
+                process = await asyncio.create_subprocess_exec(
+                    "python", "-m", module,
+                    env=env,
+                    cwd=str(cwd),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    # Its own process group, so a cancelled run can be killed with everything it spawned
+                    start_new_session=True,
+                )
+            logging.debug(f"Spawned {module} (pid {process.pid})")
+            process_span.set_attribute("pid", process.pid)
+            stdout, stderr = RingBuffer(CREW_OUTPUT_MAX_BYTES), RingBuffer(CREW_OUTPUT_MAX_BYTES)
+            try:
+                await asyncio.gather(_drain_stream(process.stdout, stdout), _drain_stream(process.stderr, stderr))
+                await process.wait()
+            except asyncio.CancelledError:
+                logging.info(f"Terminating cancelled {module} (pid {process.pid})")
+                await _terminate(process)
+                process_span.set_attribute("cancelled", True)
+                raise
+            process_span.set_attribute("returncode", process.returncode)
+
+    return CrewProcessResult(
+        args=["python", "-m", module],
+        returncode=process.returncode,
+        stdout=stdout.getvalue(),
+        stderr=stderr.getvalue(),
+        spawned_at=spawned_at,
+    )
+
+
+def record_crew_report(pipeline: str, report: Optional[Dict[str, Any]], spawned_at: float):
+    """
+    Record the timings, token usage and trace spans a crew subprocess reported.
+    Startup is the time between spawning the process and the crew kickoff (imports, crew setup).
+    """
+    if not report:
+        return
+    record_remote_spans(report.get("spans", []))
+    if "kickoff_seconds" in report:
+        observe_stage(pipeline, "crew_kickoff", report["kickoff_seconds"])
+    if "kickoff_started_at" in report:
+        observe_stage(pipeline, "crew_startup", max(0.0, report["kickoff_started_at"] - spawned_at))
+    for task_name, usage in report.get("tasks", {}).items():
+        TOKENS.labels(task=task_name, type="prompt").inc(usage.get("prompt_tokens", 0) or 0)
+        TOKENS.labels(task=task_name, type="completion").inc(usage.get("completion_tokens", 0) or 0)
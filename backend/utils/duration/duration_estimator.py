@@ -0,0 +1,203 @@
+"""
+Spoken duration estimates for script lines, so over-length scripts are caught before any TTS runs.
+
+A line's duration is modelled as a linear function of its syllables, words and pauses (commas and
+other minor breaks, sentence ends, ellipses and dashes) plus a constant for the silence the TTS
+model leaves around each line. The weights start from priors for ordinary radio-ad pacing and are
+calibrated per TTS backend from the durations of lines actually synthesized: every synthesized line
+is an observation, and the weights are the ridge regression of all observations towards the priors,
+so a few lines nudge them and many lines take over.
+
+Calibration (the regression's sufficient statistics) is kept in ADGEN_DURATION_CALIBRATION_PATH.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.observability.metrics import DURATION_ESTIMATE_ERROR
+
+DEFAULT_CALIBRATION_PATH = Path(__file__).parent.parent.parent / "var" / "duration_calibration.json"
+DURATION_TOLERANCE = float(os.environ.get("ADGEN_DURATION_TOLERANCE", "0.1"))
+
+FEATURES = ("syllables", "words", "minor_pauses", "sentence_ends", "ellipses", "line")
+# Seconds per feature: about 150 words per minute, with pauses at punctuation
+PRIOR_WEIGHTS = np.array([0.2, 0.1, 0.2, 0.35, 0.5, 0.3])
+
+_WORD_RE = re.compile(r"[A-Za-z0-9']+")
+_VOWEL_GROUP_RE = re.compile(r"[aeiouy]+")
+_ELLIPSIS_RE = re.compile(r"\.\.\.|…")
+_SENTENCE_END_RE = re.compile(r"[.!?](?=\s|$)")
+_MINOR_PAUSE_RE = re.compile(r"[,;:]|\s[-–—]\s")
+
+
+def count_syllables(word: str) -> int:
+    word = word.lower()
+    if word.isdigit():
+        # Numbers are read out: roughly two syllables per digit
+        return 2 * len(word)
+    syllables = len(_VOWEL_GROUP_RE.findall(word))
+    if word.endswith("e") and not word.endswith(("le", "ee")) and syllables > 1:
+        syllables -= 1
+    return max(1, syllables)
+
+
+def line_features(text: str) -> np.ndarray:
+    words = _WORD_RE.findall(text)
+    ellipses = len(_ELLIPSIS_RE.findall(text))
+    without_ellipses = _ELLIPSIS_RE.sub(" ", text)
+    return np.array([
+        sum(count_syllables(word) for word in words),
+        len(words),
+        len(_MINOR_PAUSE_RE.findall(without_ellipses)),
+        len(_SENTENCE_END_RE.findall(without_ellipses)),
+        ellipses,
+        1.0 if words else 0.0,
+    ], dtype=np.float64)
+
+
+class DurationEstimator:
+    def __init__(self, path: Optional[str] = None, prior_strength: float = 20.0):
+        self.path = Path(path or os.environ.get("ADGEN_DURATION_CALIBRATION_PATH", str(DEFAULT_CALIBRATION_PATH)))
+        self.prior_strength = prior_strength
+        self._lock = threading.Lock()
+        # Per backend: X^T X, X^T y and the number of observed lines
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._weights: Dict[str, np.ndarray] = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.path.is_file():
+            return
+        n = len(FEATURES)
+        try:
+            data = json.loads(self.path.read_text())
+            if data.get("features") != list(FEATURES):
+                # Statistics over other features would be solved against the wrong priors
+                raise ValueError(f"features {data.get('features')} do not match {list(FEATURES)}")
+            for backend, stats in data.get("backends", {}).items():
+                xtx = np.array(stats["xtx"], dtype=np.float64)
+                xty = np.array(stats["xty"], dtype=np.float64)
+                if xtx.shape != (n, n) or xty.shape != (n,):
+                    raise ValueError(f"backend {backend} has shapes {xtx.shape} and {xty.shape}")
+                self._stats[backend] = {"xtx": xtx, "xty": xty, "samples": int(stats["samples"])}
+        except (ValueError, KeyError, AttributeError, TypeError, OSError) as e:
+            # A corrupt or outdated calibration only costs accuracy; start again from the priors
+            self._stats = {}
+            logging.warning(f"Ignoring unreadable duration calibration {self.path}: {str(e)}")
+
+    def save(self):
+        """Write the calibration if it changed. The file is replaced atomically."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"features": list(FEATURES), "backends": {
+                backend: {"xtx": stats["xtx"].tolist(), "xty": stats["xty"].tolist(), "samples": stats["samples"]}
+                for backend, stats in self._stats.items()
+            }}
+            self._dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.partial")
+        partial_path.write_text(json.dumps(data))
+        os.replace(partial_path, self.path)
+
+    def weights(self, backend: str) -> np.ndarray:
+        with self._lock:
+            weights = self._weights.get(backend)
+            if weights is not None:
+                return weights
+            stats = self._stats.get(backend)
+            if stats is None:
+                weights = PRIOR_WEIGHTS
+            else:
+                regularizer = self.prior_strength * np.eye(len(FEATURES))
+                weights = np.linalg.solve(stats["xtx"] + regularizer, stats["xty"] + regularizer @ PRIOR_WEIGHTS)
+            self._weights[backend] = weights
+            return weights
+
+    def samples(self, backend: str) -> int:
+        with self._lock:
+            stats = self._stats.get(backend)
+            return stats["samples"] if stats else 0
+
+    def estimate_line(self, text: str, backend: str) -> float:
+        return max(0.0, float(line_features(text) @ self.weights(backend)))
+
+    def estimate_script(self, lines: Sequence[str], backend: str, target_seconds: Optional[float] = None,
+                        tolerance: float = DURATION_TOLERANCE) -> Dict[str, Any]:
+        """
+        Per-line and total estimated seconds. With a target, also whether the script runs over it by more
+        than `tolerance` (a fraction of the target) and by how many seconds.
+        """
+        weights = self.weights(backend)
+        line_seconds = [round(max(0.0, float(line_features(text) @ weights)), 2) for text in lines]
+        total = round(sum(line_seconds), 2)
+        estimate = {
+            "estimated_seconds": total,
+            "line_seconds": line_seconds,
+            "target_seconds": target_seconds,
+            "over_length": False,
+            "overrun_seconds": 0.0,
+            "backend": backend,
+            "calibration_samples": self.samples(backend),
+        }
+        if target_seconds is not None:
+            estimate["over_length"] = total > target_seconds * (1 + tolerance)
+            estimate["overrun_seconds"] = round(max(0.0, total - target_seconds), 2)
+        return estimate
+
+    def observe(self, backend: str, text: str, seconds: float):
+        """Add a synthesized line's measured duration to the backend's calibration."""
+        features = line_features(text)
+        if not features[-1]:
+            return
+        DURATION_ESTIMATE_ERROR.labels(backend=backend).observe(abs(self.estimate_line(text, backend) - seconds))
+        with self._lock:
+            stats = self._stats.setdefault(backend, {
+                "xtx": np.zeros((len(FEATURES), len(FEATURES))),
+                "xty": np.zeros(len(FEATURES)),
+                "samples": 0,
+            })
+            stats["xtx"] += np.outer(features, features)
+            stats["xty"] += features * seconds
+            stats["samples"] += 1
+            self._weights.pop(backend, None)
+            self._dirty = True
+
+
+def lines_to_trim(line_seconds: List[float], overrun_seconds: float) -> List[int]:
+    """
+    Indices, in script order, of the longest lines whose combined length is at least twice the overrun
+    (so each needs only a moderate cut), and never more than half the script.
+    """
+    order = sorted(range(len(line_seconds)), key=lambda index: line_seconds[index], reverse=True)
+    selected: List[int] = []
+    covered = 0.0
+    for index in order[:max(1, len(line_seconds) // 2)]:
+        selected.append(index)
+        covered += line_seconds[index]
+        if covered >= 2 * overrun_seconds:
+            break
+    return sorted(selected)
+
+
+_estimator: Optional[DurationEstimator] = None
+
+
+def get_duration_estimator() -> DurationEstimator:
+    global _estimator
+    if _estimator is None:
+        _estimator = DurationEstimator()
+    return _estimator
+
+
+def tts_backend_name() -> str:
+    """Backend whose calibration estimates use: the one /generate_audio will synthesize with."""
+    return os.environ.get("ADGEN_TTS_BACKEND", "parler")
@@ -0,0 +1,455 @@
+"""
+Job handlers: the crew and TTS pipelines behind the script and audio endpoints.
+
+Each handler takes (payload, lane, job_id=None) and returns a JSON-serializable result, so the same
+code runs in the API process in local execution mode and in worker.py in distributed mode. They live
+outside main.py so that workers import them without building the FastAPI app.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.audio_jobs.audio_jobs import AudioProgress
+from utils.crew_runner.crew_runner import record_crew_report, run_crew_process
+from utils.job_registry.dispatch import execution_mode, get_artifact_store, get_registry
+from utils.model_routing.router import get_model_router
+from utils.observability.logging_config import summarize_payload
+from utils.observability.metrics import VALIDATION_FALLBACKS, VALIDATION_LENGTH_MISMATCHES, VALIDATION_REVERTS
+from utils.observability.stages import stage
+from utils.token_accounting.prompt_compaction import (
+    build_explicit_instruction,
+    build_marked_script,
+    get_prompt_mode,
+    render_refine_prompt,
+    strip_markers,
+)
+from utils.token_accounting.token_accounting import build_token_usage, estimate_tokens, read_crew_report
+from utils.tts_integration.speculative import get_speculative_synthesizer, speculative_tts_enabled
+
+BACKEND_DIR = Path(__file__).parent.parent.parent
+
+
+def parse_script_output(output: str) -> List[Dict[str, str]]:
+    """Parse the script output from the crew into a list of script objects."""
+    try:
+        # Clean up the output string to handle common formatting issues
+        output = output.strip()
+        # Remove trailing period before closing bracket if present
+        if output.endswith(').'):
+            output = output[:-1] + ')'
+        if output.endswith(').  ]'):
+            output = output[:-5] + ')]'
+            
+        # First try to parse as JSON
+        try:
+            data = json.loads(output)
+            if isinstance(data, list):
+                # Each item should be a tuple/list of two strings
+                scripts = []
+                for item in data:
+                    if isinstance(item, (list, tuple)) and len(item) == 2:
+                        script_line = item[0]
+                        art_direction = item[1]
+                        # Remove any extra quotes if present
+                        if isinstance(script_line, str) and isinstance(art_direction, str):
+                            scripts.append({
+                                "line": script_line,
+                                "artDirection": art_direction
+                            })
+                return scripts
+        except json.JSONDecodeError:
+            # If not JSON, try to parse as Python literal
+            import ast
+            try:
+                # Safely evaluate the string as a Python literal
+                data = ast.literal_eval(output)
+                if isinstance(data, list):
+                    return [
+                        {
+                            "line": item[0],
+                            "artDirection": item[1]
+                        }
+                        for item in data
+                        if isinstance(item, (list, tuple)) and len(item) == 2
+                    ]
+            except (SyntaxError, ValueError):
+                # Last resort: try to fix common formatting issues with regex
+                import re
+                # Find all pairs of quoted strings
+                pattern = r'\("([^"]+)",\s*"([^"]+)"\)'
+                matches = re.findall(pattern, output)
+                if matches:
+                    return [
+                        {
+                            "line": line,
+                            "artDirection": art
+                        }
+                        for line, art in matches
+                    ]
+
+        # If all parsing attempts fail, log the raw output and raise an error
+        logging.error("Could not parse output format. Raw output: %s", summarize_payload(output))
+        raise ValueError("Output format not recognized")
+
+    except Exception as e:
+        logging.error(f"Error parsing script output: {str(e)}")
+        logging.error("Raw output: %s", summarize_payload(output))
+        raise ValueError(f"Failed to parse script output: {str(e)}")
+
+
+def crew_seconds(report: Optional[Dict[str, Any]]) -> Optional[float]:
+    """Time the crew spent in kickoff (the LLM calls), as it reported it."""
+    return report.get("kickoff_seconds") if report else None
+
+
+def new_crew_report_path() -> Path:
+    """Unique path the crew subprocess writes its run report (token usage, timings) to."""
+    return Path(tempfile.gettempdir()) / f"crew_report_{uuid.uuid4().hex}.json"
+
+
+def crew_pythonpath(src_dir: Path) -> str:
+    """The crew's own sources, plus the backend directory for the helpers the crews share (utils.crew_runner.crew_report)."""
+    return os.pathsep.join([str(src_dir), str(BACKEND_DIR)])
+
+
+def new_crew_output_path(stem: str) -> Path:
+    """Unique path the crew subprocess writes its final script to."""
+    return Path(tempfile.gettempdir()) / f"{stem}_{uuid.uuid4().hex}.md"
+
+
+async def run_crewai_script(inputs: dict, lane: str = "standard", routing: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    report = None
+    try:
+        # Log the inputs for debugging
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Inputs to script generation: %s", summarize_payload(inputs))
+        
+        # Get absolute paths
+        script_gen_dir = BACKEND_DIR / "script_generation"
+        script_src_dir = script_gen_dir / "src"
+        
+        # Each run writes to its own file so that concurrent runs cannot read each other's script
+        expected_output_path = new_crew_output_path("radio_script")
+        possible_output_paths = [expected_output_path]
+        logging.debug("Expected script generation output path: %s", expected_output_path)
+        
+        report_path = new_crew_report_path()
+        
+        # Set environment variables for the subprocess, including the explicit output path
+        env_vars = {
+            **os.environ,
+            "PYTHONPATH": crew_pythonpath(script_src_dir),
+            "CREW_INPUTS": json.dumps(inputs),
+            "SCRIPT_OUTPUT_PATH": str(expected_output_path),
+            "CREW_REPORT_PATH": str(report_path)
+        }
+        if routing and routing["model"]:
+            env_vars["CREW_LLM_MODEL"] = routing["model"]
+        
+        # Run the script generation process
+        result = await run_crew_process(
+            "generate_script",
+            "script_generation.main",
+            cwd=script_src_dir,  # Set working directory explicitly
+            env=env_vars,
+            lane=lane
+        )
+        
+        # Log the output for debugging
+        logging.info("Script generation output: %s", summarize_payload(result.stdout))
+        
+        if result.stderr:
+            logging.warning("Script generation errors: %s", summarize_payload(result.stderr))
+        
+        report = read_crew_report(report_path)
+        record_crew_report("generate_script", report, result.spawned_at)
+        token_usage = build_token_usage(report, "full", None)
+        
+        if result.returncode != 0:
+            logging.error(f"CrewAI Error: {result.stderr}")
+            raise RuntimeError(f"CrewAI Error: {result.stderr}")
+        
+        # Check all possible output paths
+        with stage("generate_script", "output_discovery"):
+            existing_output_paths = [output_path for output_path in possible_output_paths if output_path.exists()]
+        for output_path in existing_output_paths:
+            logging.info(f"Found output file at {output_path}")
+            try:
+                output_text = output_path.read_text()
+                output_path.unlink()
+                with stage("generate_script", "parse_script_output"):
+                    script = parse_script_output(output_text)
+                get_model_router().observe(routing, crew_seconds(report), failed=False)
+                return script, token_usage
+            except Exception as e:
+                logging.error(f"Error reading {output_path}: {str(e)}")
+        
+        # Try to parse the output directly from stdout if no file is found
+        if "Final Answer:" in result.stdout:
+            logging.info("Trying to parse script from stdout")
+            answer_text = result.stdout.split("Final Answer:")[1].strip()
+            with stage("generate_script", "parse_script_output"):
+                script = parse_script_output(answer_text)
+            get_model_router().observe(routing, crew_seconds(report), failed=False)
+            return script, token_usage
+            
+        # Additional debug information if file not found
+        logging.error(f"Output file not found at any of the expected paths")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("All markdown files in script_gen_dir: %s", list(Path(script_gen_dir).glob('**/*.md')))
+            logging.debug("Directory contents: %s", list(BACKEND_DIR.glob('**/*.md')))
+        raise FileNotFoundError("Script output file not generated")
+    except Exception as e:
+        logging.error(f"Script generation failed: {str(e)}")
+        get_model_router().observe(routing, crew_seconds(report), failed=True)
+        raise RuntimeError(f"Script generation failed: {str(e)}")
+
+
+async def run_regenerate_script_crew(inputs: dict, lane: str = "interactive", routing: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, str]], Dict[str, Any], Dict[str, Any]]:
+    report = None
+    try:
+        # Create enhanced input structure with explicit marking of selected sentences
+        enhanced_inputs = inputs.copy()
+        prompt_mode = get_prompt_mode(enhanced_inputs.pop("prompt_mode", None))
+        
+        # Extract the current script and selected sentences
+        current_script = enhanced_inputs.get("current_script", [])
+        selected_sentences = enhanced_inputs.get("selected_sentences", [])
+        
+        # Replace the original script with a version that marks which sentences should be modified
+        enhanced_inputs["current_script"] = build_marked_script(current_script, selected_sentences, prompt_mode)
+        
+        # Add explicit instruction about only modifying selected sentences
+        enhanced_inputs["explicit_instruction"] = build_explicit_instruction(selected_sentences, prompt_mode)
+        estimated_prompt_tokens = estimate_tokens(render_refine_prompt(enhanced_inputs, prompt_mode))
+        
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Enhanced inputs to regenerate_script crew: %s", summarize_payload(enhanced_inputs))
+        
+        script_gen_dir = BACKEND_DIR / "regenerate_script" / "src"
+        
+        # Each run writes to its own file so that concurrent runs cannot read each other's script
+        output_path = new_crew_output_path("refined_script")
+        possible_output_paths = [output_path]
+        logging.debug("Script regeneration output path: %s", output_path)
+        logging.debug("Crew working directory: %s", script_gen_dir)
+        
+        report_path = new_crew_report_path()
+        
+        result = await run_crew_process(
+            "regenerate_script",
+            "regenerate_script.main",
+            cwd=script_gen_dir,
+            env={
+                **os.environ,
+                "PYTHONPATH": crew_pythonpath(script_gen_dir),
+                "CREW_INPUTS": json.dumps(enhanced_inputs),
+                "CREW_PROMPT_MODE": prompt_mode,
+                "CREW_REPORT_PATH": str(report_path),
+                "REFINED_SCRIPT_OUTPUT_PATH": str(output_path),
+                **({"CREW_LLM_MODEL": routing["model"]} if routing and routing["model"] else {}),
+            },
+            lane=lane
+        )
+        
+        # Log the output for debugging
+        logging.info("Script regeneration output: %s", summarize_payload(result.stdout))
+        if result.stderr:
+            logging.warning("Script regeneration errors: %s", summarize_payload(result.stderr))
+        
+        report = read_crew_report(report_path)
+        record_crew_report("regenerate_script", report, result.spawned_at)
+        token_usage = build_token_usage(report, prompt_mode, estimated_prompt_tokens)
+        if result.returncode != 0:
+            logging.error(f"RegenerateScript Error: {result.stderr}")
+            raise RuntimeError(f"RegenerateScript Error: {result.stderr}")
+        
+        # Check all possible output paths
+        with stage("regenerate_script", "output_discovery"):
+            existing_output_paths = [output_path for output_path in possible_output_paths if output_path.exists()]
+        for output_path in existing_output_paths:
+            logging.info(f"Found output file at {output_path}")
+            output_text = output_path.read_text()
+            output_path.unlink()
+            # Process the output to remove the markers and enforce constraints
+            with stage("regenerate_script", "process_marked_output"):
+                processed_output, validation_meta = process_marked_output(output_text, current_script, selected_sentences)
+            get_model_router().observe(routing, crew_seconds(report), failed="error" in validation_meta)
+            return processed_output, validation_meta, token_usage
+        
+        # Try to parse the output directly from stdout if no file is found
+        if "Final Answer:" in result.stdout:
+            logging.info("Trying to parse script from stdout")
+            answer_text = result.stdout.split("Final Answer:")[1].strip()
+            with stage("regenerate_script", "process_marked_output"):
+                processed_output, validation_meta = process_marked_output(answer_text, current_script, selected_sentences)
+            get_model_router().observe(routing, crew_seconds(report), failed="error" in validation_meta)
+            return processed_output, validation_meta, token_usage
+                
+        # Additional debug information if file not found
+        logging.error(f"Output file not found at any of the expected paths")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("All markdown files in script_gen_dir: %s", list(Path(script_gen_dir).glob('**/*.md')))
+            logging.debug("Directory contents: %s", list(BACKEND_DIR.glob('**/*.md')))
+        
+        # If no output file was created, try to parse from stdout
+        with stage("regenerate_script", "process_marked_output"):
+            parsed_output, validation_meta = process_marked_output(result.stdout, current_script, selected_sentences)
+        get_model_router().observe(routing, crew_seconds(report), failed="error" in validation_meta)
+        return parsed_output, validation_meta, token_usage
+    except Exception as e:
+        logging.error(f"Failed to run regenerate_script crew: {str(e)}")
+        get_model_router().observe(routing, crew_seconds(report), failed=True)
+        raise RuntimeError(f"Failed to run regenerate_script crew: {str(e)}")
+
+
+def process_marked_output(output_text: str, original_script: List[Tuple[str, str]], selected_sentences: List[int]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """
+    Process the output from the crew to:
+    1. Remove markers from the output
+    2. Verify that only selected sentences have been modified
+    3. Revert any unauthorized changes to non-selected sentences
+    
+    This creates a safety mechanism regardless of what the crew returns.
+    
+    Returns:
+        A tuple containing:
+        - The verified script with only authorized changes
+        - Metadata about the validation process (reverted changes, etc.)
+    """
+    meta = {
+        "reverted_changes": [],
+        "had_unauthorized_changes": False,
+        "had_length_mismatch": False,
+        "original_length": len(original_script),
+        "received_length": 0
+    }
+    
+    try:
+        # First, try to parse the output normally
+        with stage("regenerate_script", "parse_script_output"):
+            parsed_script = parse_script_output(output_text)
+        meta["received_length"] = len(parsed_script)
+        
+        # Validate script length
+        if len(parsed_script) != len(original_script):
+            meta["had_length_mismatch"] = True
+            VALIDATION_LENGTH_MISMATCHES.inc()
+            logging.warning(f"Script length mismatch: original={len(original_script)}, received={len(parsed_script)}. Adjusting to match original length.")
+            # If the lengths don't match, we'll keep the original script length
+            # Truncate if too long, or extend with original sentences if too short
+            if len(parsed_script) > len(original_script):
+                parsed_script = parsed_script[:len(original_script)]
+            else:
+                for i in range(len(parsed_script), len(original_script)):
+                    parsed_script.append({
+                        "line": original_script[i][0],
+                        "artDirection": original_script[i][1]
+                    })
+        
+        # Remove markers (verbose or compact) from the generated script
+        for item in parsed_script:
+            if "line" in item and isinstance(item["line"], str):
+                item["line"] = strip_markers(item["line"])
+            if "artDirection" in item and isinstance(item["artDirection"], str):
+                item["artDirection"] = strip_markers(item["artDirection"])
+        
+        # Step 2: Verify and enforce that only selected sentences were modified
+        verified_script = []
+        # Set membership keeps this loop linear; a list lookup per line made it O(lines * selected)
+        selected_set = set(selected_sentences)
+        
+        for i, (orig_line, orig_art) in enumerate(original_script):
+            # Get the corresponding generated item
+            gen_item = parsed_script[i] if i < len(parsed_script) else {"line": "", "artDirection": ""}
+            
+            # If this is not a selected sentence, ensure it remains unchanged
+            if i not in selected_set:
+                # Check if the line or art direction was modified
+                if gen_item.get("line", "") != orig_line or gen_item.get("artDirection", "") != orig_art:
+                    meta["had_unauthorized_changes"] = True
+                    meta["reverted_changes"].append({
+                        "index": i,
+                        "original": {"line": orig_line, "artDirection": orig_art},
+                        "attempted": {"line": gen_item.get("line", ""), "artDirection": gen_item.get("artDirection", "")}
+                    })
+                    logging.warning("Unauthorized change detected for sentence %d. Reverting to original.", i)
+                    verified_script.append({
+                        "line": orig_line,
+                        "artDirection": orig_art
+                    })
+                else:
+                    # No changes detected, keep as is
+                    verified_script.append(gen_item)
+            else:
+                # This is a selected sentence, accept the changes
+                verified_script.append(gen_item)
+        
+        if meta["had_unauthorized_changes"]:
+            VALIDATION_REVERTS.inc(len(meta["reverted_changes"]))
+            logging.info(f"Some unauthorized changes were reverted in the generated script: {len(meta['reverted_changes'])} sentences affected.")
+        
+        return verified_script, meta
+        
+    except Exception as e:
+        logging.error(f"Error processing marked output: {str(e)}")
+        # Fall back to returning the original script if there's a critical error
+        VALIDATION_FALLBACKS.inc()
+        meta["error"] = str(e)
+        return [{"line": line, "artDirection": art} for line, art in original_script], meta
+
+
+# Routed where the crew runs, so the feedback comes from the runs of the same process
+async def generate_script_job(payload: dict, lane: str, job_id: Optional[str] = None) -> Dict[str, Any]:
+    routing = get_model_router().route("generate_script", payload)
+    script, token_usage = await run_crewai_script(payload, lane, routing)
+    return {"script": script, "token_usage": token_usage, "routing": routing}
+
+
+async def regenerate_script_job(payload: dict, lane: str, job_id: Optional[str] = None) -> Dict[str, Any]:
+    routing = get_model_router().route("regenerate_script", payload)
+    script, validation_meta, token_usage = await run_regenerate_script_crew(payload, lane, routing)
+    return {"script": script, "validation": validation_meta, "token_usage": token_usage, "routing": routing}
+
+
+async def audio_job(payload: dict, lane: str, job_id: Optional[str] = None, on_progress=None) -> Dict[str, Any]:
+    # Import here to avoid circular imports
+    from utils.tts_integration.tts_integration import call_parler_tts_api, job_result_path, prune_job_results, publish_audio
+    script = [tuple(pair) for pair in payload["script"]]
+    quality = payload.get("quality", "final")
+    # Each job writes a file of its own, so concurrent jobs never overwrite each other's audio
+    audio_id = job_id or uuid.uuid4().hex
+    file_name = f"{audio_id}.wav"
+    if speculative_tts_enabled() and quality == "final":
+        # Often synthesized in the background since the script was generated
+        speculative_path = await get_speculative_synthesizer().claim(payload.get("owner"), script, lane)
+        if speculative_path is not None:
+            await asyncio.to_thread(publish_audio, speculative_path, audio_id)
+            return {"audioUrl": f"/audio/{file_name}"}
+    if on_progress is None and job_id is not None:
+        # Run by a worker: progress goes through the registry, where any API process can push it
+        async def on_progress(progress: Dict[str, Any]):
+            await asyncio.to_thread(get_registry().report_progress, job_id, progress)
+    if execution_mode() == "distributed":
+        # Run by a worker: written straight into the artifact store, where every API process can serve it
+        output_path = str(get_artifact_store().path_for(f"audio/{file_name}"))
+    else:
+        output_path = job_result_path(audio_id)
+        await asyncio.to_thread(prune_job_results)
+    # Bulk jobs (such as the final renders of previews) yield the TTS slot between lines, so drafts never wait for a whole script
+    await call_parler_tts_api(script, lane, AudioProgress(script, on_progress) if on_progress else None, quality, output_path=output_path)
+    return {"audioUrl": f"/audio/{file_name}"}
+
+
+# Job kinds and the functions that run them; results are JSON-serializable so they can pass through the job registry
+JOB_HANDLERS = {
+    "generate_script": generate_script_job,
+    "regenerate_script": regenerate_script_job,
+    "audio": audio_job,
+}
@@ -0,0 +1,41 @@
+"""
+Shared artifact store for distributed execution.
+
+Workers publish job outputs (merged audio files) here under a key such as "audio/<job_id>.wav",
+and any API process serves them from here. This implementation is a directory, meant to be on a
+filesystem every node mounts (or local disk when all processes share a host); it stands in for an
+object store.
+"""
+
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_ARTIFACT_DIR = Path(__file__).parent.parent.parent / "var" / "artifacts"
+
+
+class ArtifactStore:
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or os.environ.get("ADGEN_ARTIFACT_DIR", str(DEFAULT_ARTIFACT_DIR))).absolute()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        """Local path of an artifact. Raises ValueError for keys that would escape the store."""
+        path = (self.root / key).absolute()
+        if self.root not in path.parents:
+            raise ValueError(f"Invalid artifact key '{key}'")
+        return path
+
+    def put_file(self, key: str, source_path: str) -> Path:
+        """Copy a file into the store. The artifact appears atomically, so readers never see a partial file."""
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.partial")
+        shutil.copyfile(source_path, partial_path)
+        os.replace(partial_path, path)
+        return path
+
+    def exists(self, key: str) -> bool:
+        return self.path_for(key).is_file()
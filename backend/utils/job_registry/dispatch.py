@@ -0,0 +1,95 @@
+"""
+Execution modes for crew and TTS jobs.
+
+- local (default): the API process runs jobs itself, behind the in-process gates.
+- distributed: the API process submits jobs to the shared JobRegistry and waits for a worker
+  (backend/worker.py) to finish them; results and audio files come back through the registry
+  and the ArtifactStore. Any number of API processes and workers, on any number of nodes, can
+  share one registry.
+
+Select the mode with ADGEN_EXECUTION_MODE.
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+from utils.admission.admission import estimate_retry_after
+from utils.job_registry.artifacts import ArtifactStore
+from utils.job_registry.registry import JobRegistry
+from utils.observability.stages import stage
+from utils.observability.tracing import current_traceparent
+
+EXECUTION_MODES = ("local", "distributed")
+JOB_TIMEOUT_SECONDS = float(os.environ.get("ADGEN_JOB_TIMEOUT_SECONDS", "600"))
+
+_registry: Optional[JobRegistry] = None
+_artifact_store: Optional[ArtifactStore] = None
+
+
+def execution_mode() -> str:
+    mode = os.environ.get("ADGEN_EXECUTION_MODE", "local")
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode '{mode}', expected one of {EXECUTION_MODES}")
+    return mode
+
+
+def get_registry() -> JobRegistry:
+    global _registry
+    if _registry is None:
+        _registry = JobRegistry()
+    return _registry
+
+
+def get_artifact_store() -> ArtifactStore:
+    global _artifact_store
+    if _artifact_store is None:
+        _artifact_store = ArtifactStore()
+    return _artifact_store
+
+
+class RegistryGate:
+    """
+    Admission view of the shared registry, used in place of a local JobGate in distributed mode:
+    the backlog, capacity (slots of live workers) and recent job durations are cluster-wide.
+    """
+
+    def __init__(self, name: str, kinds: List[str], max_queue: int, default_job_seconds: float):
+        self.name = name
+        self.kinds = kinds
+        self.max_queue = max_queue
+        self.default_job_seconds = default_job_seconds
+
+    @property
+    def waiting(self) -> int:
+        return get_registry().waiting(self.kinds)
+
+    def retry_after(self, lane: str = "standard") -> Optional[float]:
+        registry = get_registry()
+        durations = registry.recent_durations(self.kinds)
+        mean_job_seconds = sum(durations) / len(durations) if durations else self.default_job_seconds
+        # With no live worker nothing drains; estimate as if one slot came back
+        capacity = max(1, registry.live_slots(self.kinds))
+        return estimate_retry_after(registry.waiting(self.kinds, lane), registry.running(self.kinds), self.max_queue, capacity, mean_job_seconds)
+
+
+async def submit_and_wait(kind: str, payload: Dict[str, Any], lane: str, timeout: float = JOB_TIMEOUT_SECONDS) -> Dict[str, Any]:
+    """
+    Submit a job to the registry, wait for a worker to finish it and return its result.
+    The job is cancelled in the registry if the wait is cancelled or times out.
+    """
+    registry = get_registry()
+    with stage("distributed", "job_wait", kind=kind, lane=lane) as span:
+        job_id = await asyncio.to_thread(registry.submit, kind, payload, lane, current_traceparent())
+        span.set_attribute("job_id", job_id)
+        try:
+            job = await registry.wait_for(job_id, timeout=timeout)
+        except (asyncio.CancelledError, TimeoutError):
+            # Nobody will read the result: drop the job, or stop the worker running it
+            await asyncio.shield(asyncio.to_thread(registry.cancel, job_id))
+            raise
+    if job["status"] == "failed":
+        raise RuntimeError(job["error"] or f"Job {job_id} failed")
+    if job["status"] == "cancelled":
+        raise RuntimeError(f"Job {job_id} was cancelled")
+    return job["result"]
@@ -0,0 +1,304 @@
+"""
+Shared job registry for distributed execution (ADGEN_EXECUTION_MODE=distributed).
+
+API processes submit crew and TTS jobs here instead of running them, and worker processes
+(backend/worker.py) on any node pull jobs, run them and store the results. Capacity then
+scales with the number of workers, and no API process depends on state in another's memory
+or on its local disk.
+
+This implementation is SQLite in WAL mode, which is enough for several processes on one host
+or on hosts sharing a filesystem that supports SQLite locking. It is a development stand-in for a
+proper queue/database; the interface is what the rest of the backend relies on.
+
+Jobs move from queued to running when a worker claims them, under a lease the worker renews
+while it works. A job whose lease expires (its worker died) is claimed again, up to max_attempts.
+A job nobody is waiting for any more is cancelled: a queued one is never claimed, and the worker
+running one finds out when it next renews the lease, and stops.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from utils.scheduling.scheduler import LANES
+
+DEFAULT_REGISTRY_PATH = Path(__file__).parent.parent.parent / "var" / "jobs.sqlite3"
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+JOB_RETENTION_SECONDS = float(os.environ.get("ADGEN_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    progress TEXT,
+    traceparent TEXT,
+    supersede_key TEXT,
+    worker_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, kind, created_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (kind, status, finished_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    kinds TEXT NOT NULL,
+    slots INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+"""
+
+# Lane rank as SQL, so claims can be ordered by priority
+_LANE_RANK_SQL = "CASE lane " + " ".join(f"WHEN '{lane}' THEN {rank}" for rank, lane in enumerate(LANES)) + " END"
+
+
+def _placeholders(values: Iterable[Any]) -> str:
+    return ",".join("?" for _ in values)
+
+
+class JobRegistry:
+    def __init__(self, path: Optional[str] = None, retention_seconds: float = JOB_RETENTION_SECONDS):
+        self.path = Path(path or os.environ.get("ADGEN_JOB_REGISTRY_PATH", str(DEFAULT_REGISTRY_PATH)))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.retention_seconds = retention_seconds
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "progress" not in columns:
+                # Registries created before jobs reported progress
+                conn.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+            if "supersede_key" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN supersede_key TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_supersede ON jobs (kind, supersede_key, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # A connection per operation keeps the registry safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+        return job
+
+    def submit(self, kind: str, payload: Dict[str, Any], lane: str = "standard", traceparent: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, lane, status, payload, traceparent, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, lane, json.dumps(payload), traceparent, time.time()),
+            )
+        return job_id
+
+    def submit_superseding(self, kind: str, key: str, payload: Dict[str, Any], lane: str = "standard", traceparent: Optional[str] = None) -> str:
+        """
+        Submit a job as the latest for `key`, cancelling the key's previous job if it is still queued or running.
+        If that job has the same payload and has not failed or been cancelled, it is kept and its id returned instead.
+        Atomic, so concurrent submissions for one key from any process leave a single job in flight.
+        """
+        encoded = json.dumps(payload)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, status, payload FROM jobs WHERE kind = ? AND supersede_key = ? ORDER BY created_at DESC LIMIT 1",
+                    (kind, key),
+                ).fetchone()
+                if row is not None and row["status"] not in ("failed", "cancelled") and json.loads(row["payload"]) == json.loads(encoded):
+                    conn.execute("COMMIT")
+                    return row["id"]
+                conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE kind = ? AND supersede_key = ? AND status IN ('queued', 'running')",
+                    (now, kind, key),
+                )
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, lane, status, payload, traceparent, supersede_key, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                    (job_id, kind, lane, encoded, traceparent, key, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim(self, worker_id: str, kinds: List[str], lease_seconds: float = 60.0, max_wait_seconds: float = 120.0, max_attempts: int = 3) -> Optional[Dict[str, Any]]:
+        """
+        Claim the next job of one of `kinds`: the highest priority lane first, oldest first within a lane,
+        except that jobs queued longer than max_wait_seconds go before everything else. Running jobs whose
+        lease expired are claimed again.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers cannot claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    f"UPDATE jobs SET status = 'failed', error = 'Worker lease expired too many times', finished_at = ? "
+                    f"WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ? AND kind IN ({_placeholders(kinds)})",
+                    (now, now, max_attempts, *kinds),
+                )
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE kind IN ({_placeholders(kinds)}) "
+                    f"AND (status = 'queued' OR (status = 'running' AND lease_expires_at < ?)) "
+                    f"ORDER BY CASE WHEN created_at < ? THEN 0 ELSE 1 END, {_LANE_RANK_SQL}, created_at LIMIT 1",
+                    (*kinds, now, now - max_wait_seconds),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, started_at = ?, lease_expires_at = ? WHERE id = ?",
+                    (worker_id, now, now + lease_seconds, row["id"]),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        job = self._row_to_job(row)
+        job.update(status="running", worker_id=worker_id, attempts=row["attempts"] + 1, started_at=now)
+        return job
+
+    def renew(self, job_id: str, worker_id: str, lease_seconds: float = 60.0) -> bool:
+        """Extend a running job's lease. False if the job is no longer this worker's."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (time.time() + lease_seconds, job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def report_progress(self, job_id: str, progress: Dict[str, Any]):
+        """Store the latest progress of a running job, for API processes to push to clients."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET progress = ? WHERE id = ? AND status = 'running'", (json.dumps(progress), job_id))
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'succeeded', result = ?, finished_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (json.dumps(result), time.time(), job_id, worker_id),
+            )
+
+    def fail(self, job_id: str, worker_id: str, error: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (error, time.time(), job_id, worker_id),
+            )
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. False if it had already finished."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def latest(self, kind: str, status: str = "succeeded", owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """The most recently finished job of a kind, optionally only among those whose payload has the given owner."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND status = ? AND (? IS NULL OR json_extract(payload, '$.owner') = ?) "
+                "ORDER BY finished_at DESC LIMIT 1",
+                (kind, status, owner, owner),
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    async def wait_for(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.2) -> Dict[str, Any]:
+        """Poll until the job is finished and return it. Raises TimeoutError after `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None:
+                raise KeyError(f"Unknown job {job_id}")
+            if job["status"] in TERMINAL_STATUSES:
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} did not finish within {timeout} seconds")
+            await asyncio.sleep(poll_interval)
+
+    def waiting(self, kinds: List[str], up_to_lane: str = LANES[-1]) -> int:
+        """Number of queued jobs of `kinds` in `up_to_lane` and the lanes above it."""
+        lanes = LANES[:LANES.index(up_to_lane) + 1]
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND kind IN ({_placeholders(kinds)}) AND lane IN ({_placeholders(lanes)})",
+                (*kinds, *lanes),
+            ).fetchone()[0]
+
+    def running(self, kinds: List[str]) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE status = 'running' AND kind IN ({_placeholders(kinds)})",
+                tuple(kinds),
+            ).fetchone()[0]
+
+    def recent_durations(self, kinds: List[str], limit: int = 50) -> List[float]:
+        """Run times of the most recently finished jobs of `kinds`."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT finished_at - started_at FROM jobs WHERE kind IN ({_placeholders(kinds)}) "
+                f"AND status IN ('succeeded', 'failed') AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+                (*kinds, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def heartbeat_worker(self, worker_id: str, kinds: List[str], slots: int, host: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO workers (id, kinds, slots, host, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET kinds = excluded.kinds, slots = excluded.slots, last_seen = excluded.last_seen",
+                (worker_id, ",".join(kinds), slots, host, time.time()),
+            )
+
+    def remove_worker(self, worker_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def live_slots(self, kinds: List[str], ttl_seconds: float = 30.0) -> int:
+        """Total execution slots of workers that serve any of `kinds` and were seen within the ttl."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT kinds, slots FROM workers WHERE last_seen > ?", (time.time() - ttl_seconds,)).fetchall()
+        return sum(row["slots"] for row in rows if set(row["kinds"].split(",")) & set(kinds))
+
+    def prune(self, older_than_seconds: Optional[float] = None) -> int:
+        """Delete finished jobs older than the given age, by default the retention period. Returns the number of jobs removed."""
+        if older_than_seconds is None:
+            older_than_seconds = self.retention_seconds
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({_placeholders(TERMINAL_STATUSES)}) AND finished_at < ?",
+                (*TERMINAL_STATUSES, time.time() - older_than_seconds),
+            )
+        return cursor.rowcount
@@ -0,0 +1,138 @@
+"""
+Latency-aware choice of the LLM each crew run uses.
+
+Every task has a strong model and, optionally, a fast one:
+
+- strong: ADGEN_LLM_MODEL_<TASK> (e.g. ADGEN_LLM_MODEL_GENERATE_SCRIPT), else ADGEN_LLM_MODEL, else
+  whatever the crew's agents default to;
+- fast: ADGEN_LLM_FAST_MODEL_<TASK>, else ADGEN_LLM_FAST_MODEL. Without one, every run of the task
+  uses the strong model.
+
+Full generation always gets the strong model. A refinement is small when it selects at most
+ADGEN_ROUTING_SMALL_MAX_SENTENCES sentences (default 2) with an instruction of at most
+ADGEN_ROUTING_SMALL_MAX_INSTRUCTION_CHARS characters (default 200); small refinements get the fast
+model, larger ones the strong model.
+
+Every run feeds back into the routing. The router keeps an exponentially weighted moving average
+(ADGEN_ROUTING_EWMA_ALPHA, default 0.2) of the crew's kickoff time and of its failure rate (crew
+errors, or output that could not be parsed) per task, size and model. Once both models have
+ADGEN_ROUTING_MIN_SAMPLES runs of a kind (default 5), a fast model that is no faster than the strong
+one is passed over. Once the fast model has that many runs, it is also passed over while it fails
+more than ADGEN_ROUTING_MAX_FAILURE_RATE of them (default 0.25). ADGEN_ROUTING_EXPLORE_RATE (default
+0.05) of small refinements go to the other model, so both keep being measured and a passed-over
+model can come back.
+
+Statistics are kept per process: the API process in local execution mode, each worker in distributed mode.
+The model of a run reaches the crew subprocess as CREW_LLM_MODEL.
+"""
+
+import os
+import random
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from utils.observability.metrics import MODEL_ROUTING_DECISIONS, MODEL_ROUTING_FAILURE_RATE, MODEL_ROUTING_LATENCY
+
+# Key for runs on the crew's default model
+DEFAULT_MODEL = "default"
+
+
+class _ModelStats:
+    def __init__(self):
+        self.samples = 0
+        self.latency_samples = 0
+        self.latency: Optional[float] = None
+        self.failure_rate = 0.0
+
+
+class ModelRouter:
+    def __init__(self, small_max_sentences: int = 2, small_max_instruction_chars: int = 200, alpha: float = 0.2,
+                 min_samples: int = 5, max_failure_rate: float = 0.25, explore_rate: float = 0.05):
+        self.small_max_sentences = small_max_sentences
+        self.small_max_instruction_chars = small_max_instruction_chars
+        self.alpha = alpha
+        self.min_samples = max(1, min_samples)
+        self.max_failure_rate = max_failure_rate
+        self.explore_rate = explore_rate
+        self._stats: Dict[Tuple[str, str, str], _ModelStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def models(task: str) -> Tuple[Optional[str], Optional[str]]:
+        """The strong and fast model of a task; None means the crew's default, or no fast model."""
+        suffix = task.upper()
+        strong = os.environ.get(f"ADGEN_LLM_MODEL_{suffix}") or os.environ.get("ADGEN_LLM_MODEL") or None
+        fast = os.environ.get(f"ADGEN_LLM_FAST_MODEL_{suffix}") or os.environ.get("ADGEN_LLM_FAST_MODEL") or None
+        return strong, fast
+
+    def size(self, task: str, inputs: Dict[str, Any]) -> str:
+        if task != "regenerate_script":
+            return "full"
+        selected = inputs.get("selected_sentences") or []
+        instruction = inputs.get("improvement_instruction") or ""
+        if len(selected) <= self.small_max_sentences and len(instruction) <= self.small_max_instruction_chars:
+            return "small"
+        return "large"
+
+    def _get(self, task: str, size: str, model: Optional[str]) -> _ModelStats:
+        return self._stats.setdefault((task, size, model or DEFAULT_MODEL), _ModelStats())
+
+    def route(self, task: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Pick the model of a crew run. The decision is returned in response metadata and passed back to observe()."""
+        strong, fast = self.models(task)
+        size = self.size(task, inputs)
+        if size != "small" or fast is None or fast == strong:
+            reason = {"full": "full_generation", "large": "large_refinement"}.get(size, "no_fast_model")
+            return self._decide(task, size, strong, "strong", reason)
+        with self._lock:
+            fast_stats, strong_stats = self._get(task, size, fast), self._get(task, size, strong)
+            if fast_stats.samples >= self.min_samples and fast_stats.failure_rate > self.max_failure_rate:
+                tier, reason = "strong", "fast_model_failing"
+            elif (fast_stats.latency_samples >= self.min_samples and strong_stats.latency_samples >= self.min_samples
+                  and fast_stats.latency >= strong_stats.latency):
+                tier, reason = "strong", "fast_model_slower"
+            else:
+                tier, reason = "fast", "small_refinement"
+        if random.random() < self.explore_rate:
+            tier, reason = ("strong" if tier == "fast" else "fast"), "exploration"
+        return self._decide(task, size, fast if tier == "fast" else strong, tier, reason)
+
+    def _decide(self, task: str, size: str, model: Optional[str], tier: str, reason: str) -> Dict[str, Any]:
+        MODEL_ROUTING_DECISIONS.labels(task=task, model=model or DEFAULT_MODEL, reason=reason).inc()
+        return {"task": task, "size": size, "model": model, "tier": tier, "reason": reason}
+
+    def observe(self, decision: Optional[Dict[str, Any]], seconds: Optional[float], failed: bool):
+        """Record how a routed run went: its crew kickoff time (None if the crew did not report one) and whether it failed."""
+        if decision is None:
+            return
+        with self._lock:
+            stats = self._get(decision["task"], decision["size"], decision["model"])
+            stats.samples += 1
+            # The first observation replaces the prior outright
+            weight = max(self.alpha, 1 / stats.samples)
+            stats.failure_rate += weight * (float(failed) - stats.failure_rate)
+            if seconds is not None:
+                stats.latency_samples += 1
+                latency_weight = max(self.alpha, 1 / stats.latency_samples)
+                stats.latency = seconds if stats.latency is None else stats.latency + latency_weight * (seconds - stats.latency)
+            labels = {"task": decision["task"], "size": decision["size"], "model": decision["model"] or DEFAULT_MODEL}
+            MODEL_ROUTING_FAILURE_RATE.labels(**labels).set(stats.failure_rate)
+            if stats.latency is not None:
+                MODEL_ROUTING_LATENCY.labels(**labels).set(stats.latency)
+
+
+_router: Optional[ModelRouter] = None
+
+
+def get_model_router() -> ModelRouter:
+    global _router
+    if _router is None:
+        _router = ModelRouter(
+            small_max_sentences=int(os.environ.get("ADGEN_ROUTING_SMALL_MAX_SENTENCES", "2")),
+            small_max_instruction_chars=int(os.environ.get("ADGEN_ROUTING_SMALL_MAX_INSTRUCTION_CHARS", "200")),
+            alpha=float(os.environ.get("ADGEN_ROUTING_EWMA_ALPHA", "0.2")),
+            min_samples=int(os.environ.get("ADGEN_ROUTING_MIN_SAMPLES", "5")),
+            max_failure_rate=float(os.environ.get("ADGEN_ROUTING_MAX_FAILURE_RATE", "0.25")),
+            explore_rate=float(os.environ.get("ADGEN_ROUTING_EXPLORE_RATE", "0.05")),
+        )
+    return _router
@@ -0,0 +1,162 @@
+"""
+Logging configuration for development and production.
+
+ADGEN_LOG_MODE=development (the default) keeps the verbose DEBUG logging to stderr the
+backend has always used. ADGEN_LOG_MODE=production switches to:
+
+- structured JSON records carrying the current trace id,
+- a queue handler, so formatting and I/O happen on a listener thread, not in request handlers,
+- sampling and truncation of large payloads (crew inputs, crew stdout/stderr),
+- non-verbose crew runs, unless ADGEN_CREW_VERBOSE overrides it.
+"""
+
+import atexit
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from utils.observability.tracing import current_trace_id
+
+# Payloads longer than this are truncated in production logs
+DEFAULT_PAYLOAD_MAX_CHARS = 2000
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def is_production() -> bool:
+    return os.environ.get("ADGEN_LOG_MODE", "development").lower() == "production"
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the caller: records are dropped (and counted) if the queue is full.
+    Only the message interpolation happens in the calling thread; JSON formatting and I/O
+    happen on the listener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The trace id lives in a context variable, so it must be captured in the calling thread
+        record.trace_id = current_trace_id()
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging():
+    """Configure the root logger according to ADGEN_LOG_MODE and ADGEN_LOG_LEVEL."""
+    global _listener
+    if not is_production():
+        logging.basicConfig(level=os.environ.get("ADGEN_LOG_LEVEL", "DEBUG").upper())
+        return
+
+    log_file = os.environ.get("ADGEN_LOG_FILE")
+    output_handler = logging.FileHandler(log_file) if log_file else logging.StreamHandler()
+    output_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=int(os.environ.get("ADGEN_LOG_QUEUE_SIZE", "10000")))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    root.setLevel(os.environ.get("ADGEN_LOG_LEVEL", "INFO").upper())
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def summarize_payload(payload: Any, max_chars: Optional[int] = None) -> str:
+    """
+    Render a payload for logging.
+    In development the full payload is returned. In production only a sampled fraction of
+    payloads (ADGEN_LOG_PAYLOAD_SAMPLE_RATE) is logged in full; the rest are truncated to max_chars.
+    """
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    if not is_production():
+        return text
+    if max_chars is None:
+        max_chars = int(os.environ.get("ADGEN_LOG_PAYLOAD_MAX_CHARS", DEFAULT_PAYLOAD_MAX_CHARS))
+    sample_rate = float(os.environ.get("ADGEN_LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+    if len(text) <= max_chars or random.random() < sample_rate:
+        return text
+    return f"{text[:max_chars]}... [{len(text) - max_chars} more chars]"
+
+
+def crew_verbose() -> str:
+    """Value for CREW_VERBOSE in the crew subprocesses: verbose in development, quiet in production."""
+    return os.environ.get("ADGEN_CREW_VERBOSE", "false" if is_production() else "true")
+
+
+class RingBuffer:
+    """
+    Keeps the last max_bytes of a byte stream, such as a crew subprocess's stdout.
+    Older chunks are discarded as new ones arrive, so memory stays bounded however much the crew prints.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.discarded_bytes = 0
+        self._chunks = collections.deque()
+
+    def append(self, chunk: bytes):
+        if not chunk:
+            return
+        if len(chunk) > self.max_bytes:
+            self.discarded_bytes += len(chunk) - self.max_bytes
+            chunk = chunk[-self.max_bytes:]
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.max_bytes:
+            oldest = self._chunks.popleft()
+            overflow = self.size - self.max_bytes
+            if len(oldest) > overflow:
+                # Keep the tail of the oldest chunk
+                self._chunks.appendleft(oldest[overflow:])
+                self.size -= overflow
+                self.discarded_bytes += overflow
+            else:
+                self.size -= len(oldest)
+                self.discarded_bytes += len(oldest)
+
+    def getvalue(self) -> str:
+        text = b"".join(self._chunks).decode(errors="replace")
+        if self.discarded_bytes:
+            return f"[{self.discarded_bytes} earlier bytes discarded]\n{text}"
+        return text
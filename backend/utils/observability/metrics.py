@@ -0,0 +1,337 @@
+"""
+Minimal Prometheus-style metrics registry.
+
+Metrics are kept in process memory and rendered in the Prometheus text exposition
+format by the /metrics endpoint. Only counters, gauges and histograms are supported,
+which is all the backend needs, so we avoid pulling in an extra client library.
+"""
+
+import math
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+# Buckets in seconds, spanning fast parsing steps up to full crew runs and long TTS jobs
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Dict[str, str] = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """Return the child metric for the given label values, creating it on first use."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in self._items()
+        ]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in self._items()
+        ]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in self._items():
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metrics shared across the backend
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "adgen_stage_duration_seconds",
+    "Duration of each pipeline stage in seconds.",
+    ["pipeline", "stage"],
+))
+STAGE_FAILURES = REGISTRY.register(Counter(
+    "adgen_stage_failures_total",
+    "Number of pipeline stages that raised an exception.",
+    ["pipeline", "stage"],
+))
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "adgen_http_request_duration_seconds",
+    "End-to-end HTTP request latency in seconds.",
+    ["method", "path", "status"],
+))
+JOBS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "adgen_jobs_in_flight",
+    "Number of crew and TTS jobs currently executing.",
+    ["kind"],
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "adgen_queue_depth",
+    "Number of crew and TTS jobs waiting for an execution slot.",
+    ["kind"],
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "adgen_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss; in_flight for speculative audio still being synthesized).",
+    ["cache", "result"],
+))
+VALIDATION_REVERTS = REGISTRY.register(Counter(
+    "adgen_validation_reverted_sentences_total",
+    "Non-selected sentences reverted by refinement validation.",
+))
+VALIDATION_LENGTH_MISMATCHES = REGISTRY.register(Counter(
+    "adgen_validation_length_mismatches_total",
+    "Refinement outputs whose length did not match the original script.",
+))
+VALIDATION_FALLBACKS = REGISTRY.register(Counter(
+    "adgen_validation_fallbacks_total",
+    "Refinement outputs that could not be processed and fell back to the original script.",
+))
+TOKENS = REGISTRY.register(Counter(
+    "adgen_llm_tokens_total",
+    "LLM tokens reported by the crews, by task and token type.",
+    ["task", "type"],
+))
+ADMISSION_REJECTIONS = REGISTRY.register(Counter(
+    "adgen_admission_rejections_total",
+    "Requests rejected with 429 before any work started, by job kind and reason (rate_limited or queue_full).",
+    ["kind", "reason"],
+))
+SCHEDULER_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "adgen_scheduler_queue_depth",
+    "Jobs waiting for an execution slot, by gate and priority lane.",
+    ["gate", "lane"],
+))
+SCHEDULER_RUNNING = REGISTRY.register(Gauge(
+    "adgen_scheduler_running",
+    "Jobs holding an execution slot, by gate and priority lane.",
+    ["gate", "lane"],
+))
+SCHEDULER_WAIT = REGISTRY.register(Histogram(
+    "adgen_scheduler_wait_seconds",
+    "Time jobs waited for an execution slot, by gate and priority lane.",
+    ["gate", "lane"],
+))
+SCHEDULER_DISPATCHES = REGISTRY.register(Counter(
+    "adgen_scheduler_dispatches_total",
+    "Slots granted by gate, lane and reason (immediate, weighted, or aged for starvation protection).",
+    ["gate", "lane", "reason"],
+))
+SCRIPT_STORE_BYTES = REGISTRY.register(Counter(
+    "adgen_script_store_bytes_total",
+    "Bytes written to the script version store, by encoding (delta or snapshot).",
+    ["encoding"],
+))
+DURATION_ESTIMATE_ERROR = REGISTRY.register(Histogram(
+    "adgen_duration_estimate_error_seconds",
+    "Absolute error of the per-line duration estimate against the synthesized line, by TTS backend.",
+    ["backend"],
+))
+SPECULATIVE_TTS_JOBS = REGISTRY.register(Counter(
+    "adgen_speculative_tts_jobs_total",
+    "Background syntheses of generated scripts, by outcome (started, completed, superseded, evicted, failed).",
+    ["outcome"],
+))
+AUDIO_JOB_WATCHERS = REGISTRY.register(Gauge(
+    "adgen_audio_job_watchers",
+    "Open connections waiting on audio job progress, by transport (sse or long_poll).",
+    ["transport"],
+))
+CANCELLATIONS = REGISTRY.register(Counter(
+    "adgen_cancellations_total",
+    "Work cancelled before it finished, by pipeline and reason (client_disconnect, deadline, or registry for jobs cancelled under a worker).",
+    ["pipeline", "reason"],
+))
+CAMPAIGN_ROWS = REGISTRY.register(Counter(
+    "adgen_campaign_rows_total",
+    "Bulk campaign rows by outcome (succeeded, failed, or retried for each failed attempt that is tried again).",
+    ["outcome"],
+))
+TTS_WORKER_MEMORY = REGISTRY.register(Gauge(
+    "adgen_tts_worker_memory_bytes",
+    "Memory of TTS pool worker processes by backend, worker and kind (rss, pss, or unique: pages no other process maps).",
+    ["backend", "worker", "kind"],
+))
+AUDIO_RENDER_DURATION = REGISTRY.register(Histogram(
+    "adgen_audio_render_seconds",
+    "Time to synthesize a whole script into an audio file, by quality (preview or final).",
+    ["quality"],
+))
+MODEL_ROUTING_DECISIONS = REGISTRY.register(Counter(
+    "adgen_model_routing_decisions_total",
+    "Crew runs by task, model routed to, and reason for the choice.",
+    ["task", "model", "reason"],
+))
+MODEL_ROUTING_LATENCY = REGISTRY.register(Gauge(
+    "adgen_model_routing_latency_seconds",
+    "Moving average of crew kickoff time the model router sees, by task, request size and model.",
+    ["task", "size", "model"],
+))
+MODEL_ROUTING_FAILURE_RATE = REGISTRY.register(Gauge(
+    "adgen_model_routing_failure_rate",
+    "Moving average of the share of crew runs that failed or could not be parsed, by task, request size and model.",
+    ["task", "size", "model"],
+))
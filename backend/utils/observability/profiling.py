@@ -0,0 +1,320 @@
+"""
+Opt-in profiling of single requests, for admins.
+
+A request sent with `X-Profile: 1` and an `X-Admin-Token` equal to ADGEN_ADMIN_TOKEN runs under:
+
+- a sampling profiler: a thread that records the Python stack of every busy thread of the process
+  every ADGEN_PROFILE_INTERVAL_MS (default 5). Samples taken on a thread inside one of the request's
+  stages are attributed to that stage;
+- allocation tracking with tracemalloc: the request's peak traced memory, and the source lines holding
+  the most memory at the stage boundary where the most was held;
+- a per-stage breakdown (wall time, CPU time of the thread that entered the stage, net allocations),
+  recorded by the stage() helper for the stages of the profiled request only.
+
+The profile runs until the response body has been sent, so streamed responses are profiled for as
+long as they stream. The report is stored as JSON under the request's trace id (ADGEN_PROFILE_DIR, default var/profiles,
+keeping the ADGEN_PROFILE_MAX_ENTRIES most recent, default 100) and read back with GET /profiles/{trace_id}.
+One request is profiled at a time; the sampler and tracemalloc see the whole process, so other
+requests running meanwhile show up in the unattributed samples and in the allocation sites.
+
+Without ADGEN_ADMIN_TOKEN the profiling middleware is not installed at all, and outside a profiled
+request stage() only checks a module-level counter.
+"""
+
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_PROFILE_DIR = Path(__file__).parent.parent.parent / "var" / "profiles"
+TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+# Deepest stack recorded per sample, innermost frames first
+MAX_STACK_DEPTH = 64
+TOP_ENTRIES = 25
+
+_STDLIB = sysconfig.get_paths()["stdlib"]
+# Innermost standard library functions of threads that are waiting rather than working
+_IDLE_FUNCTIONS = {"wait", "select", "poll", "get", "_worker", "accept", "_wait_for_tstate_lock", "read", "readline"}
+_BACKEND_DIR = str(Path(__file__).parent.parent.parent)
+
+_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("adgen_profile", default=None)
+# Profiles running in this process; stage() looks at the context variable only while this is non-zero
+_active = 0
+_profile_lock = threading.Lock()
+
+
+def admin_token() -> str:
+    return os.environ.get("ADGEN_ADMIN_TOKEN", "")
+
+
+def is_admin(headers) -> bool:
+    token = admin_token()
+    return bool(token) and hmac.compare_digest(headers.get("x-admin-token", "").encode(), token.encode())
+
+
+def profiling_requested(headers) -> bool:
+    return headers.get("x-profile", "").lower() in ("1", "true", "yes", "on") and is_admin(headers)
+
+
+def current_profile() -> Optional["RequestProfile"]:
+    if not _active:
+        return None
+    profile = _profile.get()
+    # Background tasks started by a profiled request inherit its context, and may outlive it
+    return profile if profile is not None and profile.running else None
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    if path.startswith(_BACKEND_DIR):
+        path = path[len(_BACKEND_DIR) + 1:]
+    elif "site-packages" in path:
+        path = path.split("site-packages", 1)[1].lstrip(os.sep)
+    elif path.startswith(_STDLIB):
+        path = path[len(_STDLIB) + 1:]
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profile: "RequestProfile", interval: float):
+        super().__init__(name="adgen-profiler", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if code.co_name in _IDLE_FUNCTIONS and code.co_filename.startswith(_STDLIB):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.profile.add_sample(ident, stack)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    """Samples, stage timings and allocations of one request."""
+
+    def __init__(self, trace_id: str, method: str, path: str, interval: float):
+        self.trace_id = trace_id
+        self.method = method
+        self.path = path
+        self.interval = interval
+        # Stages each thread is in, innermost last; written by the request's threads, read by the sampler
+        self._thread_stages: Dict[int, List[str]] = defaultdict(list)
+        self._stacks: Counter = Counter()
+        self._stage_samples: Counter = Counter()
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._sampler = _Sampler(self, interval)
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_size = -1
+        self._snapshot_lock = threading.Lock()
+        self.running = False
+
+    def add_sample(self, thread: int, stack: List[str]):
+        stages = self._thread_stages.get(thread)
+        self._stage_samples[stages[-1] if stages else "unattributed"] += 1
+        self._stacks[";".join(reversed(stack))] += 1
+
+    @contextmanager
+    def stage(self, pipeline: str, stage_name: str):
+        name = f"{pipeline}.{stage_name}"
+        thread = threading.get_ident()
+        self._thread_stages[thread].append(name)
+        started, started_cpu = time.perf_counter(), time.thread_time()
+        allocated = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            # Stages of concurrent coroutines on one thread need not end in the order they started
+            stages = self._thread_stages[thread]
+            del stages[len(stages) - 1 - stages[::-1].index(name)]
+            totals = self._stages.setdefault(name, {"count": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "allocated_kb": 0.0})
+            totals["count"] += 1
+            totals["wall_ms"] += 1000 * (time.perf_counter() - started)
+            totals["cpu_ms"] += 1000 * (time.thread_time() - started_cpu)
+            totals["allocated_kb"] += (tracemalloc.get_traced_memory()[0] - allocated) / 1024
+            self._snapshot_if_largest()
+
+    def _snapshot_if_largest(self):
+        with self._snapshot_lock:
+            held = tracemalloc.get_traced_memory()[0]
+            if self.running and held > self._snapshot_size:
+                self._snapshot = tracemalloc.take_snapshot()
+                self._snapshot_size = held
+
+    def start(self):
+        tracemalloc.start()
+        self._started, self._started_cpu = time.perf_counter(), time.process_time()
+        self.running = True
+        self._sampler.start()
+
+    def stop(self, status: int) -> Dict[str, Any]:
+        self._sampler.stop()
+        wall_ms = 1000 * (time.perf_counter() - self._started)
+        cpu_ms = 1000 * (time.process_time() - self._started_cpu)
+        self._snapshot_if_largest()
+        with self._snapshot_lock:
+            self.running = False
+            _, peak = tracemalloc.get_traced_memory()
+            allocations = self._snapshot.statistics("lineno")
+            held = self._snapshot_size
+            tracemalloc.stop()
+
+        self_samples, total_samples = Counter(), Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            self_samples[frames[-1]] += count
+            for frame in set(frames):
+                total_samples[frame] += count
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "created_at": time.time(),
+            "wall_ms": round(wall_ms, 1),
+            # Of the whole process, all threads
+            "process_cpu_ms": round(cpu_ms, 1),
+            "sampling_interval_ms": self.interval * 1000,
+            "samples": sum(self._stage_samples.values()),
+            "samples_by_stage": dict(self._stage_samples.most_common()),
+            "stages": [
+                {"stage": name, **{key: round(value, 1) for key, value in totals.items()}}
+                for name, totals in sorted(self._stages.items(), key=lambda item: -item[1]["wall_ms"])
+            ],
+            "functions": [
+                {"function": function, "self": self_samples[function], "total": total}
+                for function, total in sorted(total_samples.items(), key=lambda item: (-self_samples[item[0]], -item[1]))[:TOP_ENTRIES]
+            ],
+            "stacks": [{"stack": stack, "samples": count} for stack, count in self._stacks.most_common(TOP_ENTRIES)],
+            "memory": {
+                "peak_traced_kb": round(peak / 1024, 1),
+                # Allocations made during the request and still held at the stage boundary where they peaked
+                "snapshot_traced_kb": round(held / 1024, 1),
+                "top_allocations": [
+                    {"site": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                    for stat in allocations[:TOP_ENTRIES]
+                ],
+            },
+        }
+
+
+class ProfileStore:
+    """Profile reports as <trace_id>.json files; beyond max_entries, the oldest are deleted."""
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 100):
+        self.directory = Path(directory or os.environ.get("ADGEN_PROFILE_DIR", str(DEFAULT_PROFILE_DIR)))
+        self.max_entries = max(1, max_entries)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def put(self, report: Dict[str, Any]):
+        path = self.directory / f"{report['trace_id']}.json"
+        partial_path = path.with_suffix(f".{uuid.uuid4().hex}.partial")
+        partial_path.write_text(json.dumps(report, indent=2))
+        os.replace(partial_path, path)
+        entries = sorted(self.directory.glob("*.json"), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:-self.max_entries]:
+            entry.unlink(missing_ok=True)
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        if not TRACE_ID_PATTERN.match(trace_id):
+            return None
+        try:
+            return json.loads((self.directory / f"{trace_id}.json").read_text())
+        except FileNotFoundError:
+            return None
+
+
+_store: Optional[ProfileStore] = None
+
+
+def get_profile_store() -> ProfileStore:
+    global _store
+    if _store is None:
+        _store = ProfileStore(max_entries=int(os.environ.get("ADGEN_PROFILE_MAX_ENTRIES", "100")))
+    return _store
+
+
+async def profile_request(trace_id: str, method: str, path: str, call_next):
+    """
+    Run call_next under a profile and store the report. Returns the response, with X-Profile set to
+    "stored", or "busy" if another request was being profiled (this one then runs unprofiled).
+    The profile ends when the response body has been sent, so streamed responses (server-sent events,
+    NDJSON) are profiled for as long as they stream, not just until their headers.
+    """
+    global _active
+    with _profile_lock:
+        if _active:
+            busy = True
+        else:
+            busy = False
+            _active += 1
+    if busy:
+        response = await call_next()
+        response.headers["X-Profile"] = "busy"
+        return response
+    profile = RequestProfile(trace_id, method, path, float(os.environ.get("ADGEN_PROFILE_INTERVAL_MS", "5")) / 1000)
+    finished = False
+
+    async def store(status: int):
+        global _active
+        report = await asyncio.to_thread(profile.stop, status)
+        with _profile_lock:
+            _active -= 1
+        await asyncio.to_thread(get_profile_store().put, report)
+        logging.info(f"Profiled {method} {path} ({report['wall_ms']} ms, {report['samples']} samples) as {trace_id}")
+
+    async def finish(status: int):
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        # A task of its own, so the profile is stopped and stored even if the request is being cancelled
+        await asyncio.shield(asyncio.ensure_future(store(status)))
+
+    # The endpoint, and the body it streams, run in a task that copies this context when call_next starts it
+    token = _profile.set(profile)
+    try:
+        await asyncio.to_thread(profile.start)
+        response = await call_next()
+    except BaseException:
+        await finish(500)
+        raise
+    finally:
+        _profile.reset(token)
+    response.headers["X-Profile"] = "stored"
+    body = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            await finish(response.status_code)
+
+    response.body_iterator = profiled_body()
+    return response
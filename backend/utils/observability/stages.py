@@ -0,0 +1,34 @@
+import asyncio
+import time
+from contextlib import contextmanager, nullcontext
+
+from utils.observability.metrics import STAGE_DURATION, STAGE_FAILURES
+from utils.observability.profiling import current_profile
+from utils.observability.tracing import start_span
+
+
+def observe_stage(pipeline: str, stage_name: str, seconds: float):
+    """Record a stage duration that was measured elsewhere (e.g. inside a crew subprocess)."""
+    STAGE_DURATION.labels(pipeline=pipeline, stage=stage_name).observe(seconds)
+
+
+@contextmanager
+def stage(pipeline: str, stage_name: str, **attributes):
+    """
+    Time a pipeline stage, record it in the stage latency histogram and trace it as a span.
+    Failures are counted separately and the duration is still recorded. Cancellation is not a
+    failure of the stage (see adgen_cancellations_total).
+    Stages of a profiled request are also added to its profile.
+    """
+    started = time.perf_counter()
+    profile = current_profile()
+    try:
+        with start_span(f"{pipeline}.{stage_name}", **attributes) as span, profile.stage(pipeline, stage_name) if profile else nullcontext():
+            yield span
+    except asyncio.CancelledError:
+        raise
+    except BaseException:
+        STAGE_FAILURES.labels(pipeline=pipeline, stage=stage_name).inc()
+        raise
+    finally:
+        observe_stage(pipeline, stage_name, time.perf_counter() - started)
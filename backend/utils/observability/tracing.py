@@ -0,0 +1,241 @@
+"""
+Lightweight request tracing.
+
+Spans are tracked with a context variable, so nested stages (in the API process, in
+threads started with asyncio.to_thread and in background tasks) attach to the right
+parent automatically. Trace context crosses process boundaries as a W3C `traceparent`
+string, e.g. in the TRACEPARENT environment variable of the crew subprocesses.
+
+Finished spans are exported by a background thread, either appended to a JSONL file
+(ADGEN_TRACE_FILE) or posted as OTLP/HTTP JSON to a local collector (ADGEN_OTLP_ENDPOINT,
+e.g. http://localhost:4318/v1/traces). With neither configured, trace ids are still
+generated and returned to clients, but spans are not exported.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+SERVICE_NAME = "adgen-backend"
+
+# Flush a batch when it reaches this size or after this many seconds
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL_SECONDS = 1.0
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("adgen_current_span", default=None)
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None, attributes: Dict[str, Any] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes or {})
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_ns": self.start_time_ns,
+            "end_time_ns": self.end_time_ns,
+            "duration_ms": round((self.end_time_ns - self.start_time_ns) / 1e6, 3) if self.end_time_ns else None,
+            "attributes": self.attributes,
+            "error": self.error,
+            "service": SERVICE_NAME,
+        }
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Parse a W3C traceparent header into (trace_id, parent_span_id), or None if it is invalid."""
+    if not traceparent:
+        return None
+    parts = traceparent.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2]
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent to hand to a subprocess or background job so its spans join the current trace."""
+    span = _current_span.get()
+    return span.traceparent if span else None
+
+
+@contextmanager
+def start_span(name: str, traceparent: Optional[str] = None, **attributes):
+    """
+    Start a span as a child of the current span.
+    A traceparent can be passed to continue a trace started in another process instead.
+    """
+    remote_parent = parse_traceparent(traceparent)
+    parent = _current_span.get()
+    if remote_parent:
+        span = Span(name, remote_parent[0], remote_parent[1], attributes)
+    elif parent:
+        span = Span(name, parent.trace_id, parent.span_id, attributes)
+    else:
+        span = Span(name, new_trace_id(), None, attributes)
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_time_ns = time.time_ns()
+        get_exporter().export(span.to_dict())
+
+
+def record_remote_spans(spans: List[Dict[str, Any]]):
+    """Export spans that were recorded by another process (e.g. a crew subprocess report)."""
+    exporter = get_exporter()
+    for span in spans:
+        exporter.export({"service": SERVICE_NAME, **span})
+
+
+def _to_otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp_span(span: Dict[str, Any]) -> Dict[str, Any]:
+    otlp_span = {
+        "traceId": span["trace_id"],
+        "spanId": span["span_id"],
+        "name": span["name"],
+        "kind": 1,
+        "startTimeUnixNano": str(span["start_time_ns"]),
+        "endTimeUnixNano": str(span["end_time_ns"]),
+        "attributes": [{"key": key, "value": _to_otlp_value(value)} for key, value in span.get("attributes", {}).items()],
+        "status": {"code": 2, "message": span["error"]} if span.get("error") else {"code": 1},
+    }
+    if span.get("parent_span_id"):
+        otlp_span["parentSpanId"] = span["parent_span_id"]
+    return otlp_span
+
+
+class SpanExporter:
+    """
+    Exports finished spans from a background thread so request handling never waits on file or network I/O.
+    Spans are dropped (and counted) if the queue is full.
+    """
+
+    def __init__(self, trace_file: Optional[str] = None, otlp_endpoint: Optional[str] = None, max_queue_size: int = 10000):
+        self.trace_file = trace_file
+        self.otlp_endpoint = otlp_endpoint
+        self.enabled = bool(trace_file or otlp_endpoint)
+        self.dropped = 0
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        if self.enabled:
+            threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+
+    def export(self, span: Dict[str, Any]):
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EXPORT_INTERVAL_SECONDS
+            while len(batch) < EXPORT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logging.warning(f"Failed to export {len(batch)} spans: {str(e)}")
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        if self.trace_file:
+            with open(self.trace_file, "a") as trace_file:
+                trace_file.write("".join(json.dumps(span) + "\n" for span in batch))
+        if self.otlp_endpoint:
+            payload = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                    "scopeSpans": [{"scope": {"name": "adgen"}, "spans": [_to_otlp_span(span) for span in batch]}],
+                }]
+            }
+            request = urllib.request.Request(
+                self.otlp_endpoint,
+                data=json.dumps(payload).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+
+
+_exporter: Optional[SpanExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> SpanExporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanExporter(
+                    trace_file=os.environ.get("ADGEN_TRACE_FILE"),
+                    otlp_endpoint=os.environ.get("ADGEN_OTLP_ENDPOINT"),
+                )
+    return _exporter
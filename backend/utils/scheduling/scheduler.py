@@ -0,0 +1,128 @@
+"""
+Priority scheduling of crew and TTS jobs.
+
+Jobs wait in one of three lanes, highest priority first:
+
+- interactive: refinements a copywriter is waiting on (/regenerate_script),
+- standard: script generation and on-demand audio,
+- bulk: batch and background work.
+
+When a slot frees up, the next lane is picked by stride scheduling: every lane advances a virtual
+clock by 1/weight per job it starts, and the lane with the lowest clock goes next, so under contention
+the lanes share slots in proportion to their weights (6:3:1 by default) rather than strictly by priority.
+Two rules keep latency predictable:
+
+- starvation protection: a job that has waited longer than max_wait_seconds goes next regardless of lane,
+- lane limits: bulk jobs may only hold capacity - 1 slots (when there is more than one), so a burst of
+  bulk work cannot occupy every slot while an interactive edit waits for a long job to finish. With a
+  single slot, bulk work must hold it only briefly (the TTS gate's bulk jobs take it per line), since
+  reserving it would starve the bulk lane.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from utils.observability.metrics import SCHEDULER_DISPATCHES, SCHEDULER_QUEUE_DEPTH, SCHEDULER_RUNNING, SCHEDULER_WAIT
+
+LANES = ("interactive", "standard", "bulk")
+DEFAULT_WEIGHTS = {"interactive": 6, "standard": 3, "bulk": 1}
+
+
+def lane_rank(lane: str) -> int:
+    """0 for the highest priority lane."""
+    return LANES.index(lane)
+
+
+class _Waiter:
+    def __init__(self, lane: str, future: asyncio.Future):
+        self.lane = lane
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class PriorityScheduler:
+    """Grants `capacity` execution slots to waiters from the priority lanes."""
+
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        weights: Optional[Dict[str, float]] = None,
+        max_wait_seconds: float = 120.0,
+        lane_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.max_wait_seconds = max_wait_seconds
+        self.lane_limits = {lane: self.capacity for lane in LANES}
+        self.lane_limits["bulk"] = max(1, self.capacity - 1)
+        self.lane_limits.update(lane_limits or {})
+        self._queues: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self._running: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._passes: Dict[str, float] = {lane: 0.0 for lane in LANES}
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def waiting(self, up_to_lane: str = LANES[-1]) -> int:
+        """Number of jobs waiting in `up_to_lane` and the lanes above it."""
+        return sum(len(self._queues[lane]) for lane in LANES[:lane_rank(up_to_lane) + 1])
+
+    async def acquire(self, lane: str):
+        """Wait until a slot is granted to this job."""
+        waiter = _Waiter(lane, asyncio.get_running_loop().create_future())
+        if not self._queues[lane]:
+            # A lane that was idle must not bank credit from the time it had no work
+            active_passes = [self._passes[other] for other in LANES if self._queues[other]]
+            if active_passes:
+                self._passes[lane] = max(self._passes[lane], min(active_passes))
+        self._queues[lane].append(waiter)
+        SCHEDULER_QUEUE_DEPTH.labels(gate=self.name, lane=lane).inc()
+        self._dispatch(arriving=waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just as the waiter was cancelled; hand it on
+                self.release(lane)
+            elif waiter in self._queues[lane]:
+                self._queues[lane].remove(waiter)
+                SCHEDULER_QUEUE_DEPTH.labels(gate=self.name, lane=lane).dec()
+            raise
+
+    def release(self, lane: str):
+        self._running[lane] -= 1
+        SCHEDULER_RUNNING.labels(gate=self.name, lane=lane).dec()
+        self._dispatch()
+
+    def _pick_lane(self):
+        eligible = [lane for lane in LANES if self._queues[lane] and self._running[lane] < self.lane_limits[lane]]
+        if not eligible:
+            return None, None
+        oldest = min(eligible, key=lambda lane: self._queues[lane][0].enqueued_at)
+        if time.monotonic() - self._queues[oldest][0].enqueued_at > self.max_wait_seconds:
+            return oldest, "aged"
+        # Ties go to the higher priority lane, since eligible is in priority order
+        return min(eligible, key=lambda lane: self._passes[lane]), "weighted"
+
+    def _dispatch(self, arriving: Optional[_Waiter] = None):
+        while self.running < self.capacity:
+            lane, reason = self._pick_lane()
+            if lane is None:
+                return
+            waiter = self._queues[lane].popleft()
+            if waiter.future.cancelled():
+                # Cancelled while queued; its task has not run its cleanup yet
+                SCHEDULER_QUEUE_DEPTH.labels(gate=self.name, lane=lane).dec()
+                continue
+            self._passes[lane] += 1 / self.weights[lane]
+            self._running[lane] += 1
+            SCHEDULER_QUEUE_DEPTH.labels(gate=self.name, lane=lane).dec()
+            SCHEDULER_RUNNING.labels(gate=self.name, lane=lane).inc()
+            SCHEDULER_WAIT.labels(gate=self.name, lane=lane).observe(time.monotonic() - waiter.enqueued_at)
+            SCHEDULER_DISPATCHES.labels(gate=self.name, lane=lane, reason="immediate" if waiter is arriving else reason).inc()
+            waiter.future.set_result(None)
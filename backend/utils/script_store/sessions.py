@@ -0,0 +1,161 @@
+"""
+Editing sessions: the server-side state of a script being refined.
+
+A session points at a version in the ScriptVersionStore, together with the content hash of that
+version and the refinement context (key selling points, tone, ad length, prompt mode). Refine calls
+then only name the session, the selected indices and the instruction; the server answers with the
+changes against the session's current version and the hashes before and after, so the client can
+apply the delta to its copy and verify that both sides hold the same script.
+
+Updates are compare-and-set on the content hash: a client whose copy is stale (another tab refined
+the script meanwhile) gets a SessionConflict instead of silently overwriting the newer version.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Sequence
+
+from utils.script_store.version_store import ScriptLines, ScriptVersionStore, get_script_store
+
+SESSION_TTL_SECONDS = float(os.environ.get("ADGEN_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS script_sessions (
+    id TEXT PRIMARY KEY,
+    script_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    context TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+class SessionConflict(Exception):
+    """The client's base hash does not match the session's current version."""
+
+    def __init__(self, session: Dict[str, Any]):
+        super().__init__(f"Session {session['session_id']} is at version {session['version']} ({session['content_hash']})")
+        self.session = session
+
+
+class ScriptSessionStore:
+    def __init__(self, script_store: ScriptVersionStore, ttl_seconds: float = SESSION_TTL_SECONDS):
+        # Sessions live next to the versions they point at, so every API process sees the same state
+        self.script_store = script_store
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.script_store.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_session(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "session_id": row["id"],
+            "script_id": row["script_id"],
+            "version": row["version"],
+            "content_hash": row["content_hash"],
+            "context": json.loads(row["context"]),
+        }
+
+    def open(self, context: Dict[str, Any], lines: Optional[ScriptLines] = None,
+             script_id: Optional[str] = None, version: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Start a session, either on a new script (`lines`) or on a version of a stored one
+        (`script_id`, `version` defaulting to the latest).
+        """
+        self.prune()
+        if script_id is None:
+            info = self.script_store.create(lines or [], {"source": "session"})
+        else:
+            info = self.script_store.info(script_id, version if version is not None else self.script_store.head(script_id))
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO script_sessions (id, script_id, version, content_hash, context, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, info["script_id"], info["version"], info["content_hash"], json.dumps(context), now, now),
+            )
+        return self.get(session_id)
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM script_sessions WHERE id = ? AND updated_at > ?", (session_id, time.time() - self.ttl_seconds)
+            ).fetchone()
+        if row is None:
+            raise SessionNotFound(f"Unknown or expired session {session_id}")
+        return self._row_to_session(row)
+
+    def script(self, session: Dict[str, Any]) -> ScriptLines:
+        return self.script_store.get(session["script_id"], session["version"])
+
+    def check(self, session_id: str, base_hash: Optional[str]) -> Dict[str, Any]:
+        """Return the session, or raise SessionConflict if `base_hash` is given and is not its current hash."""
+        session = self.get(session_id)
+        if base_hash is not None and base_hash != session["content_hash"]:
+            raise SessionConflict(session)
+        return session
+
+    def advance(self, session_id: str, base_hash: Optional[str], lines: Optional[ScriptLines] = None,
+                changes: Optional[Sequence[Sequence[Any]]] = None, length: Optional[int] = None,
+                metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Store a new version on top of the session's current one and move the session to it. Returns the
+        updated session with the `changes` against the previous version and its hash as `base_hash`.
+        """
+        session = self.check(session_id, base_hash)
+        info = self.script_store.commit(session["script_id"], session["version"], lines, changes, length, metadata)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE script_sessions SET version = ?, content_hash = ?, updated_at = ? WHERE id = ? AND content_hash = ?",
+                (info["version"], info["content_hash"], time.time(), session_id, session["content_hash"]),
+            )
+        if cursor.rowcount != 1:
+            # Another update won the race; the version stays in the history as a branch
+            raise SessionConflict(self.get(session_id))
+        return {
+            **self.get(session_id),
+            "base_hash": session["content_hash"],
+            "parent_version": session["version"],
+            "length": info["length"],
+            "changes": info["changes"],
+        }
+
+    def close(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM script_sessions WHERE id = ?", (session_id,))
+
+    def prune(self) -> int:
+        """Delete expired sessions. Their script versions are kept."""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM script_sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+        return cursor.rowcount
+
+
+_sessions: Optional[ScriptSessionStore] = None
+
+
+def get_session_store() -> ScriptSessionStore:
+    global _sessions
+    if _sessions is None:
+        _sessions = ScriptSessionStore(get_script_store())
+    return _sessions
+
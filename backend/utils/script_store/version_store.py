@@ -0,0 +1,353 @@
+"""
+Server-side version history for scripts.
+
+A script is stored once in full (version 1). Every later version, such as a refinement, is stored
+as a delta against its parent: the script length plus the (index, line, artDirection) entries
+that changed. Storage therefore grows with the size of the edits rather than with the size of the
+script. Every SNAPSHOT_INTERVAL versions a full snapshot is stored instead, which bounds the number
+of deltas needed to rebuild any version. Versions are immutable, so rebuilt scripts are cached.
+
+Any version can be the parent of a new one, so reverting to an older version and editing from there
+creates a branch instead of losing history.
+
+Scripts without a new version for RETENTION_SECONDS are deleted with their history, unless an
+editing session (sessions.py) still points at them.
+
+Like the job registry, this is SQLite in WAL mode (ADGEN_SCRIPT_STORE_PATH), shared by every API
+process on a host.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.observability.metrics import CACHE_REQUESTS, SCRIPT_STORE_BYTES
+
+DEFAULT_STORE_PATH = Path(__file__).parent.parent.parent / "var" / "scripts.sqlite3"
+SNAPSHOT_INTERVAL = int(os.environ.get("ADGEN_SCRIPT_SNAPSHOT_INTERVAL", "20"))
+RETENTION_SECONDS = float(os.environ.get("ADGEN_SCRIPT_RETENTION_SECONDS", str(30 * 24 * 3600)))
+# Pruning scans every script, so each process runs it at most this often
+PRUNE_INTERVAL_SECONDS = 600.0
+
+# A script line is a (line, artDirection) pair, as in RefineRequest.current_script
+ScriptLines = List[Tuple[str, str]]
+# A change sets one index to a new (line, artDirection); indices at or past the parent's length append
+Change = Tuple[int, str, str]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scripts (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    head_version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS script_versions (
+    script_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    parent_version INTEGER,
+    depth INTEGER NOT NULL,
+    encoding TEXT NOT NULL,
+    body TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    metadata TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (script_id, version)
+);
+"""
+
+
+class ScriptNotFound(KeyError):
+    pass
+
+
+def content_hash(lines: Sequence[Sequence[str]]) -> str:
+    """Stable hash of a script's content, used to verify reconstructions and client state."""
+    canonical = json.dumps([[line, art] for line, art in lines], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def compute_delta(old: ScriptLines, new: ScriptLines) -> List[Change]:
+    """Entries of `new` that differ from `old` at the same index, plus any appended lines."""
+    changes = []
+    for index, (line, art) in enumerate(new):
+        if index >= len(old) or tuple(old[index]) != (line, art):
+            changes.append((index, line, art))
+    return changes
+
+
+def apply_delta(lines: ScriptLines, length: int, changes: Sequence[Sequence[Any]]) -> ScriptLines:
+    """Apply a delta to a script: truncate to `length`, then set each changed index."""
+    result = [tuple(pair) for pair in lines[:length]]
+    for index, line, art in changes:
+        if index < len(result):
+            result[index] = (line, art)
+        elif index == len(result):
+            result.append((line, art))
+        else:
+            raise ValueError(f"Delta change at index {index} leaves a gap in a script of {len(result)} lines")
+    if len(result) != length:
+        raise ValueError(f"Delta produced {len(result)} lines, expected {length}")
+    return result
+
+
+class ScriptVersionStore:
+    def __init__(self, path: Optional[str] = None, snapshot_interval: int = SNAPSHOT_INTERVAL, cache_size: int = 256,
+                 retention_seconds: float = RETENTION_SECONDS):
+        self.path = Path(path or os.environ.get("ADGEN_SCRIPT_STORE_PATH", str(DEFAULT_STORE_PATH)))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.snapshot_interval = max(1, snapshot_interval)
+        self.retention_seconds = retention_seconds
+        self._pruned_at = 0.0
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, int], ScriptLines]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _cache_get(self, key: Tuple[str, int]) -> Optional[ScriptLines]:
+        with self._cache_lock:
+            lines = self._cache.get(key)
+            if lines is not None:
+                self._cache.move_to_end(key)
+            return lines
+
+    def _cache_put(self, key: Tuple[str, int], lines: ScriptLines):
+        with self._cache_lock:
+            self._cache[key] = lines
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _version_info(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "script_id": row["script_id"],
+            "version": row["version"],
+            "parent_version": row["parent_version"],
+            "length": row["length"],
+            "content_hash": row["content_hash"],
+            "metadata": json.loads(row["metadata"]) if row["metadata"] else {},
+            "created_at": row["created_at"],
+        }
+
+    def _insert_version(self, conn, script_id: str, version: int, parent_version: Optional[int], depth: int,
+                        encoding: str, body: Any, lines: ScriptLines, metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        encoded = json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+        conn.execute(
+            "INSERT INTO script_versions (script_id, version, parent_version, depth, encoding, body, length, content_hash, metadata, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (script_id, version, parent_version, depth, encoding, encoded, len(lines), content_hash(lines),
+             json.dumps(metadata) if metadata else None, time.time()),
+        )
+        SCRIPT_STORE_BYTES.labels(encoding=encoding).inc(len(encoded.encode("utf-8")))
+        row = conn.execute("SELECT * FROM script_versions WHERE script_id = ? AND version = ?", (script_id, version)).fetchone()
+        return self._version_info(row)
+
+    def create(self, lines: ScriptLines, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Store a new script as version 1 and return its version info."""
+        if time.time() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+            self.prune()
+        lines = [tuple(pair) for pair in lines]
+        script_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT INTO scripts (id, created_at, head_version) VALUES (?, ?, 1)", (script_id, time.time()))
+                info = self._insert_version(conn, script_id, 1, None, 0, "snapshot", [list(pair) for pair in lines], lines, metadata)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self._cache_put((script_id, 1), lines)
+        return info
+
+    def commit(self, script_id: str, parent_version: int, lines: Optional[ScriptLines] = None,
+               changes: Optional[Sequence[Sequence[Any]]] = None, length: Optional[int] = None,
+               metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Store a new version derived from `parent_version`, given either its full `lines` or the `changes`
+        (and optionally the new `length`) against the parent. Only the delta is stored.
+        """
+        parent_lines = self.get(script_id, parent_version)
+        if lines is None:
+            new_length = len(parent_lines) if length is None else length
+            lines = apply_delta(parent_lines, new_length, changes or [])
+        lines = [tuple(pair) for pair in lines]
+        delta = compute_delta(parent_lines, lines)
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                head = conn.execute("SELECT head_version FROM scripts WHERE id = ?", (script_id,)).fetchone()["head_version"]
+                parent_depth = conn.execute(
+                    "SELECT depth FROM script_versions WHERE script_id = ? AND version = ?", (script_id, parent_version)
+                ).fetchone()["depth"]
+                version = head + 1
+                if parent_depth + 1 >= self.snapshot_interval:
+                    info = self._insert_version(conn, script_id, version, parent_version, 0, "snapshot",
+                                                [list(pair) for pair in lines], lines, metadata)
+                else:
+                    body = {"length": len(lines), "changes": [list(change) for change in delta]}
+                    info = self._insert_version(conn, script_id, version, parent_version, parent_depth + 1, "delta", body, lines, metadata)
+                conn.execute("UPDATE scripts SET head_version = ? WHERE id = ?", (version, script_id))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        # Cache only once committed: a rolled back version number is reused by the next commit
+        self._cache_put((script_id, version), lines)
+        info["changes"] = delta
+        return info
+
+    def head(self, script_id: str) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT head_version FROM scripts WHERE id = ?", (script_id,)).fetchone()
+        if row is None:
+            raise ScriptNotFound(f"Unknown script {script_id}")
+        return row["head_version"]
+
+    def get(self, script_id: str, version: Optional[int] = None) -> ScriptLines:
+        """Rebuild a version (the head by default) from its nearest snapshot and the deltas after it."""
+        if version is None:
+            version = self.head(script_id)
+        cached = self._cache_get((script_id, version))
+        if cached is not None:
+            CACHE_REQUESTS.labels(cache="script_versions", result="hit").inc()
+            return list(cached)
+        CACHE_REQUESTS.labels(cache="script_versions", result="miss").inc()
+
+        # Walk up the parents to a snapshot or a cached version, then replay the deltas forward
+        chain = []
+        base: Optional[ScriptLines] = None
+        with self._connect() as conn:
+            current = version
+            while True:
+                row = conn.execute(
+                    "SELECT version, parent_version, encoding, body, content_hash FROM script_versions WHERE script_id = ? AND version = ?",
+                    (script_id, current),
+                ).fetchone()
+                if row is None:
+                    raise ScriptNotFound(f"Unknown version {current} of script {script_id}")
+                if row["encoding"] == "snapshot":
+                    base = [tuple(pair) for pair in json.loads(row["body"])]
+                    self._check_hash(script_id, row, base)
+                    break
+                chain.append(row)
+                base = self._cache_get((script_id, row["parent_version"]))
+                if base is not None:
+                    break
+                current = row["parent_version"]
+
+        lines = base
+        for row in reversed(chain):
+            body = json.loads(row["body"])
+            lines = apply_delta(lines, body["length"], body["changes"])
+            self._check_hash(script_id, row, lines)
+            self._cache_put((script_id, row["version"]), lines)
+        self._cache_put((script_id, version), lines)
+        return list(lines)
+
+    @staticmethod
+    def _check_hash(script_id: str, row: sqlite3.Row, lines: ScriptLines):
+        if content_hash(lines) != row["content_hash"]:
+            raise ValueError(f"Version {row['version']} of script {script_id} does not match its content hash")
+
+    def info(self, script_id: str, version: int) -> Dict[str, Any]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM script_versions WHERE script_id = ? AND version = ?", (script_id, version)).fetchone()
+        if row is None:
+            raise ScriptNotFound(f"Unknown version {version} of script {script_id}")
+        return self._version_info(row)
+
+    def history(self, script_id: str, since_version: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Versions after `since_version`, oldest first, each with its changes against its parent. Clients that
+        already hold `since_version` can replay these instead of fetching full scripts.
+        """
+        self.head(script_id)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM script_versions WHERE script_id = ? AND version > ? ORDER BY version LIMIT ?",
+                (script_id, since_version, limit),
+            ).fetchall()
+        history = []
+        for row in rows:
+            entry = self._version_info(row)
+            if row["encoding"] == "delta":
+                body = json.loads(row["body"])
+                entry["changes"] = [tuple(change) for change in body["changes"]]
+            elif row["parent_version"] is None:
+                entry["changes"] = [(index, line, art) for index, (line, art) in enumerate(json.loads(row["body"]))]
+            else:
+                # Snapshots taken to bound the delta chain are still reported as deltas
+                entry["changes"] = compute_delta(self.get(script_id, row["parent_version"]), self.get(script_id, row["version"]))
+            history.append(entry)
+        return history
+
+    def diff(self, script_id: str, from_version: int, to_version: int) -> Dict[str, Any]:
+        """Changes that turn `from_version` into `to_version`, in the same form as a stored delta."""
+        old, new = self.get(script_id, from_version), self.get(script_id, to_version)
+        return {
+            "from_version": from_version,
+            "to_version": to_version,
+            "length": len(new),
+            "changes": compute_delta(old, new),
+        }
+
+    def prune(self) -> int:
+        """
+        Delete scripts whose newest version is older than the retention period, with all their
+        versions. Scripts an editing session points at are kept; expired sessions are deleted by
+        the session store. Returns the number of scripts deleted.
+        """
+        self._pruned_at = time.time()
+        query = "SELECT script_id FROM script_versions GROUP BY script_id HAVING MAX(created_at) < ?"
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                has_sessions = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'script_sessions'"
+                ).fetchone() is not None
+                if has_sessions:
+                    query += " AND script_id NOT IN (SELECT script_id FROM script_sessions)"
+                expired = [row["script_id"] for row in conn.execute(query, (self._pruned_at - self.retention_seconds,))]
+                conn.executemany("DELETE FROM script_versions WHERE script_id = ?", [(script_id,) for script_id in expired])
+                conn.executemany("DELETE FROM scripts WHERE id = ?", [(script_id,) for script_id in expired])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if expired:
+            removed = set(expired)
+            with self._cache_lock:
+                for key in [key for key in self._cache if key[0] in removed]:
+                    del self._cache[key]
+        return len(expired)
+
+
+_store: Optional[ScriptVersionStore] = None
+
+
+def get_script_store() -> ScriptVersionStore:
+    global _store
+    if _store is None:
+        _store = ScriptVersionStore()
+    return _store
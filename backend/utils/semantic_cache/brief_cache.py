@@ -0,0 +1,149 @@
+"""
+Near-duplicate cache for /generate_script (opt-in with ADGEN_SEMANTIC_CACHE=1).
+
+Many briefs differ only trivially from one already generated: punctuation, the order of the key
+selling points, the casing of the tone. An exact-key cache misses these; this one embeds each brief
+locally and serves a previous response when a new brief is similar enough.
+
+Briefs are embedded with a hashing vectorizer (word unigrams plus character trigrams, hashed per field
+into a fixed number of dimensions and L2-normalized), so there is no model to load and no network
+call, and embedding a brief takes well under a millisecond. Similarity is the cosine between embeddings, computed against
+an in-memory matrix per partition.
+
+Only briefs for the same product, ad length and speaker voice are compared: a script for another
+product or another length is never a near-duplicate, however similar the rest of the brief.
+"""
+
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.observability.metrics import CACHE_REQUESTS
+
+# Fields compared by similarity, with their weights in the embedding
+SIMILARITY_FIELDS = {"key_selling_points": 1.0, "target_audience": 0.8, "tone": 0.6}
+# Fields that must match (after normalization) for two briefs to be compared at all
+PARTITION_FIELDS = ("product_name", "ad_length", "speaker_voice")
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def semantic_cache_enabled() -> bool:
+    return os.environ.get("ADGEN_SEMANTIC_CACHE", "0").lower() in ("1", "true", "yes", "on")
+
+
+def normalize_words(text: str) -> List[str]:
+    return _WORD_RE.findall(str(text).casefold())
+
+
+def _bucket(feature: str, dimensions: int) -> int:
+    # crc32 rather than hash(): Python's string hash is salted per process
+    return zlib.crc32(feature.encode("utf-8")) % dimensions
+
+
+def embed_brief(brief: Dict[str, Any], dimensions: int = 4096) -> np.ndarray:
+    """Hashing-vectorizer embedding of a brief's similarity fields, L2-normalized."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for field, weight in SIMILARITY_FIELDS.items():
+        words = normalize_words(brief.get(field, ""))
+        field_vector = np.zeros(dimensions, dtype=np.float32)
+        for word in words:
+            field_vector[_bucket(f"{field}:w:{word}", dimensions)] += 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                field_vector[_bucket(f"{field}:c:{padded[i:i + 3]}", dimensions)] += 0.25
+        norm = np.linalg.norm(field_vector)
+        if norm > 0:
+            # Sublinear term weights, then each field contributes by its weight whatever its length
+            field_vector = np.log1p(field_vector)
+            vector += weight * field_vector / np.linalg.norm(field_vector)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def partition_key(brief: Dict[str, Any]) -> Tuple[str, ...]:
+    return tuple(" ".join(normalize_words(brief.get(field, ""))) for field in PARTITION_FIELDS)
+
+
+class _Partition:
+    def __init__(self, dimensions: int):
+        self.ids: List[int] = []
+        self.matrix = np.zeros((0, dimensions), dtype=np.float32)
+
+
+class SemanticScriptCache:
+    def __init__(self, threshold: float = 0.97, max_entries: int = 1000, ttl_seconds: float = 24 * 3600, dimensions: int = 4096):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.dimensions = dimensions
+        self._partitions: Dict[Tuple[str, ...], _Partition] = {}
+        # Entry id -> (partition key, response, stored at), least recently used first
+        self._entries: "OrderedDict[int, Tuple[Tuple[str, ...], Dict[str, Any], float]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, brief: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], float, float]]:
+        """Return (response, similarity, stored_at) of the closest cached brief above the threshold, or None."""
+        key = partition_key(brief)
+        vector = embed_brief(brief, self.dimensions)
+        with self._lock:
+            partition = self._partitions.get(key)
+            match = None
+            if partition is not None and partition.ids:
+                scores = partition.matrix @ vector
+                best = int(np.argmax(scores))
+                entry_id, score = partition.ids[best], float(scores[best])
+                _, response, stored_at = self._entries[entry_id]
+                if time.time() - stored_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                elif score >= self.threshold:
+                    self._entries.move_to_end(entry_id)
+                    match = (response, score, stored_at)
+        CACHE_REQUESTS.labels(cache="semantic_script", result="hit" if match else "miss").inc()
+        return match
+
+    def store(self, brief: Dict[str, Any], response: Dict[str, Any]):
+        key = partition_key(brief)
+        vector = embed_brief(brief, self.dimensions)
+        with self._lock:
+            partition = self._partitions.setdefault(key, _Partition(self.dimensions))
+            entry_id = self._next_id
+            self._next_id += 1
+            partition.ids.append(entry_id)
+            partition.matrix = np.vstack([partition.matrix, vector[np.newaxis, :]])
+            self._entries[entry_id] = (key, response, time.time())
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        key, _, _ = self._entries.pop(entry_id)
+        partition = self._partitions[key]
+        row = partition.ids.index(entry_id)
+        del partition.ids[row]
+        partition.matrix = np.delete(partition.matrix, row, axis=0)
+        if not partition.ids:
+            del self._partitions[key]
+
+
+_cache: Optional[SemanticScriptCache] = None
+
+
+def get_semantic_cache() -> SemanticScriptCache:
+    global _cache
+    if _cache is None:
+        _cache = SemanticScriptCache(
+            threshold=float(os.environ.get("ADGEN_SEMANTIC_CACHE_THRESHOLD", "0.97")),
+            max_entries=int(os.environ.get("ADGEN_SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+            ttl_seconds=float(os.environ.get("ADGEN_SEMANTIC_CACHE_TTL_SECONDS", str(24 * 3600))),
+        )
+    return _cache
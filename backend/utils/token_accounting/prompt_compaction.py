@@ -0,0 +1,111 @@
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import yaml
+
+PROMPT_MODES = ("full", "compact")
+
+REGENERATE_CONFIG_DIR = Path(__file__).parent.parent.parent / "regenerate_script" / "src" / "regenerate_script" / "config"
+
+# Config files used by the regenerate_script crew for each prompt mode
+PROMPT_CONFIG_FILES = {
+    "full": ("agents.yaml", "tasks.yaml"),
+    "compact": ("agents_compact.yaml", "tasks_compact.yaml"),
+}
+
+# Matches both the verbose markers and the short compact markers, including the index
+MARKER_PATTERN = re.compile(
+    r"\[\[(?:SELECTED FOR MODIFICATION|PRESERVE|EDIT|KEEP):?\s*\d+\]\]\s?"
+    r"|\s?\[\[END (?:SELECTED|PRESERVE)\]\]"
+)
+
+
+def get_prompt_mode(requested_mode: str = None) -> str:
+    """Resolve the prompt mode from the request or the ADGEN_PROMPT_MODE environment variable."""
+    mode = requested_mode or os.environ.get("ADGEN_PROMPT_MODE", "full")
+    if mode not in PROMPT_MODES:
+        raise ValueError(f"Unknown prompt mode '{mode}', expected one of {PROMPT_MODES}")
+    return mode
+
+
+def build_marked_script(current_script: List[Tuple[str, str]], selected_sentences: List[int], mode: str = "full") -> List[List[str]]:
+    """
+    Mark each sentence of the script as selected or preserved.
+
+    In full mode both the line and the art direction are wrapped in verbose start/end markers.
+    In compact mode only the line carries a short prefix marker, which is enough for the agent
+    to tell the sentences apart and saves a large share of the per-line tokens.
+    """
+    selected = set(selected_sentences)
+    marked_script = []
+    for idx, (line, art_direction) in enumerate(current_script):
+        if mode == "compact":
+            marker = f"[[EDIT {idx}]]" if idx in selected else f"[[KEEP {idx}]]"
+            marked_script.append([f"{marker} {line}", art_direction])
+        elif idx in selected:
+            # Mark selected sentences with special prefix/suffix
+            marked_script.append([
+                f"[[SELECTED FOR MODIFICATION: {idx}]] {line} [[END SELECTED]]",
+                f"[[SELECTED FOR MODIFICATION: {idx}]] {art_direction} [[END SELECTED]]"
+            ])
+        else:
+            # Mark non-selected sentences as should be preserved
+            marked_script.append([
+                f"[[PRESERVE: {idx}]] {line} [[END PRESERVE]]",
+                f"[[PRESERVE: {idx}]] {art_direction} [[END PRESERVE]]"
+            ])
+    return marked_script
+
+
+def build_explicit_instruction(selected_sentences: List[int], mode: str = "full") -> str:
+    """
+    Build the instruction reinforcing that only selected sentences may change.
+    The compact task config already states the response rules, so compact mode only adds the indices.
+    """
+    if mode == "compact":
+        return f"Edit ONLY indices {selected_sentences}; return every [[KEEP]] line verbatim."
+    return f"""
+IMPORTANT: You MUST ONLY modify sentences marked with [[SELECTED FOR MODIFICATION]].
+DO NOT change ANY part of sentences marked with [[PRESERVE]].
+Your task is to apply the improvement instruction ONLY to the selected sentences.
+For any sentence not selected (marked with PRESERVE), return it EXACTLY as provided.
+The indices that should be modified are: {selected_sentences}
+"""
+
+
+def strip_markers(text: str) -> str:
+    """Remove selection markers of either prompt mode from a script line or art direction."""
+    return MARKER_PATTERN.sub("", text)
+
+
+@lru_cache(maxsize=None)
+def load_prompt_config(mode: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Load the agent and task configuration the regenerate_script crew uses in the given mode."""
+    agents_file, tasks_file = PROMPT_CONFIG_FILES[mode]
+    agents = yaml.safe_load((REGENERATE_CONFIG_DIR / agents_file).read_text())
+    tasks = yaml.safe_load((REGENERATE_CONFIG_DIR / tasks_file).read_text())
+    return agents, tasks
+
+
+def render_refine_prompt(enhanced_inputs: Dict[str, Any], mode: str) -> str:
+    """
+    Render the prompt text the refinement agent receives (role, goal, backstory and task description).
+    This mirrors the crew's input interpolation closely enough for token estimates and benchmarks.
+    """
+    agents, tasks = load_prompt_config(mode)
+    agent = agents["refine_script_generator"]
+    task = tasks["refine_script_task"]
+    values = {key: value if isinstance(value, str) else str(value) for key, value in enhanced_inputs.items()}
+    description = task["description"]
+    for key, value in values.items():
+        description = description.replace("{" + key + "}", value)
+    return "\n".join([
+        agent["role"],
+        agent["goal"],
+        agent["backstory"],
+        description,
+        task["expected_output"],
+    ])
@@ -0,0 +1,90 @@
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken ships with the crew dependencies, but is optional here
+    tiktoken = None
+
+# Rough characters-per-token ratio used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+
+def estimate_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """
+    Estimate the number of tokens in a piece of text.
+    Uses tiktoken when it is installed and falls back to a character heuristic otherwise.
+    """
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is not None:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def empty_usage() -> Dict[str, int]:
+    return {
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "successful_requests": 0,
+    }
+
+
+def read_crew_report(report_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Read the run report written by a crew subprocess (see CREW_REPORT_PATH in the crew main files).
+    Returns None if the crew did not write a report, e.g. because it failed before kickoff finished.
+    """
+    if not report_path.exists():
+        logging.warning(f"Crew run report not found at {report_path}")
+        return None
+    try:
+        return json.loads(report_path.read_text())
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"Could not read crew run report at {report_path}: {str(e)}")
+        return None
+    finally:
+        try:
+            report_path.unlink()
+        except OSError:
+            pass
+
+
+def build_token_usage(report: Optional[Dict[str, Any]], prompt_mode: str, estimated_prompt_tokens: int) -> Dict[str, Any]:
+    """
+    Combine the token usage reported by the crew with the locally estimated prompt size
+    into the structure returned in response metadata.
+    """
+    usage = empty_usage()
+    tasks = {}
+    if report:
+        for key in usage:
+            usage[key] = int(report.get("token_usage", {}).get(key, 0) or 0)
+        tasks = report.get("tasks", {})
+
+    token_usage = {
+        **usage,
+        "tasks": [
+            {"task": task_name, **{key: int(task_usage.get(key, 0) or 0) for key in usage}}
+            for task_name, task_usage in tasks.items()
+        ],
+        "estimated_prompt_tokens": estimated_prompt_tokens,
+        "prompt_mode": prompt_mode,
+        "reported": report is not None,
+    }
+    logging.info(
+        f"Token usage ({prompt_mode} prompts): prompt={usage['prompt_tokens']}, "
+        f"completion={usage['completion_tokens']}, estimated_prompt={estimated_prompt_tokens}"
+    )
+    return token_usage
@@ -0,0 +1,261 @@
+"""
+TTS backends for the audio pipeline.
+
+The pipeline (per-line generation, merging, serving) only depends on the TTSBackend
+interface, so it can run against the real Parler model or against a lightweight stand-in:
+
+- "parler" (default): ParlerTTSForConditionalGeneration, loaded once per process.
+- "synthetic": a deterministic synthetic waveform with configurable per-character latency
+  and sample rate, for benchmarking and testing the pipeline without model weights.
+
+Select the backend with ADGEN_TTS_BACKEND. With ADGEN_TTS_WORKERS set, either runs in a pool of
+worker processes instead (see tts_pool).
+
+Each backend comes in two qualities. "final" is the full model. "preview" trades fidelity for speed, for
+drafts: Parler loads ADGEN_TTS_PREVIEW_MODEL (by default the final model) with its linear layers
+quantized to int8 on CPU (ADGEN_TTS_PREVIEW_QUANTIZE, on by default), and the synthetic backend
+scales its latency by ADGEN_SYNTHETIC_TTS_PREVIEW_COST (default 0.25). Preview backends always run in
+the requesting process: a second worker pool would double the pool's memory for drafts.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.observability.metrics import CACHE_REQUESTS
+from utils.observability.stages import stage
+
+DEFAULT_PARLER_MODEL = "c0derish/parler-tts-mini-v1-segp-colab"
+
+QUALITIES = ("final", "preview")
+
+
+class TTSBackend:
+    """Synthesizes one script line (transcript plus art direction as the voice description) to a mono waveform."""
+
+    name = "base"
+    # Lines the backend can synthesize at the same time; jobs keep this many lines in flight
+    concurrency = 1
+    quality = "final"
+
+    @property
+    def sampling_rate(self) -> int:
+        raise NotImplementedError
+
+    def set_threads(self, threads: int):
+        """Limit the CPU threads one synthesis uses. Called before load() in TTS worker processes."""
+
+    def load(self):
+        """Load weights or other resources. Called once before the first synthesis."""
+
+    def can_share_weights(self) -> bool:
+        """Whether load() leaves the weights in CPU memory, which processes forked afterwards share copy-on-write."""
+        return True
+
+    def report_memory(self):
+        """Update memory metrics. Only backends running in processes of their own report anything."""
+
+    def synthesize(self, transcript: str, description: str) -> np.ndarray:
+        raise NotImplementedError
+
+    def synthesize_batch(self, items: List[Tuple[str, str]]) -> List[np.ndarray]:
+        """Synthesize several (transcript, description) pairs. Backends that can batch should override this."""
+        return [self.synthesize(transcript, description) for transcript, description in items]
+
+
+class ParlerTTSBackend(TTSBackend):
+    name = "parler"
+
+    def __init__(self, model_name: Optional[str] = None, device: Optional[str] = None, quality: str = "final"):
+        final_model = os.environ.get("ADGEN_TTS_MODEL", DEFAULT_PARLER_MODEL)
+        if model_name is None and quality == "preview":
+            model_name = os.environ.get("ADGEN_TTS_PREVIEW_MODEL") or final_model
+        self.model_name = model_name or final_model
+        self.device = device
+        self.quality = quality
+        self.model = None
+        self.tokenizer = None
+
+    @property
+    def sampling_rate(self) -> int:
+        return self.model.config.sampling_rate
+
+    def set_threads(self, threads: int):
+        import torch
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only possible before the first parallel operation of the process
+            pass
+
+    def can_share_weights(self) -> bool:
+        import torch
+        # CUDA state does not survive a fork; GPU workers load their own copy onto the device
+        return (self.device or ("cuda:0" if torch.cuda.is_available() else "cpu")) == "cpu"
+
+    def load(self):
+        # Imported lazily so the synthetic backend works without torch and parler_tts installed
+        import torch
+        from parler_tts import ParlerTTSForConditionalGeneration
+        from transformers import AutoTokenizer
+
+        if self.device is None:
+            self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.model = ParlerTTSForConditionalGeneration.from_pretrained(self.model_name).to(self.device)
+        # Inference only: nothing writes to the weights, so pages shared with forked workers stay shared
+        self.model.eval().requires_grad_(False)
+        if self.quality == "preview" and self.device == "cpu" and os.environ.get("ADGEN_TTS_PREVIEW_QUANTIZE", "1").lower() in ("1", "true", "yes", "on"):
+            # int8 weights and activations in the decoder's linear layers, where CPU generation spends its time
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+
+    def synthesize(self, transcript: str, description: str) -> np.ndarray:
+        with stage("audio", "tokenize"):
+            description_tokenized = self.tokenizer(
+                text=description,
+                return_tensors="pt",
+            )
+            description_input_ids = description_tokenized.input_ids.to(self.device)
+            # if you remove this attention mask adn look below
+            description_attn_mask = description_tokenized.attention_mask.to(self.device)
+
+            prompt_tokenized = self.tokenizer(
+                text=transcript,
+                return_tensors="pt",
+            )
+            prompt_input_ids = prompt_tokenized.input_ids.to(self.device)
+
+        # and remove the setting of the attention mask here, you should see the pad and eos token error
+        with stage("audio", "generate"):
+            generation = self.model.generate(
+                input_ids=description_input_ids,
+                prompt_input_ids=prompt_input_ids,
+                attention_mask=description_attn_mask,
+            )
+        return generation.cpu().numpy().squeeze()
+
+    def synthesize_batch(self, items: List[Tuple[str, str]]) -> List[np.ndarray]:
+        """One generate call for all items: descriptions and transcripts padded, each output cut to its own length."""
+        if len(items) < 2:
+            return [self.synthesize(transcript, description) for transcript, description in items]
+        with stage("audio", "tokenize", batch=len(items)):
+            descriptions = self.tokenizer([description for _, description in items], return_tensors="pt", padding=True)
+            prompts = self.tokenizer([transcript for transcript, _ in items], return_tensors="pt", padding=True)
+        with stage("audio", "generate", batch=len(items)):
+            generation = self.model.generate(
+                input_ids=descriptions.input_ids.to(self.device),
+                attention_mask=descriptions.attention_mask.to(self.device),
+                prompt_input_ids=prompts.input_ids.to(self.device),
+                prompt_attention_mask=prompts.attention_mask.to(self.device),
+                return_dict_in_generate=True,
+            )
+        return [generation.sequences[i, :generation.audios_length[i]].cpu().numpy() for i in range(len(items))]
+
+
+class SyntheticTTSBackend(TTSBackend):
+    """
+    Deterministic stand-in for a real TTS model.
+    Produces a tone per word whose pitch and length derive from a hash of the input, with short
+    gaps at punctuation, after sleeping seconds_per_char for each transcript character to mimic
+    generation cost. The same input always yields the same samples.
+    weights_mb allocates a read-only buffer of that size on load, to stand in for model weights when
+    measuring memory. The preview quality sleeps preview_cost times as long and yields the same samples.
+    """
+
+    name = "synthetic"
+
+    def __init__(self, sample_rate: Optional[int] = None, seconds_per_char: Optional[float] = None, seconds_per_word: float = 0.3,
+                 weights_mb: Optional[float] = None, quality: str = "final", preview_cost: Optional[float] = None):
+        self._sampling_rate = sample_rate or int(os.environ.get("ADGEN_SYNTHETIC_TTS_SAMPLE_RATE", "44100"))
+        if seconds_per_char is None:
+            seconds_per_char = float(os.environ.get("ADGEN_SYNTHETIC_TTS_SECONDS_PER_CHAR", "0.0"))
+        if weights_mb is None:
+            weights_mb = float(os.environ.get("ADGEN_SYNTHETIC_TTS_WEIGHTS_MB", "0"))
+        if quality == "preview":
+            if preview_cost is None:
+                preview_cost = float(os.environ.get("ADGEN_SYNTHETIC_TTS_PREVIEW_COST", "0.25"))
+            seconds_per_char *= preview_cost
+        self.quality = quality
+        self.seconds_per_char = seconds_per_char
+        self.seconds_per_word = seconds_per_word
+        self.weights_mb = weights_mb
+        self.weights: Optional[np.ndarray] = None
+
+    def load(self):
+        if self.weights_mb:
+            self.weights = np.random.default_rng(0).random(int(self.weights_mb * 2 ** 20 / 4), dtype=np.float32)
+            self.weights.flags.writeable = False
+
+    @property
+    def sampling_rate(self) -> int:
+        return self._sampling_rate
+
+    def synthesize(self, transcript: str, description: str) -> np.ndarray:
+        with stage("audio", "generate"):
+            if self.seconds_per_char:
+                time.sleep(len(transcript) * self.seconds_per_char)
+            digest = hashlib.sha256(f"{description}\n{transcript}".encode()).digest()
+            if self.weights is not None:
+                # Read every weight, as a forward pass would
+                float(self.weights.sum())
+            base_frequency = 110 + digest[0] % 110
+            segments = []
+            for i, word in enumerate(transcript.split() or [""]):
+                duration = self.seconds_per_word * (0.6 + 0.1 * min(len(word), 8))
+                t = np.arange(int(duration * self.sampling_rate), dtype=np.float32) / self.sampling_rate
+                frequency = base_frequency * (1 + (digest[(i + 1) % len(digest)] % 12) / 12)
+                envelope = np.minimum(1.0, np.minimum(t, t[::-1]) * 40)  # 25 ms attack and release
+                segments.append(0.3 * envelope * np.sin(2 * np.pi * frequency * t))
+                if word and word[-1] in ",.!?;:":
+                    segments.append(np.zeros(int(0.15 * self.sampling_rate), dtype=np.float32))
+            return np.concatenate(segments).astype(np.float32)
+
+
+BACKENDS = {
+    ParlerTTSBackend.name: ParlerTTSBackend,
+    SyntheticTTSBackend.name: SyntheticTTSBackend,
+}
+
+_loaded_backends: Dict[str, TTSBackend] = {}
+_backend_lock = threading.Lock()
+
+
+def get_tts_backend(name: Optional[str] = None, quality: str = "final") -> TTSBackend:
+    """
+    Return the loaded backend of the given quality, loading it on first use.
+    Loading the Parler weights takes far longer than most jobs, so the backend is kept for the
+    lifetime of the process; reuse is reported as hits on the "tts_model" cache.
+    """
+    name = name or os.environ.get("ADGEN_TTS_BACKEND", ParlerTTSBackend.name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TTS backend '{name}', expected one of {sorted(BACKENDS)}")
+    if quality not in QUALITIES:
+        raise ValueError(f"Unknown TTS quality '{quality}', expected one of {list(QUALITIES)}")
+    workers = int(os.environ.get("ADGEN_TTS_WORKERS", "0")) if quality == "final" else 0
+    key = f"{name}:pool" if workers > 0 else name if quality == "final" else f"{name}:{quality}"
+    with _backend_lock:
+        backend = _loaded_backends.get(key)
+        if backend is not None:
+            CACHE_REQUESTS.labels(cache="tts_model", result="hit").inc()
+            return backend
+        CACHE_REQUESTS.labels(cache="tts_model", result="miss").inc()
+        if workers > 0:
+            # Imported here to avoid circular imports
+            from utils.tts_integration.tts_pool import PooledTTSBackend
+            backend = PooledTTSBackend(name, workers)
+        else:
+            backend = BACKENDS[name](quality=quality)
+        with stage("audio", "model_load", backend=name, quality=quality):
+            backend.load()
+        _loaded_backends[key] = backend
+        return backend
+
+
+def loaded_tts_backends() -> List[TTSBackend]:
+    with _backend_lock:
+        return list(_loaded_backends.values())
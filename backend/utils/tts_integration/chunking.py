@@ -0,0 +1,71 @@
+"""
+Sub-line chunking of long script lines.
+
+A TTS model generates a line in one autoregressive pass whose time and memory grow faster than the
+line's length, and long lines are the ones that run into the model's maximum generation length.
+Lines longer than max_chars (ADGEN_TTS_CHUNK_MAX_CHARS, default 160, 0 disables chunking) are
+split into chunks of at most max_chars: at sentence ends and ellipses first, then at commas,
+semicolons, colons and dashes, and between words only where a clause is longer than the limit.
+Every chunk is voiced with the line's art direction.
+
+The chunks of a line are synthesized together with synthesize_batch (one batched generate with
+Parler, spread over the workers with a TTS pool), then joined back into one line: each chunk is
+trimmed to pause_ms / 2 of its own silence and consecutive chunks overlap by crossfade_ms.
+"""
+
+import os
+import re
+from typing import List
+
+# Boundaries by preference: sentence ends and ellipses, clause punctuation, any space
+BOUNDARIES = [
+    re.compile(r"(?<=[.!?…])\s+|(?<=\.\.\.)(?=\w)"),
+    re.compile(r"(?<=[,;:–—])\s+|\s+(?=[–—]|--)"),
+    re.compile(r"\s+"),
+]
+
+
+class ChunkSettings:
+    def __init__(self, max_chars: int = 160, crossfade_ms: float = 30.0, pause_ms: float = 120.0):
+        self.max_chars = max_chars
+        self.crossfade_ms = crossfade_ms
+        self.pause_ms = pause_ms
+
+    @classmethod
+    def from_env(cls) -> "ChunkSettings":
+        return cls(
+            max_chars=int(os.environ.get("ADGEN_TTS_CHUNK_MAX_CHARS", "160")),
+            crossfade_ms=float(os.environ.get("ADGEN_TTS_CHUNK_CROSSFADE_MS", "30")),
+            pause_ms=float(os.environ.get("ADGEN_TTS_CHUNK_PAUSE_MS", "120")),
+        )
+
+
+def _pieces(text: str, max_chars: int, level: int = 0) -> List[str]:
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(BOUNDARIES):
+        # A single word longer than the limit
+        return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+    pieces = []
+    for piece in BOUNDARIES[level].split(text):
+        if piece:
+            pieces.extend(_pieces(piece, max_chars, level + 1))
+    return pieces
+
+
+def split_line(text: str, max_chars: int) -> List[str]:
+    """
+    Split a line into chunks of at most max_chars characters at the most natural boundaries available,
+    packing consecutive pieces into a chunk while they fit. Short lines, and any line when max_chars
+    is 0, come back as they are.
+    """
+    text = text.strip()
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+    chunks: List[str] = []
+    for piece in _pieces(text, max_chars):
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
@@ -0,0 +1,33 @@
+"""
+Imported by the TTS pool's fork server (see tts_pool), never by request-serving processes.
+
+Loads the backend named by ADGEN_TTS_PRELOAD_BACKEND (set by the pool in the fork server's environment
+only) once, in the fork server, before any worker exists. Workers are forked from it and use this copy: its weights are shared between all of them
+copy-on-write, and since inference only reads them, each worker adds only its own activations and
+buffers to the host's memory.
+"""
+
+import logging
+import os
+from typing import Optional
+
+from utils.tts_integration.backends import BACKENDS, TTSBackend
+
+
+def _preload() -> Optional[TTSBackend]:
+    name = os.environ.get("ADGEN_TTS_PRELOAD_BACKEND")
+    if not name:
+        return None
+    # Any error here would take the fork server down with it; workers then load their own copy instead
+    try:
+        backend = BACKENDS[name]()
+        if not backend.can_share_weights():
+            return None
+        backend.load()
+        return backend
+    except Exception as e:
+        logging.error(f"Could not preload the {name} TTS backend for its workers: {str(e)}")
+        return None
+
+
+PRELOADED = _preload()
@@ -0,0 +1,186 @@
+"""
+Speculative synthesis of generated scripts (opt-in with ADGEN_SPECULATIVE_TTS=1, local execution mode).
+
+Most users go from a generated script straight to the audio page. With speculation on, a script
+returned by /generate_script or /regenerate_script is synthesized in the background, in the bulk
+lane, into a content-addressed audio cache. When /generate_audio then asks for the same script (same
+lines, TTS backend and post-processing settings), the cached file is published instead of
+synthesizing again, or the request joins the synthesis still in progress.
+
+Background jobs take the TTS slot one line at a time, so other work waits for at most one line; a job
+a request starts waiting on is promoted to that request's lane. A job is cancelled when its script is
+superseded: a newer version of the same stored script, or a different script asked for by the same
+owner. At most max_jobs run at once; a new one evicts the oldest.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.audio_processing.postprocess import AudioPostProcessSettings
+from utils.duration.duration_estimator import tts_backend_name
+from utils.tts_integration.chunking import ChunkSettings
+from utils.job_registry.dispatch import execution_mode
+from utils.observability.metrics import CACHE_REQUESTS, SPECULATIVE_TTS_JOBS
+from utils.scheduling.scheduler import lane_rank
+
+DEFAULT_CACHE_DIR = Path(__file__).parent.parent.parent / "var" / "audio_cache"
+
+
+def speculative_tts_enabled() -> bool:
+    # Jobs run in this process; in distributed mode the TTS model lives in the workers
+    return os.environ.get("ADGEN_SPECULATIVE_TTS", "0").lower() in ("1", "true", "yes", "on") and execution_mode() == "local"
+
+
+def audio_cache_key(script_lines: Sequence[Tuple[str, str]]) -> str:
+    """Everything the synthesized file depends on: the lines, the TTS backend and model, chunking and post-processing."""
+    identity = {
+        "script": [[line, art] for line, art in script_lines],
+        "backend": tts_backend_name(),
+        "model": os.environ.get("ADGEN_TTS_MODEL", ""),
+        "chunking": vars(ChunkSettings.from_env()),
+        "postprocess": vars(AudioPostProcessSettings.from_env()),
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Finished audio as <key>.wav files; beyond max_entries, the least recently used are deleted."""
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 32):
+        self.directory = Path(directory or os.environ.get("ADGEN_AUDIO_CACHE_DIR", str(DEFAULT_CACHE_DIR)))
+        self.max_entries = max(1, max_entries)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}.wav"
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def prune(self):
+        entries = sorted(self.directory.glob("*.wav"), key=lambda path: path.stat().st_mtime)
+        for path in entries[:-self.max_entries]:
+            path.unlink(missing_ok=True)
+
+
+class _Speculation:
+    def __init__(self, owner: str, key: str, script_lines: List[Tuple[str, str]]):
+        self.owner = owner
+        self.key = key
+        self.script_lines = script_lines
+        # Read before every line, so promoting the job takes effect from its next line
+        self.lane = "bulk"
+        self.task: Optional[asyncio.Task] = None
+
+
+class SpeculativeSynthesizer:
+    def __init__(self, cache: AudioCache, max_jobs: int = 2):
+        self.cache = cache
+        self.max_jobs = max(1, max_jobs)
+        # Speculative jobs by owner, oldest first
+        self._jobs: "OrderedDict[str, _Speculation]" = OrderedDict()
+        # Jobs a request is waiting on, by key: no longer speculative, so never cancelled
+        self._claimed: Dict[str, _Speculation] = {}
+
+    def schedule(self, owner: str, script_lines: Sequence[Tuple[str, str]]) -> bool:
+        """Start synthesizing a script in the background, superseding the owner's previous one. Returns whether a job started."""
+        script_lines = [tuple(pair) for pair in script_lines]
+        key = audio_cache_key(script_lines)
+        current = self._jobs.get(owner)
+        if current is not None:
+            if current.key == key:
+                return False
+            self._cancel(current, "superseded")
+        if key in self._claimed or any(job.key == key for job in self._jobs.values()) or self.cache.get(key) is not None:
+            return False
+        while len(self._jobs) >= self.max_jobs:
+            self._cancel(next(iter(self._jobs.values())), "evicted")
+        job = _Speculation(owner, key, script_lines)
+        job.task = asyncio.create_task(self._run(job))
+        self._jobs[owner] = job
+        SPECULATIVE_TTS_JOBS.labels(outcome="started").inc()
+        return True
+
+    def cancel(self, owner: str):
+        """Cancel the owner's speculative job, if any, as superseded."""
+        job = self._jobs.get(owner)
+        if job is not None:
+            self._cancel(job, "superseded")
+
+    def _cancel(self, job: _Speculation, outcome: str):
+        del self._jobs[job.owner]
+        job.task.cancel()
+        SPECULATIVE_TTS_JOBS.labels(outcome=outcome).inc()
+        logging.info(f"Speculative synthesis for {job.owner} {outcome}")
+
+    async def _run(self, job: _Speculation) -> Optional[str]:
+        from utils.tts_integration.tts_integration import generate_audio_from_script
+        try:
+            path = await generate_audio_from_script(
+                job.script_lines, lane="bulk", output_path=str(self.cache.path_for(job.key)), line_lane=lambda: job.lane
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Nothing depends on a speculative job; a request waiting on it synthesizes the script itself
+            SPECULATIVE_TTS_JOBS.labels(outcome="failed").inc()
+            logging.warning(f"Speculative synthesis for {job.owner} failed: {str(e)}")
+            return None
+        finally:
+            if self._jobs.get(job.owner) is job:
+                del self._jobs[job.owner]
+            if self._claimed.get(job.key) is job:
+                del self._claimed[job.key]
+        SPECULATIVE_TTS_JOBS.labels(outcome="completed").inc()
+        await asyncio.to_thread(self.cache.prune)
+        return path
+
+    async def claim(self, owner: Optional[str], script_lines: Sequence[Tuple[str, str]], lane: str) -> Optional[str]:
+        """
+        Path of the speculatively synthesized audio of `script_lines`: from the cache, or from a job still
+        running, which is promoted to `lane` and awaited. On a miss, returns None and cancels the owner's
+        speculation, since the owner has asked for a different script.
+        """
+        key = audio_cache_key([tuple(pair) for pair in script_lines])
+        path = self.cache.get(key)
+        if path is not None:
+            CACHE_REQUESTS.labels(cache="speculative_audio", result="hit").inc()
+            return str(path)
+        job = self._claimed.get(key) or next((job for job in self._jobs.values() if job.key == key), None)
+        if job is not None:
+            CACHE_REQUESTS.labels(cache="speculative_audio", result="in_flight").inc()
+            if self._jobs.get(job.owner) is job:
+                del self._jobs[job.owner]
+                self._claimed[key] = job
+            if lane_rank(lane) < lane_rank(job.lane):
+                job.lane = lane
+            # Shielded: a client that disconnects leaves the job to finish into the cache
+            return await asyncio.shield(job.task)
+        CACHE_REQUESTS.labels(cache="speculative_audio", result="miss").inc()
+        if owner is not None:
+            self.cancel(owner)
+        return None
+
+
+_synthesizer: Optional[SpeculativeSynthesizer] = None
+
+
+def get_speculative_synthesizer() -> SpeculativeSynthesizer:
+    global _synthesizer
+    if _synthesizer is None:
+        _synthesizer = SpeculativeSynthesizer(
+            AudioCache(max_entries=int(os.environ.get("ADGEN_AUDIO_CACHE_MAX_ENTRIES", "32"))),
+            max_jobs=int(os.environ.get("ADGEN_SPECULATIVE_TTS_MAX_JOBS", "2")),
+        )
+    return _synthesizer
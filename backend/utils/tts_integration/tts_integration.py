@@ -1,98 +1,179 @@
+import asyncio
+import logging
 import os
+import re
 import shutil
-from parler_tts import ParlerTTSForConditionalGeneration
-from transformers import AutoTokenizer
-import torch
-import soundfile as sf
-from typing import List, Optional, Tuple
-from pydub import AudioSegment
+import time
+import uuid
+import numpy as np
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+from utils.admission.admission import TTS_GATE
+from utils.audio_processing.postprocess import AudioPostProcessSettings, StreamingAudioWriter, join_chunks, process_line
+from utils.duration.duration_estimator import get_duration_estimator
+from utils.observability.metrics import AUDIO_RENDER_DURATION
+from utils.observability.stages import stage
+from utils.observability.tracing import start_span
+from utils.tts_integration.backends import TTSBackend, get_tts_backend
+from utils.tts_integration.chunking import ChunkSettings, split_line
 
-output_dir = "/home/azureuser/marketing-app-ad-gen/backend/output/"
-result_path = "/home/azureuser/marketing-app-ad-gen/full_script_audio.wav"
+result_path = os.environ.get("ADGEN_AUDIO_RESULT_PATH", "/home/azureuser/marketing-app-ad-gen/full_script_audio.wav")
+# Every job writes <job_id>.wav next to the result path; files older than this are deleted as new jobs run
+AUDIO_RESULT_RETENTION_SECONDS = float(os.environ.get("ADGEN_AUDIO_RESULT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+_JOB_AUDIO_NAME = re.compile(r"^[0-9a-f]{32}\.wav$")
 
 
-async def generate_audio_from_text(model, tokenizer, device, transcript, art_dir, line_num) -> str:
+async def generate_audio_from_text(backend: TTSBackend, transcript, art_dir, line_num, chunking: Optional[ChunkSettings] = None) -> np.ndarray:
     """
-    Generate audio from text using the Parler TTS model.
-    Returns a base64-encoded data URL for the audio.
-    
-    For now, this is a mock implementation since we don't have direct access to the virtual machine.
-    The real implementation would:
-    1. Load the model (using the cache)
-    2. Generate the audio
-    3. Apply any speed/pitch adjustments
-    4. Return the audio as a data URL
+    Generate audio for one script line with the given TTS backend.
+    Synthesis runs in a worker thread so the event loop keeps serving other requests.
+    Long lines are split into chunks that are synthesized as one batch and joined back (see chunking).
+    If the job is cancelled, the line is finished first and the cancellation raised after it.
+    Returns the line's samples at the backend's sampling rate.
     """
-    prompt = transcript
-    description = art_dir
-
-    description_tokenized = tokenizer(
-        text=description,
-        return_tensors="pt",
-    )
-    description_input_ids = description_tokenized.input_ids.to(device)
-    # if you remove this attention mask adn look below
-    description_attn_mask = description_tokenized.attention_mask.to(device)
-
-    prompt_tokenized = tokenizer(
-        text=prompt,
-        return_tensors="pt",
+    chunking = chunking or ChunkSettings.from_env()
+    chunks = split_line(transcript, chunking.max_chars)
+    started = time.perf_counter()
+    with stage("audio", "line_synthesis", line=line_num, chunks=len(chunks)):
+        if len(chunks) == 1:
+            synthesis = asyncio.ensure_future(asyncio.to_thread(backend.synthesize, transcript, art_dir))
+        else:
+            synthesis = asyncio.ensure_future(asyncio.to_thread(backend.synthesize_batch, [(chunk, art_dir) for chunk in chunks]))
+        try:
+            audio_arr = await asyncio.shield(synthesis)
+        except asyncio.CancelledError:
+            # The model call cannot be interrupted: hold the TTS slot until it returns, then stop before the next line
+            await asyncio.wait([synthesis])
+            raise
+    if len(chunks) > 1:
+        with stage("audio", "chunk_join", line=line_num):
+            audio_arr = await asyncio.to_thread(join_chunks, audio_arr, backend.sampling_rate, chunking.crossfade_ms, chunking.pause_ms)
+    logging.info(
+        f"Synthesized line {line_num} in {time.perf_counter() - started:.2f}s: {len(audio_arr) / backend.sampling_rate:.1f}s of audio, "
+        f"{len(transcript)} characters in {len(chunks)} chunk{'s' if len(chunks) > 1 else ''}"
     )
-    prompt_input_ids = prompt_tokenized.input_ids.to(device)
-    prompt_attn_mask = prompt_tokenized.attention_mask.to(device)
 
-    # and remove the setting of the attention mask here, you should see the pad and eos token error
-    print("starting generation")
-    generation = model.generate(input_ids=description_input_ids, prompt_input_ids=prompt_input_ids, attention_mask=description_attn_mask)
-    print("generation done")
-    audio_arr = generation.cpu().numpy().squeeze()
+    # Every synthesized line calibrates the duration estimates for this backend; drafts may pace differently
+    if backend.quality == "final":
+        get_duration_estimator().observe(backend.name, transcript, len(audio_arr) / backend.sampling_rate)
+    return audio_arr
 
-    sf.write(f"{output_dir}line_{line_num}.wav", audio_arr, model.config.sampling_rate)
-    
 
-async def generate_audio_from_script(script_lines: List[Tuple[str, str]]) -> str:
+async def generate_audio_from_script(script_lines: List[Tuple[str, str]], traceparent: Optional[str] = None, lane: str = "standard",
+                                     output_path: Optional[str] = None, line_lane: Optional[Callable[[], str]] = None,
+                                     on_progress: Optional[Callable[[int], Awaitable[None]]] = None, quality: str = "final") -> str:
     """
     Generate audio from a list of script lines and their art directions.
-    This concatenates the lines and generates a single audio file.
+    Each line is post-processed (silence trim, loudness normalization, resampling) as soon as it is
+    synthesized and appended to the output file, so the whole ad is never held in memory.
+    Pass a traceparent to attach the job's spans to a trace when it runs outside the request context.
+    `lane` is the scheduling priority of the job on the TTS gate.
+    The audio is written to `output_path`, by default the result path.
+    With `line_lane`, the TTS slot is taken per line rather than for the whole job, in the lane the
+    callable returns at that moment: background jobs then yield between lines, and can be promoted.
+    Bulk jobs always take it per line (see TTS_GATE).
+    `on_progress` is awaited with the number of lines written: 0 when the job starts, then after each line.
+    Backends that synthesize several lines at once (a TTS worker pool) get up to `concurrency` lines of
+    the job in flight; lines are still written in script order.
+    `quality` selects the full model ("final") or the faster draft model ("preview", see backends).
     """
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    output_path = output_path or result_path
+    if line_lane is None and lane == "bulk":
+        line_lane = lambda: lane
+    with start_span("audio.job", traceparent=traceparent, lines=len(script_lines), lane=lane, quality=quality):
+        async with TTS_GATE.slot("tts", pipeline="audio", lane=lane) if line_lane is None else nullcontext():
+            backend = await asyncio.to_thread(get_tts_backend, None, quality)
+            started = time.perf_counter()
+            settings = AudioPostProcessSettings.from_env()
 
-    model = ParlerTTSForConditionalGeneration.from_pretrained("c0derish/parler-tts-mini-v1-segp-colab").to(device)
-    tokenizer = AutoTokenizer.from_pretrained("c0derish/parler-tts-mini-v1-segp-colab")
-    
-    # make directory for output
-    if os.path.isdir(output_dir):
-        shutil.rmtree(output_dir)
-    os.mkdir(output_dir)
-    
-    for i, pair in enumerate(script_lines):
-        transcript, art_dir = pair
-        await generate_audio_from_text(model, tokenizer, device, transcript, art_dir, i)
-    
-    try:
-        return await merge_audio()
-    finally:
-        shutil.rmtree(output_dir)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            # Write next to the result and rename, so a concurrent job or reader never sees a half-written file
+            partial_path = f"{output_path}.{uuid.uuid4().hex}.partial"
+            chunking = ChunkSettings.from_env()
+            writer = StreamingAudioWriter(partial_path, settings.sample_rate or backend.sampling_rate, settings.gap_ms, settings.crossfade_ms)
+            # Jobs that take the slot per line synthesize one line at a time, so they still yield between lines
+            window = backend.concurrency if line_lane is None else 1
+            in_flight: Deque[asyncio.Future] = deque()
+
+            async def synthesize_line(i: int) -> np.ndarray:
+                transcript, art_dir = script_lines[i]
+                async with TTS_GATE.slot("tts", pipeline="audio", lane=line_lane()) if line_lane else nullcontext():
+                    return await generate_audio_from_text(backend, transcript, art_dir, i, chunking)
+
+            try:
+                if on_progress:
+                    await on_progress(0)
+                for i in range(len(script_lines)):
+                    while len(in_flight) < window and i + len(in_flight) < len(script_lines):
+                        in_flight.append(asyncio.ensure_future(synthesize_line(i + len(in_flight))))
+                    # Removed only once done, so a cancelled job still waits for it below
+                    audio_arr = await in_flight[0]
+                    in_flight.popleft()
+                    with stage("audio", "postprocess", line=i):
+                        processed = await asyncio.to_thread(process_line, audio_arr, backend.sampling_rate, settings)
+                    with stage("audio", "merge", line=i):
+                        await asyncio.to_thread(writer.append, processed)
+                    if on_progress:
+                        await on_progress(i + 1)
+                writer.close()
+                os.replace(partial_path, output_path)
+                AUDIO_RENDER_DURATION.labels(quality=quality).observe(time.perf_counter() - started)
+                return output_path
+            except BaseException:
+                for line in in_flight:
+                    line.cancel()
+                await asyncio.gather(*in_flight, return_exceptions=True)
+                writer.close()
+                os.remove(partial_path)
+                raise
+            finally:
+                await asyncio.to_thread(get_duration_estimator().save)
 
-async def merge_audio():
-    dir = output_dir
-    files = os.listdir(dir)
-    output = AudioSegment.from_file(dir + files[0], format="wav")
-    for i in range(1, len(files)):
-        sound = AudioSegment.from_file(dir + files[i], format="wav")
-        output = output.append(sound, crossfade=0)
-    output.export(result_path, format="wav")
-    return result_path
+def job_result_path(job_id: str) -> str:
+    """Where a job's audio is written in local execution mode, so concurrent jobs never share a file."""
+    return str(Path(result_path).parent / f"{job_id}.wav")
+
+def prune_job_results(older_than_seconds: float = AUDIO_RESULT_RETENTION_SECONDS) -> int:
+    """Delete job audio files older than the given age. Returns the number of files removed."""
+    cutoff = time.time() - older_than_seconds
+    removed = 0
+    for path in Path(result_path).parent.glob("*.wav"):
+        try:
+            if _JOB_AUDIO_NAME.match(path.name) and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def publish_audio(source_path: str, job_id: str) -> str:
+    """
+    Publish finished audio (e.g. from the speculative cache) as the job's own file, atomically.
+    The file is hard-linked rather than copied where the filesystem allows, so publishing is free and
+    the job's file outlives the cache entry.
+    """
+    output_path = job_result_path(job_id)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    partial_path = f"{output_path}.{uuid.uuid4().hex}.partial"
+    try:
+        os.link(source_path, partial_path)
+    except OSError:
+        # Another filesystem, or one without hard links
+        shutil.copyfile(source_path, partial_path)
+    os.replace(partial_path, output_path)
+    return output_path
 
-async def call_parler_tts_api(script: List[Tuple[str]]):
+async def call_parler_tts_api(script: List[Tuple[str]], lane: str = "standard", on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+                              quality: str = "final", line_lane: Optional[Callable[[], str]] = None, output_path: Optional[str] = None):
     """
-    Process an audio request using the Parler TTS model.
+    Process an audio request using the configured TTS backend (Parler TTS by default).
     This is the main entry point from the FastAPI endpoint.
+    Returns the path of the merged audio file, `output_path` when given.
     """
     try:
-        audio_url = await generate_audio_from_script(script)
-        
-        # return audio_url
+        return await generate_audio_from_script(script, lane=lane, output_path=output_path, line_lane=line_lane, on_progress=on_progress, quality=quality)
     except Exception as e:
         print(f"Error in call_parler_tts_api: {str(e)}")
-        raise Exception(f"Failed to generate audio: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Failed to generate audio: {str(e)}")
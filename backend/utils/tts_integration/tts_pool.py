@@ -0,0 +1,224 @@
+"""
+Multi-process TTS: script lines sharded over a pool of worker processes.
+
+Autoregressive decoding keeps only a few cores of a CPU box busy, however many threads torch is
+given, and one process synthesizes one line at a time. With ADGEN_TTS_WORKERS=N, get_tts_backend
+returns a PooledTTSBackend instead: N worker processes each load the backend and synthesize with
+their share of the cores (ADGEN_TTS_THREADS_PER_WORKER, by default cores / N torch threads), so N
+lines are decoded at once.
+
+A job keeps `concurrency` (= N) of its lines in flight and writes them in script order as they come
+back. Lines of concurrent jobs (ADGEN_MAX_TTS_JOBS > 1) share the workers in submission order.
+synthesize_batch shards a batch into contiguous chunks, one per worker, each synthesized as a batch.
+
+The weights are loaded once and shared (ADGEN_TTS_SHARE_WEIGHTS, on by default): workers are forked
+from a fork server that loaded the model before any worker existed (see preload), so N workers cost
+one copy of the weights plus what each allocates while synthesizing. Memory per worker (RSS,
+proportional set size and unique memory, i.e. pages no other process maps) is logged at start and
+exported as adgen_tts_worker_memory_bytes.
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.observability.metrics import TTS_WORKER_MEMORY
+from utils.tts_integration.backends import BACKENDS, TTSBackend
+
+PRELOAD_MODULE = "utils.tts_integration.preload"
+
+# The backend of this worker process
+_worker_backend: Optional[TTSBackend] = None
+
+
+def _init_worker(backend_name: str, threads: int, started):
+    global _worker_backend
+    # Before torch is imported, so its OpenMP and MKL pools start at the worker's size
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+    # Present only in workers forked from the preloading fork server; importing it here would load the model
+    preloaded = getattr(sys.modules.get(PRELOAD_MODULE), "PRELOADED", None)
+    if preloaded is not None and preloaded.name == backend_name:
+        preloaded.set_threads(threads)
+        _worker_backend = preloaded
+    else:
+        backend = BACKENDS[backend_name]()
+        backend.set_threads(threads)
+        backend.load()
+        _worker_backend = backend
+    # Tell the pool which process this is, for its memory reports
+    started.put(os.getpid())
+
+
+def _worker_info() -> Dict[str, object]:
+    return {"sampling_rate": _worker_backend.sampling_rate, "preloaded": _preloaded()}
+
+
+def _synthesize(transcript: str, description: str) -> np.ndarray:
+    return _worker_backend.synthesize(transcript, description)
+
+
+def _synthesize_batch(items: List[Tuple[str, str]]) -> List[np.ndarray]:
+    return _worker_backend.synthesize_batch(items)
+
+
+def _preloaded() -> bool:
+    return _worker_backend is not None and _worker_backend is getattr(sys.modules.get(PRELOAD_MODULE), "PRELOADED", None)
+
+
+@contextmanager
+def _preload_environment(backend_name: str):
+    """Name the backend to preload in the environment the fork server starts with, and only there."""
+    previous = os.environ.get("ADGEN_TTS_PRELOAD_BACKEND")
+    os.environ["ADGEN_TTS_PRELOAD_BACKEND"] = backend_name
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("ADGEN_TTS_PRELOAD_BACKEND", None)
+        else:
+            os.environ["ADGEN_TTS_PRELOAD_BACKEND"] = previous
+
+
+def default_threads_per_worker(workers: int) -> int:
+    threads = int(os.environ.get("ADGEN_TTS_THREADS_PER_WORKER", "0"))
+    return threads or max(1, (os.cpu_count() or 1) // workers)
+
+
+def process_memory(pid: int) -> Optional[Dict[str, int]]:
+    """RSS, proportional set size, unique (private) and shared memory of a process in bytes, from /proc (Linux)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "unique": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+class PooledTTSBackend(TTSBackend):
+    """The `backend_name` backend, run in `workers` processes of `threads_per_worker` torch threads each."""
+
+    def __init__(self, backend_name: str, workers: int, threads_per_worker: Optional[int] = None, share_weights: Optional[bool] = None):
+        self.name = backend_name
+        self.concurrency = max(1, workers)
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(self.concurrency)
+        if share_weights is None:
+            share_weights = os.environ.get("ADGEN_TTS_SHARE_WEIGHTS", "1").lower() in ("1", "true", "yes", "on")
+        self.share_weights = share_weights and "forkserver" in multiprocessing.get_all_start_methods()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._sampling_rate: Optional[int] = None
+        # PIDs reported by the workers of the current pool as they start
+        self._started = None
+        self._worker_pids: List[int] = []
+
+    @property
+    def sampling_rate(self) -> int:
+        return self._sampling_rate
+
+    def _start(self) -> ProcessPoolExecutor:
+        # Workers are never forked from this process: forking one that already runs threads (the event
+        # loop's, torch's) is unsafe. The fork server is single-threaded. It is started here, with the
+        # preload list and the backend to preload in its environment; later subprocesses do not see it.
+        if self.share_weights:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([PRELOAD_MODULE])
+            with _preload_environment(self.name):
+                multiprocessing.forkserver.ensure_running()
+        else:
+            context = multiprocessing.get_context("spawn")
+        self._started = context.Queue()
+        self._worker_pids = []
+        return ProcessPoolExecutor(
+            max_workers=self.concurrency,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.name, self.threads_per_worker, self._started),
+        )
+
+    def load(self):
+        self._executor = self._start()
+        # One call per worker starts them all now, so no request waits for a worker to load the model
+        started = [future.result() for future in [self._executor.submit(_worker_info) for _ in range(self.concurrency)]]
+        self._sampling_rate = started[0]["sampling_rate"]
+        # One worker may have answered several of those calls: wait for every worker to report in
+        self._collect_started(wait_for=self.concurrency)
+        shared = all(info["preloaded"] for info in started)
+        logging.info(
+            f"Started {self.concurrency} {self.name} TTS workers with {self.threads_per_worker} threads each, "
+            f"{'sharing one copy of the weights' if shared else 'each with its own copy of the weights'}"
+        )
+        for worker, memory in self.worker_memory().items():
+            logging.info(f"TTS worker {worker}: {memory['unique'] / 2 ** 20:.0f} MB unique, {memory['pss'] / 2 ** 20:.0f} MB PSS, {memory['rss'] / 2 ** 20:.0f} MB RSS")
+
+    def worker_memory(self) -> Dict[str, Dict[str, int]]:
+        """Memory of each worker process, by worker index."""
+        memory = {}
+        for index, pid in enumerate(self._collect_started()):
+            # None once a worker has exited
+            usage = process_memory(pid)
+            if usage is not None:
+                memory[str(index)] = usage
+        return memory
+
+    def _collect_started(self, wait_for: int = 0, timeout: float = 60.0) -> List[int]:
+        """PIDs of the current pool's workers, waiting up to `timeout` until `wait_for` of them have started."""
+        with self._executor_lock:
+            while self._started is not None:
+                try:
+                    waiting = len(self._worker_pids) < wait_for
+                    self._worker_pids.append(self._started.get(block=waiting, timeout=timeout if waiting else None))
+                except queue.Empty:
+                    break
+            return sorted(self._worker_pids)
+
+    def report_memory(self):
+        """Export the workers' memory as adgen_tts_worker_memory_bytes."""
+        for worker, usage in self.worker_memory().items():
+            for kind in ("rss", "pss", "unique"):
+                TTS_WORKER_MEMORY.labels(backend=self.name, worker=worker, kind=kind).set(usage[kind])
+
+    def _submit(self, fn, *args) -> Future:
+        with self._executor_lock:
+            try:
+                return self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory): replace the pool rather than fail every later job
+                logging.error(f"{self.name} TTS worker pool is broken, restarting it")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._start()
+                return self._executor.submit(fn, *args)
+
+    def synthesize(self, transcript: str, description: str) -> np.ndarray:
+        return self._submit(_synthesize, transcript, description).result()
+
+    def synthesize_batch(self, items: List[Tuple[str, str]]) -> List[np.ndarray]:
+        if not items:
+            return []
+        chunk = -(-len(items) // self.concurrency)
+        futures = [self._submit(_synthesize_batch, items[start:start + chunk]) for start in range(0, len(items), chunk)]
+        return [samples for future in futures for samples in future.result()]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
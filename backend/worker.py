@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Job worker for distributed execution (ADGEN_EXECUTION_MODE=distributed).
+
+Pulls crew and TTS jobs from the shared job registry, runs them with the same code the API uses
+in local mode, and stores results (and audio files, via the artifact store) for the API processes
+to return. Start as many workers as the hardware allows, on any node that can reach the registry
+and artifact store; API processes need no changes to use the extra capacity.
+
+Each worker runs --slots jobs at a time, renews the lease of every job it is running, and
+heartbeats so that API processes can size their Retry-After estimates. A job whose lease cannot be
+renewed (cancelled because its client is gone, or passed to another worker) is stopped: crew
+subprocesses are killed and TTS stops after the current line. On SIGTERM/SIGINT the worker stops
+claiming new jobs and finishes the ones it has.
+
+Usage (from the backend directory):
+    python worker.py --kinds generate_script regenerate_script --slots 4
+    python worker.py --kinds audio --slots 1
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+import socket
+import time
+import uuid
+
+from utils.job_handlers.job_handlers import JOB_HANDLERS
+from utils.job_registry.dispatch import get_registry
+from utils.observability.logging_config import configure_logging
+from utils.observability.metrics import CANCELLATIONS
+from utils.observability.tracing import start_span
+
+
+async def keep_lease(registry, job_id: str, worker_id: str, lease_seconds: float, renew_interval: float):
+    """Renew the job's lease until it is lost. Renewing often is also how a cancelled job is noticed."""
+    while True:
+        await asyncio.sleep(min(lease_seconds / 3, renew_interval))
+        if not await asyncio.to_thread(registry.renew, job_id, worker_id, lease_seconds):
+            logging.warning(f"Lost the lease on job {job_id}")
+            return
+
+
+async def run_job(job):
+    with start_span("worker.job", traceparent=job["traceparent"], kind=job["kind"], job_id=job["id"], lane=job["lane"]):
+        return await JOB_HANDLERS[job["kind"]](job["payload"], job["lane"], job["id"])
+
+
+async def heartbeat(registry, worker_id: str, args, stopping: asyncio.Event):
+    host = socket.gethostname()
+    last_pruned = 0.0
+    while not stopping.is_set():
+        await asyncio.to_thread(registry.heartbeat_worker, worker_id, args.kinds, args.slots, host)
+        if time.monotonic() - last_pruned >= args.prune_interval:
+            # Finished jobs are only kept for ADGEN_JOB_RETENTION_SECONDS; any worker may prune them
+            removed = await asyncio.to_thread(registry.prune)
+            if removed:
+                logging.info(f"Pruned {removed} finished jobs from the registry")
+            last_pruned = time.monotonic()
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=args.heartbeat_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_slot(registry, worker_id: str, args, stopping: asyncio.Event):
+    while not stopping.is_set():
+        job = await asyncio.to_thread(registry.claim, worker_id, args.kinds, args.lease_seconds, args.max_wait)
+        if job is None:
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=args.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        logging.info(f"Running {job['kind']} job {job['id']} ({job['lane']}, attempt {job['attempts']})")
+        work = asyncio.create_task(run_job(job))
+        lease = asyncio.create_task(keep_lease(registry, job["id"], worker_id, args.lease_seconds, args.renew_interval))
+        try:
+            await asyncio.wait([work, lease], return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                logging.info(f"Stopping {job['kind']} job {job['id']}: it was cancelled or is no longer ours")
+                work.cancel()
+                await asyncio.wait([work])
+                CANCELLATIONS.labels(pipeline=job["kind"], reason="registry").inc()
+                continue
+            result = work.result()
+            await asyncio.to_thread(registry.complete, job["id"], worker_id, result)
+        except Exception as e:
+            logging.error(f"{job['kind']} job {job['id']} failed: {str(e)}")
+            await asyncio.to_thread(registry.fail, job["id"], worker_id, str(e))
+        finally:
+            lease.cancel()
+
+
+async def main(args):
+    registry = get_registry()
+    worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    logging.info(f"Worker {worker_id} serving {args.kinds} with {args.slots} slots, registry {registry.path}")
+    try:
+        await asyncio.gather(
+            heartbeat(registry, worker_id, args, stopping),
+            *(run_slot(registry, worker_id, args, stopping) for _ in range(args.slots)),
+        )
+    finally:
+        await asyncio.to_thread(registry.remove_worker, worker_id)
+        logging.info(f"Worker {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull and run crew and TTS jobs from the shared job registry")
+    parser.add_argument("--kinds", nargs="+", choices=sorted(JOB_HANDLERS), default=sorted(JOB_HANDLERS))
+    parser.add_argument("--slots", type=int, default=2, help="Jobs run concurrently by this worker")
+    parser.add_argument("--lease-seconds", type=float, default=60.0)
+    parser.add_argument("--renew-interval", type=float, default=1.0, help="Seconds between lease renewals, i.e. how fast a cancelled job stops")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--heartbeat-interval", type=float, default=10.0)
+    parser.add_argument("--prune-interval", type=float, default=600.0, help="Seconds between deletions of finished jobs past their retention")
+    parser.add_argument("--max-wait", type=float, default=120.0, help="Seconds after which a queued job is claimed before higher lanes")
+    configure_logging()
+    asyncio.run(main(parser.parse_args()))